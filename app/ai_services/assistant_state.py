@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+# Kept next to config.json, one entry per prop name.
+ASSISTANT_STATE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'assistant_state.json'))
+
+
+def instructions_hash(instructions: str, model: str) -> str:
+    """
+    Fingerprints what an assistant was last configured with, a change means it needs an update.
+    """
+    return hashlib.sha256(f"{model}\n{instructions}".encode('utf-8')).hexdigest()
+
+
+class AssistantState:
+    """
+    The assistants the props resolved on earlier runs, so a prop can start talking without
+    asking the api which assistant to use.
+
+    Entries hold the assistant id, the hash of the instructions and model it was configured with
+    and when that was last confirmed with the api. The file is rewritten atomically.
+
+    Args:
+        path (str): The state file, ASSISTANT_STATE_PATH by default.
+    """
+    def __init__(self, path: str = None, logger=None):
+        self.path = path or ASSISTANT_STATE_PATH
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring the unreadable assistant state file {self.path}: {e}")
+            return {}
+
+    def get(self, prop_name: str) -> dict:
+        with self.lock:
+            return dict(self.entries.get(prop_name, {}))
+
+    def put(self, prop_name: str, assistant_id: str, fingerprint: str, model: str, replaces: str = None):
+        """
+        Records the assistant a prop uses and what it is configured with.
+
+        Args:
+            replaces (str): The configured assistant id this assistant stands in for, because it was deleted.
+        """
+        with self.lock:
+            # a replacement keeps standing in until the configured id changes
+            if replaces is None and self.entries.get(prop_name, {}).get("AssistantId") == assistant_id:
+                replaces = self.entries[prop_name].get("Replaces")
+            self.entries[prop_name] = {
+                "AssistantId": assistant_id,
+                "InstructionsHash": fingerprint,
+                "Model": model,
+                "ValidatedAt": datetime.now(timezone.utc).isoformat(timespec='seconds')
+            }
+            if replaces:
+                self.entries[prop_name]["Replaces"] = replaces
+
+            # written under the lock, props saving at the same time would otherwise drop each other's entries
+            try:
+                with open(self.path + '.tmp', 'w') as state_file:
+                    json.dump(self.entries, state_file, indent=4)
+                os.replace(self.path + '.tmp', self.path)
+            except OSError as e:
+                self.logger.warning(f"Failed to save the assistant state to {self.path}: {e}")
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_assistant_state(path: str = None) -> AssistantState:
+    """
+    Returns the one AssistantState for a file, every prop in the process shares it.
+    """
+    path = path or ASSISTANT_STATE_PATH
+    with _shared_lock:
+        if path not in _shared:
+            _shared[path] = AssistantState(path)
+        return _shared[path]
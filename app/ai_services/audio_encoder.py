@@ -0,0 +1,107 @@
+import io
+import time
+import numpy as np
+import soundfile as sf
+
+# file name and mime type sent with each supported upload format
+UPLOAD_FORMATS = {
+    "wav": ("speech.wav", "audio/wav", "WAV", "PCM_16"),
+    "flac": ("speech.flac", "audio/flac", "FLAC", "PCM_16"),
+    "opus": ("speech.ogg", "audio/ogg", "OGG", "OPUS"),
+}
+
+
+class EncodedAudio:
+    """
+    The result of encoding a capture for upload along with the metrics describing the work.
+    """
+    def __init__(self, data: bytes, file_name: str, content_type: str, original_size: int, trimmed_seconds: float, encode_time: float):
+        self.data = data
+        self.file_name = file_name
+        self.content_type = content_type
+        self.original_size = original_size
+        self.trimmed_seconds = trimmed_seconds
+        self.encode_time = encode_time
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def as_stream(self):
+        return io.BytesIO(self.data)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold_db: float = -40.0, padding_ms: int = 250) -> np.ndarray:
+    """
+    Removes leading and trailing silence from a block of samples.
+
+    Silence is any 20ms window whose RMS level is below threshold_db (relative to full scale).
+    A little padding is kept around the speech so the first and last words are not clipped.
+
+    Args:
+        samples (np.ndarray): Mono int16 samples.
+        sample_rate (int): The sample rate of the audio.
+        threshold_db (float): The level below which a window is considered silent.
+        padding_ms (int): Milliseconds of audio kept before and after the detected speech.
+
+    Returns:
+        np.ndarray: The trimmed samples, or the original samples when no speech was found.
+    """
+    window = max(1, int(sample_rate * 0.02))
+    window_count = len(samples) // window
+    if window_count == 0:
+        return samples
+
+    frames = samples[:window_count * window].astype(np.float32).reshape(window_count, window) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    levels = 20 * np.log10(np.maximum(rms, 1e-10))
+    voiced = np.flatnonzero(levels > threshold_db)
+
+    if len(voiced) == 0:
+        return samples
+
+    padding = int(sample_rate * padding_ms / 1000)
+    start = max(0, voiced[0] * window - padding)
+    end = min(len(samples), (voiced[-1] + 1) * window + padding)
+    return samples[start:end]
+
+
+def encode_for_upload(wav_bytes: bytes, upload_format: str = "flac", trim: bool = True, threshold_db: float = -40.0, padding_ms: int = 250) -> EncodedAudio:
+    """
+    Trims and compresses a WAV capture in memory before it is uploaded for transcription.
+
+    Args:
+        wav_bytes (bytes): The captured audio as a WAV file.
+        upload_format (str): wav, flac or opus.
+        trim (bool): Whether to remove leading and trailing silence.
+        threshold_db (float): The silence threshold used when trimming.
+        padding_ms (int): Milliseconds of audio kept around the speech when trimming.
+
+    Returns:
+        EncodedAudio: The encoded payload.
+    """
+    if upload_format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported upload format: {upload_format}")
+
+    start_time = time.time()
+    file_name, content_type, container, subtype = UPLOAD_FORMATS[upload_format]
+
+    samples, sample_rate = sf.read(io.BytesIO(wav_bytes), dtype='int16')
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+
+    original_length = len(samples)
+    if trim:
+        samples = trim_silence(samples, sample_rate, threshold_db, padding_ms)
+
+    output = io.BytesIO()
+    sf.write(output, samples, sample_rate, format=container, subtype=subtype)
+
+    return EncodedAudio(
+        data=output.getvalue(),
+        file_name=file_name,
+        content_type=content_type,
+        original_size=len(wav_bytes),
+        trimmed_seconds=(original_length - len(samples)) / sample_rate,
+        encode_time=time.time() - start_time
+    )
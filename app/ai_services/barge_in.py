@@ -0,0 +1,217 @@
+import io
+import time
+import wave
+import logging
+import threading
+from collections import deque
+import numpy as np
+from app.configuration import merge_defaults
+
+# Defaults for the BargeIn configuration section.
+DEFAULT_BARGE_IN_CONFIG = {
+    "Enabled": False,
+    # how far (dB) a visitor's voice must rise above the prop's own voice picked up by the microphone
+    "EchoMarginDb": 10.0,
+    # quieter sound is never taken for speech, whatever the echo level
+    "MinLevelDb": -45.0,
+    # speech must last this long to interrupt the prop, coughs and clatter are shorter
+    "MinSpeechMs": 300,
+    # the echo level is learned over the start of each line, nobody can interrupt before that
+    "EchoLearnMs": 500,
+    # audio kept from before the interruption was detected, so the visitor's first word is not cut off
+    "PreRollMs": 400
+}
+
+# The microphone is read in 30ms frames of 16kHz mono audio, the format the transcription takes.
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+
+
+def frame_level(frame: bytes) -> float:
+    """
+    Returns the level of a frame of 16 bit audio in dB relative to full scale.
+    """
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    rms = float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+    return 20 * np.log10(max(rms, 1.0) / 32768.0)
+
+
+class EchoGate:
+    """
+    Tells a visitor talking over the prop apart from the prop's own voice coming back through the microphone.
+
+    The level of the echo is learned from the first EchoLearnMs of each line and then follows it
+    slowly, only through frames that are not speech. A frame is speech when it is EchoMarginDb
+    above that level, and MinSpeechMs of speech in a row is an interruption.
+
+    Args:
+        config (dict): The BargeIn configuration section, with the defaults filled in.
+    """
+    def __init__(self, config: dict):
+        self.margin = config["EchoMarginDb"]
+        self.min_level = config["MinLevelDb"]
+        self.learn_frames = max(1, config["EchoLearnMs"] // FRAME_MS)
+        self.speech_frames = max(1, config["MinSpeechMs"] // FRAME_MS)
+        self.echo_level = None
+        self.frames = 0
+        self.speech_run = 0
+
+    @property
+    def threshold(self) -> float:
+        return max(self.min_level, (self.echo_level if self.echo_level is not None else self.min_level) + self.margin)
+
+    def is_speech(self, level: float) -> bool:
+        return level >= self.threshold
+
+    def update(self, level: float) -> bool:
+        """
+        Feeds the level of the next frame, returns True once the visitor has interrupted.
+        """
+        self.frames += 1
+        if self.frames <= self.learn_frames:
+            # the loudest part of the opening words sets the echo level, the prop is talking throughout
+            self.echo_level = level if self.echo_level is None else max(self.echo_level * 0.9 + level * 0.1, level - self.margin / 2)
+            return False
+
+        if self.is_speech(level):
+            self.speech_run += 1
+            return self.speech_run >= self.speech_frames
+
+        self.speech_run = 0
+        self.echo_level = self.echo_level * 0.98 + level * 0.02
+        return False
+
+
+class BargeInMonitor:
+    """
+    Listens while the prop speaks one line, and records the visitor's utterance if they interrupt.
+
+    Args:
+        detector (BargeInDetector): The detector that started the monitor, for its settings and counters.
+        stream: The open PyAudio input stream, closed by the monitor.
+    """
+    def __init__(self, detector, stream):
+        self.detector = detector
+        self.stream = stream
+        self.gate = EchoGate(detector.config)
+        self.interrupted = threading.Event()
+        self.finished = threading.Event()
+        self.interrupted_at = None
+        self.stopping = False
+        self.pre_roll = deque(maxlen=max(1, detector.config["PreRollMs"] // FRAME_MS + self.gate.speech_frames))
+        self.utterance = []
+        self.thread = threading.Thread(target=self._run, name="BargeInMonitor", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        silence_frames = max(1, int(self.detector.pause_threshold * 1000) // FRAME_MS)
+        max_frames = int(self.detector.phrase_time_limit * 1000) // FRAME_MS if self.detector.phrase_time_limit else None
+        silent = 0
+        try:
+            while not self.stopping:
+                frame = self.stream.read(FRAME_SAMPLES, exception_on_overflow=False)
+                level = frame_level(frame)
+                if not self.interrupted.is_set():
+                    self.pre_roll.append(frame)
+                    if self.gate.update(level):
+                        self.interrupted_at = time.time()
+                        self.utterance = list(self.pre_roll)
+                        self.detector.interruptions += 1
+                        self.interrupted.set()
+                    continue
+
+                # the prop has stopped talking, the visitor's utterance ends at the first pause
+                self.utterance.append(frame)
+                silent = 0 if self.gate.is_speech(level) or level >= self.gate.echo_level else silent + 1
+                if silent >= silence_frames or (max_frames and len(self.utterance) >= max_frames):
+                    break
+        except Exception as e:
+            self.detector.logger.warning(f"Listening during playback failed: {str(e)}")
+        finally:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception:
+                pass
+            self.finished.set()
+
+    def stop(self):
+        """
+        Stops listening, the line was played to the end without an interruption.
+        """
+        self.stopping = True
+        self.thread.join(timeout=1.0)
+
+    def wav_bytes(self, timeout: float = None) -> bytes:
+        """
+        Waits for the visitor to finish the utterance that interrupted the prop and returns it as a 16kHz WAV.
+        """
+        self.finished.wait(timeout)
+        self.stopping = True
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(SAMPLE_RATE)
+            wav_file.writeframes(b"".join(self.utterance))
+        return buffer.getvalue()
+
+
+class BargeInDetector:
+    """
+    Keeps the microphone open while the prop speaks, so a visitor can interrupt.
+
+    Args:
+        config (dict): The BargeIn configuration section, missing keys use DEFAULT_BARGE_IN_CONFIG.
+        microphone_index (int): The input device, None uses the default.
+        pause_threshold (float): Seconds of silence that end the visitor's utterance.
+        phrase_time_limit (float): Longest utterance in seconds, None for no limit.
+        logger (Logger): Logger for microphone failures.
+    """
+    def __init__(self, config: dict = None, microphone_index=None, pause_threshold: float = 2.0, phrase_time_limit: float = None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.microphone_index = microphone_index
+        self.pause_threshold = pause_threshold
+        self.phrase_time_limit = phrase_time_limit
+        self._audio = None
+        self.interruptions = 0
+        self.lines = 0
+        self.apply_config(config)
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the BargeIn configuration section, the next line uses it.
+        """
+        self.config = merge_defaults(DEFAULT_BARGE_IN_CONFIG, configuration)
+
+    @property
+    def enabled(self):
+        return self.config["Enabled"]
+
+    def start(self):
+        """
+        Starts listening for a line that is about to play.
+
+        Returns:
+            BargeInMonitor: The monitor for the line, None when the microphone could not be opened.
+        """
+        import pyaudio
+        try:
+            # PortAudio is initialized once, opening a stream on it is quick
+            if self._audio is None:
+                self._audio = pyaudio.PyAudio()
+            stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=SAMPLE_RATE, input=True,
+                                      frames_per_buffer=FRAME_SAMPLES, input_device_index=self.microphone_index)
+        except Exception as e:
+            self.logger.warning(f"Could not open the microphone to listen during playback: {str(e)}")
+            return None
+        self.lines += 1
+        return BargeInMonitor(self, stream)
+
+    def get_status(self):
+        return {
+            'enabled': self.enabled,
+            'lines': self.lines,
+            'interruptions': self.interruptions
+        }
@@ -0,0 +1,144 @@
+import time
+import threading
+from app.configuration import merge_defaults
+
+# Defaults for the Budgets configuration section, all times in seconds.
+DEFAULT_BUDGET_CONFIG = {
+    # from the start of a group's turn until the greeting must be ready
+    "Greeting": 10.0,
+    # for the assistant's reply once the visitor has spoken
+    "Reply": 8.0,
+    # for the transcription of what the visitor said
+    "Transcription": 6.0,
+    # from the speech synthesis request until the first audio arrives
+    "FirstAudio": 3.0,
+    # for any single api request, the sdk defaults wait minutes and retry
+    "Request": 10.0,
+    # consecutive failures that open a service's circuit breaker
+    "BreakerFailures": 3,
+    # seconds an open breaker rejects calls before one call is let through to test the service
+    "BreakerCooldown": 30.0,
+    # lines played from the phrase cache when a stage blows its budget
+    "FallbackLines": {
+        "Greeting": ["Well, well, what do we have here? Come closer, I do not bite... much."],
+        "Reply": ["Hmm, the spirits are muttering in my ear. What was that again?"],
+        "Voice": ["Oh, my voice! The fog has got into my old bones."]
+    }
+}
+
+
+def budget_config(config: dict) -> dict:
+    """
+    Returns the Budgets section of a configuration with the defaults filled in.
+    """
+    return merge_defaults(DEFAULT_BUDGET_CONFIG, (config or {}).get('Budgets'))
+
+
+class BudgetExceeded(TimeoutError):
+    """
+    Raised when a stage of the conversation takes longer than its budget.
+    """
+
+
+class CircuitOpen(RuntimeError):
+    """
+    Raised instead of calling a service whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling an external service after repeated failures, so every visitor does not wait
+    out the same timeout while the service is down.
+
+    After BreakerFailures consecutive failures the breaker opens and calls fail immediately with
+    CircuitOpen. Once the cooldown has passed a single call is let through, its success closes
+    the breaker and its failure opens it for another cooldown.
+
+    Args:
+        name (str): The service name, used in errors and the status.
+        failures (int): Consecutive failures that open the breaker.
+        cooldown (float): Seconds the breaker stays open.
+    """
+    def __init__(self, name: str, failures: int = 3, cooldown: float = 30.0):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        """
+        Raises CircuitOpen when the service should not be called right now.
+        """
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self.trial:
+                self.trial = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(f"The {self.name} circuit breaker is open.")
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release_trial(self):
+        # a trial call that never reached the service, the next call may try again
+        with self.lock:
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.trial or self.consecutive_failures >= self.failures:
+                if self.opened_at is None or self.trial:
+                    self.opened += 1
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls the function through the breaker, exceptions count as failures and are re-raised.
+        """
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except CircuitOpen:
+            # another service's breaker is open, that says nothing about this service
+            self.release_trial()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def apply_config(self, failures: int, cooldown: float):
+        with self.lock:
+            self.failures = failures
+            self.cooldown = cooldown
+
+    def get_status(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'opened': self.opened,
+            'rejected': self.rejected
+        }
@@ -0,0 +1,172 @@
+import base64
+import itertools
+from abc import ABC, abstractmethod
+from typing import Optional
+from app.configuration import merge_defaults
+
+# Defaults for the Conversation configuration section.
+DEFAULT_CONVERSATION_CONFIG = {
+    # assistants | chat
+    "Engine": "assistants",
+    # exchanges the chat engine sends with every request, older ones are dropped, 0 keeps them all
+    "MaxHistoryTurns": 6,
+    # longest answer the chat engine asks for
+    "MaxTokens": 300,
+    # low | high | auto, low sends the image as a single 512px tile
+    "ImageDetail": "low",
+    # the chat engine sends the visitor's image with the greeting only, later turns go on the greeting text
+    "KeepImages": False
+}
+
+
+def conversation_config(config: dict) -> dict:
+    """
+    Returns the Conversation section of a configuration with the defaults filled in.
+    """
+    return merge_defaults(DEFAULT_CONVERSATION_CONFIG, (config or {}).get('Conversation'))
+
+
+class ConversationEngine(ABC):
+    """
+    Base class for the ways a conversation with a visitor is carried on the OpenAI api.
+
+    Every visitor gets a thread from create_thread, each turn is one call to respond with that thread.
+    """
+    name = "base"
+    # the thread and images live on the api, so they can be prepared before the visitor is confirmed
+    remote_history = False
+
+    @abstractmethod
+    def create_thread(self):
+        pass
+
+    def upload_image(self, media: str, media_data: Optional[bytes] = None) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def respond(self, prompt: str, media: Optional[str] = None, media_data: Optional[bytes] = None, thread=None,
+                media_url: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """
+        Sends the visitor's turn and returns the prop's answer.
+
+        Args:
+            prompt (str): The message.
+            media (str): Path of the visitor's image.
+            media_data (bytes): The encoded image, read from the path when not given.
+            thread: The visitor's thread from create_thread.
+            media_url (str): The url of an image that was already uploaded.
+            timeout (float): Seconds the answer may take, BudgetExceeded is raised after that.
+
+        Returns:
+            str: The answer.
+        """
+
+
+class AssistantsEngine(ConversationEngine):
+    """
+    Keeps the conversation in an assistant thread, a turn adds a message, starts a run, polls it
+    and lists the messages. Images are uploaded to blob storage and sent as urls.
+    """
+    name = "assistants"
+    remote_history = True
+
+    def __init__(self, openai_service):
+        self.openai_service = openai_service
+
+    def create_thread(self):
+        return self.openai_service.create_thread()
+
+    def upload_image(self, media: str, media_data: Optional[bytes] = None) -> Optional[str]:
+        return self.openai_service.upload_image(media, media_data)
+
+    def respond(self, prompt: str, media: Optional[str] = None, media_data: Optional[bytes] = None, thread=None,
+                media_url: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        return self.openai_service.generate_assistant_response(prompt, media, media_data, thread=thread, media_url=media_url, timeout=timeout)
+
+
+class ChatHistory:
+    """
+    A conversation kept on the prop: the messages exchanged so far, without the system instructions.
+    """
+    def __init__(self, history_id: str):
+        self.id = history_id
+        self.messages = []
+
+    def compact(self, max_turns: int, keep_images: bool):
+        """
+        Drops the images the model has already answered and the exchanges beyond the last max_turns.
+        """
+        if not keep_images:
+            answered = False
+            for message in reversed(self.messages):
+                if message["role"] == "assistant":
+                    answered = True
+                elif answered and isinstance(message["content"], list):
+                    message["content"] = [part for part in message["content"] if part["type"] == "text"]
+
+        if max_turns and len(self.messages) > max_turns * 2:
+            del self.messages[:-max_turns * 2]
+
+
+class ChatCompletionsEngine(ConversationEngine):
+    """
+    Keeps the conversation on the prop and answers each turn with a single streaming chat
+    completions request. Nothing is created on the api, so a visitor's thread costs no round trip,
+    and images go inline as the capture's JPEG bytes instead of through blob storage.
+
+    Args:
+        openai_service (OpenAIService): Sends the requests with the prop's instructions.
+        config (dict): The Conversation configuration section, missing keys use DEFAULT_CONVERSATION_CONFIG.
+    """
+    name = "chat"
+    remote_history = False
+
+    def __init__(self, openai_service, config: dict = None):
+        self.openai_service = openai_service
+        self.config = merge_defaults(DEFAULT_CONVERSATION_CONFIG, config)
+        self._ids = itertools.count(1)
+
+    def create_thread(self):
+        return ChatHistory(f"chat_{next(self._ids)}")
+
+    def respond(self, prompt: str, media: Optional[str] = None, media_data: Optional[bytes] = None, thread=None,
+                media_url: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        history = thread if thread is not None else self.create_thread()
+
+        content = [{"type": "text", "text": prompt}]
+        if media and media_data is None:
+            with open(media, "rb") as image_file:
+                media_data = image_file.read()
+        if media_data is not None:
+            media_url = f"data:image/jpeg;base64,{base64.b64encode(media_data).decode('utf-8')}"
+        if media_url:
+            content.append({"type": "image_url", "image_url": {"url": media_url, "detail": self.config["ImageDetail"]}})
+
+        # an unanswered message stays in the history, the same as in an assistant thread
+        history.messages.append({"role": "user", "content": content})
+        answer = self.openai_service.generate_chat_response(history.messages, timeout=timeout, max_tokens=self.config["MaxTokens"])
+        history.messages.append({"role": "assistant", "content": answer})
+        history.compact(self.config["MaxHistoryTurns"], self.config["KeepImages"])
+        return answer
+
+
+def create_conversation_engine(config: dict, openai_service, engine: str = None) -> ConversationEngine:
+    """
+    Creates the conversation engine selected in the Conversation configuration section.
+
+    Args:
+        config (dict): The full application configuration.
+        openai_service (OpenAIService): The service the engine sends its requests through.
+        engine (str): Overrides the configured engine name.
+
+    Returns:
+        ConversationEngine: The configured engine.
+    """
+    engine_config = conversation_config(config)
+    engine = engine or engine_config["Engine"]
+
+    if engine == "assistants":
+        return AssistantsEngine(openai_service)
+    elif engine == "chat":
+        return ChatCompletionsEngine(openai_service, engine_config)
+    raise ValueError(f"Unsupported conversation engine: {engine}")
@@ -2,27 +2,87 @@ import os
 import base64
 import time                                       
 import logging 
-from openai import OpenAI
+import threading
+from openai import OpenAI, NotFoundError
 from typing import Optional
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.identity import DefaultAzureCredential
+from app.logging.tracing import get_tracer
+from app.ai_services.budgets import budget_config, BudgetExceeded, CircuitBreaker
+from app.ai_services.assistant_state import shared_assistant_state, instructions_hash
+
+# Used when the App section has no OpenAiModel.
+DEFAULT_ASSISTANT_MODEL = "gpt-4o-mini"
+
+# A run that was cancelled is polled this long for it to stop, the thread rejects new messages until it has.
+RUN_CANCEL_WAIT = 3.0
+RUN_TERMINAL_STATES = ("cancelled", "expired", "failed", "completed", "incomplete")
+
+
 class OpenAIService:
-    def __init__(self, api_key: str = None, config: dict = None, logger=None):
+    def __init__(self, api_key: str = None, config: dict = None, logger=None, assistant_state=None):
         
         self.api_key = api_key or os.getenv("SPOOKYPI_OPENAI_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set and a custom API key was not provided.")
-        self.openai_client = OpenAI(api_key=self.api_key)
+        # an empty base url keeps the sdk default, point it at the mock server for load tests
+        self.base_url = config.get("Endpoints", {}).get("OpenAI") or None
+        self.budgets = budget_config(config)
+        self.openai_client = self._create_client()
+
+        # one breaker per external service, the assistant and transcription share the OpenAI one
+        self.breaker = CircuitBreaker("openai", self.budgets["BreakerFailures"], self.budgets["BreakerCooldown"])
+        self.storage_breaker = CircuitBreaker("storage", self.budgets["BreakerFailures"], self.budgets["BreakerCooldown"])
 
-        self.active_assistant = None
         self.active_thread = None
+        self._container_client = None
         self.prop_config = config["Prop"]
         self.azure_config = config["Azure"]
         self.app_config = config["App"]
         self.logger = logger or logging.getLogger(__name__)
+        self.tracer = get_tracer(__name__)
+
+        # the assistant is resolved from the local state file, the api is only asked by verify_assistant
+        self.assistant_state = assistant_state or shared_assistant_state()
+        self._assistant_ready = threading.Event()
+        self._verify_lock = threading.Lock()
+        self._resolve_assistant()
+
+    def apply_config(self, config: dict, changes: dict):
+        """
+        Applies a changed configuration to the live service.
+
+        Changed prop instructions are picked up by the next message, which updates the assistant once.
+
+        Args:
+            config (dict): The new configuration.
+            changes (dict): The changed keys per section, see app.configuration.diff_config.
+        """
+        self.prop_config = config["Prop"]
+        self.azure_config = config["Azure"]
+        self.app_config = config["App"]
+
+        if changes.get('Azure'):
+            self._container_client = None
+
+        if 'Budgets' in changes:
+            self.budgets = budget_config(config)
+            for breaker in (self.breaker, self.storage_breaker):
+                breaker.apply_config(self.budgets["BreakerFailures"], self.budgets["BreakerCooldown"])
+
+        if 'OpenAI' in changes.get('Keys', set()) or 'OpenAI' in changes.get('Endpoints', set()) or 'Request' in changes.get('Budgets', set()):
+            self.api_key = config['Keys']['OpenAI']
+            self.base_url = config.get("Endpoints", {}).get("OpenAI") or None
+            self.openai_client = self._create_client()
 
-        if self.prop_config["AssistantId"]:
-            self.active_assistant = self.get_assistant(self.prop_config["AssistantId"])
+        assistant_keys = {'AssistantId', 'Name', 'Instructions', 'Description', 'CommunicationAge', 'MaxSentenceCount', 'Backstory'}
+        if changes.get('Prop', set()) & assistant_keys or 'OpenAiModel' in changes.get('App', set()):
+            if 'AssistantId' in changes.get('Prop', set()):
+                self.active_thread = None
+            self._resolve_assistant()
+            self.verify_assistant_async()
+
+    def _create_client(self):
+        # the sdk waits up to ten minutes per request and retries twice, far longer than a visitor waits
+        return OpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.budgets["Request"], max_retries=1)
 
     def generate_response(self, prompt: str, media: Optional[str] = None) -> str:
         
@@ -32,22 +92,87 @@ class OpenAIService:
             messages = [{"role": "user", "content": prompt}]
 
         response = self.openai_client.chat.completions.create(
-            model=self.app_config["OpenAiModel"],
+            model=self.app_config.get("OpenAiModel", DEFAULT_ASSISTANT_MODEL),
             messages=messages,
             max_tokens=300
         )
 
         return response.choices[0].message.content
-    
+
+    def generate_chat_response(self, messages: list, timeout: Optional[float] = None, max_tokens: int = 300) -> str:
+        """
+        Answers a conversation kept on the prop with one streaming chat completions request,
+        the prop's assistant instructions go in as the system message.
+
+        Args:
+            messages (list): The conversation so far, ending with the visitor's message.
+            timeout (float): Seconds the answer may take, the stream is closed and BudgetExceeded is raised after that.
+            max_tokens (int): The longest answer to ask for.
+
+        Returns:
+            str: The answer.
+        """
+        with self.tracer.start_as_current_span("openai.chat_completion", attributes={"messages": len(messages)}):
+            deadline = time.monotonic() + timeout if timeout else None
+            return self.breaker.call(self._stream_chat_response, [{"role": "system", "content": self.instructions}] + messages, deadline, max_tokens)
+
+    def _stream_chat_response(self, messages, deadline, max_tokens):
+        start_time = time.monotonic()
+        client = self.openai_client
+        if deadline is not None:
+            # a stalled stream gives up at the deadline instead of after the full request budget
+            client = client.with_options(timeout=max(0.1, min(self.budgets["Request"], deadline - start_time)))
+
+        stream = client.chat.completions.create(model=self.model, messages=messages, max_tokens=max_tokens, stream=True)
+        parts = []
+        first_token_time = None
+        with stream:
+            for chunk in stream:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise BudgetExceeded("The chat completion did not finish in time.")
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.monotonic() - start_time
+                parts.append(chunk.choices[0].delta.content)
+
+        if not parts:
+            raise ValueError("The chat completion ended without an answer.")
+        self.logger.info(f"Chat completion metrics: first token {first_token_time:.3f}s - total time: {time.monotonic() - start_time:.3f}s")
+        return "".join(parts)
+
     # Encapsulating the entire sequence in a single call.
-    def generate_assistant_response(self, prompt: str, media: Optional[str] = None) -> str:
-        run = self._submit_message_async(prompt, media)
-        message_context = self._get_message_response(run)
+    def generate_assistant_response(self, prompt: str, media: Optional[str] = None, media_data: Optional[bytes] = None, thread=None,
+                                    media_url: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """
+        Sends a message to the assistant and waits for its answer.
+
+        Args:
+            prompt (str): The message.
+            media (str): Path of an image to upload with the message.
+            media_data (bytes): The encoded image, read from the path when not given.
+            thread: The conversation's thread, None uses the shared thread.
+            media_url (str): The url of an image that was already uploaded.
+            timeout (float): Seconds the run may take, it is cancelled and BudgetExceeded is raised after that.
+
+        Returns:
+            str: The assistant's answer.
+        """
+        with self.tracer.start_as_current_span("openai.assistant_run"):
+            deadline = time.monotonic() + timeout if timeout else None
+            # the upload goes through the storage breaker only, a storage outage is not an OpenAI failure
+            if media and not media_url:
+                media_url = self.upload_image(media, media_data)
+            run, thread = self.breaker.call(self._submit_message_async, prompt, thread, media_url)
+            message_context = self.breaker.call(self._get_message_response, run, thread, deadline)
         
+        response = None
         for message in message_context:
             if message.role == "assistant":
                 response = message.content[0].text.value
 
+        if response is None:
+            raise ValueError(f"Run {run.id} completed without an answer.")
         return response
     
     def transcribe_speech_file(self, audio_path: str) -> str:
@@ -55,11 +180,15 @@ class OpenAIService:
         transcription = self.openai_client.audio.transcriptions.create(file=file, model="whisper-1",response_format="text")
         return transcription 
     
-    def transcribe_speech_stream(self, audio_stream):
-        transcription = self.openai_client.audio.transcriptions.create(
-            file=("temp.wav", audio_stream, "audio/wav"),
-            model="whisper-1", 
-            response_format="text")
+    def transcribe_speech_stream(self, audio_stream, file_name: str = "temp.wav", content_type: str = "audio/wav"):
+        # a retried transcription would always be too late, the visitor is waiting for an answer
+        client = self.openai_client.with_options(timeout=self.budgets["Transcription"], max_retries=0)
+        with self.tracer.start_as_current_span("openai.transcription", attributes={"content_type": content_type}):
+            transcription = self.breaker.call(
+                client.audio.transcriptions.create,
+                file=(file_name, audio_stream, content_type),
+                model="whisper-1", 
+                response_format="text")
         return transcription
 
 
@@ -79,55 +208,72 @@ class OpenAIService:
 
         return content
     
-    def _prepare_content_for_assistant(self, prompt: str, media: Optional[str] = None):
-        
-        # Upload the image to azure blob storage and get a URL that can be sent to the api that can be used to access the image
+    def _prepare_content_for_assistant(self, prompt: str, media_url: Optional[str] = None):
+        # the image was uploaded to azure blob storage already, the assistant reads it from the blob url
         content = [{"type": "text", "text": prompt}]
 
-        if media:
-            with open(media, "rb") as image_file:
-                image = image_file.read()
-
-                # Create a BlobServiceClient object
-                blob_service_client = BlobServiceClient.from_connection_string(self.azure_config["StorageConnectionString"])
-
-                # Get a reference to a container
-                container_name = self.azure_config["ContainerName"]
-                container_client = blob_service_client.get_container_client(container_name)
-
-                # Create a blob client using the local file name as the name for the blob
-                blob_client = container_client.get_blob_client(os.path.basename(media))
-                blob_client.upload_blob(image, overwrite=True)
-                blob_url = blob_client.url
-                            
+        if media_url:
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": blob_url
+                    "url": media_url
                 }
             })
 
         return content
+
+    def upload_image(self, media: str, media_data: Optional[bytes] = None) -> str:
+        """
+        Uploads an image to the storage container so the assistant can look at it.
+
+        Args:
+            media (str): The image path, its file name is the blob name.
+            media_data (bytes): The encoded image, read from the path when not given.
+
+        Returns:
+            str: The blob url.
+        """
+        if media_data is None:
+            with open(media, "rb") as image_file:
+                media_data = image_file.read()
+
+        # Create a blob client using the local file name as the name for the blob
+        with self.tracer.start_as_current_span("openai.blob_upload", attributes={"bytes": len(media_data)}):
+            blob_client = self._get_container_client().get_blob_client(os.path.basename(media))
+            self.storage_breaker.call(blob_client.upload_blob, media_data, overwrite=True, timeout=int(self.budgets["Request"]))
+            return blob_client.url
+
+    def _get_container_client(self):
+        # kept for the life of the service so uploads reuse the storage connection
+        if self._container_client is None:
+            # the storage sdk is only loaded once an image is uploaded
+            from azure.storage.blob import BlobServiceClient
+            blob_service_client = BlobServiceClient.from_connection_string(self.azure_config["StorageConnectionString"])
+            self._container_client = blob_service_client.get_container_client(self.azure_config["ContainerName"])
+        return self._container_client
     
-    def _submit_message_async(self, prompt: str, media: Optional[str] = None):
-        asst_id = self.prop_config.get("AssistantId", None)
-        self._create_assistant(assistant_id=asst_id)
-        self._create_thread()
+    def _submit_message_async(self, prompt: str, thread=None, media_url: Optional[str] = None):
+        assistant_id = self._require_assistant()
+
+        # conversations with their own thread pass it in, everything else shares the active thread
+        if thread is None:
+            self._create_thread()
+            thread = self.active_thread
 
         # create message
-        self.openai_client.beta.threads.messages.create(self.active_thread.id, role="user", content=self._prepare_content_for_assistant(prompt, media))
+        self.openai_client.beta.threads.messages.create(thread.id, role="user", content=self._prepare_content_for_assistant(prompt, media_url))
 
         # create run
         run = self.openai_client.beta.threads.runs.create(
-            thread_id=self.active_thread.id,
-            assistant_id=self.active_assistant.id,
+            thread_id=thread.id,
+            assistant_id=assistant_id,
         )
 
-        return run
+        return run, thread
     
-    def _get_message_response(self, run):
-        run = self._wait_on_run(run, self.active_thread)
-        return self.openai_client.beta.threads.messages.list(thread_id=self.active_thread.id, order="asc")
+    def _get_message_response(self, run, thread, deadline=None):
+        run = self._wait_on_run(run, thread, deadline)
+        return self.openai_client.beta.threads.messages.list(thread_id=thread.id, order="asc")
         
     def _create_thread(self):
         if self.active_thread:
@@ -135,57 +281,134 @@ class OpenAIService:
 
         self.active_thread = self.openai_client.beta.threads.create()
 
-    def _create_assistant(self, assistant_id: Optional[str] = None):
-        
-        assistant_instructions = self.prop_config["Instructions"].format(
+    def create_thread(self):
+        """
+        Creates a new conversation thread that is not shared with anyone else.
+        """
+        return self.openai_client.beta.threads.create()
+
+    def _assistant_instructions(self):
+        return self.prop_config["Instructions"].format(
             self.prop_config['Description'],
             self.prop_config['CommunicationAge'],
             self.prop_config['MaxSentenceCount'],
             self.prop_config['Backstory']
         )
-        
-        if self.active_assistant:
-            if self.active_assistant.id == assistant_id and self.active_assistant.instructions == assistant_instructions:
-                self.logger.info("Using existing assistant")
-                return self.active_assistant
-            else:
-                self.logger.info("Updating existing assistant")
-                self.active_assistant = self._update_assistant(assistant_id, assistant_instructions)
-                self.logger.info(f"Assistant {assistant_id} is now configured with the following instructions:\n{assistant_instructions}")
+
+    def _resolve_assistant(self):
+        """
+        Picks the assistant to use from the configuration and the state file, without any api call.
+
+        A configured AssistantId always wins, without one the assistant created on an earlier run
+        is used. The assistant is trusted right away when the state file says it was configured with
+        the current instructions and model, otherwise it is used once verify_assistant has checked it.
+        """
+        self.instructions = self._assistant_instructions()
+        self.model = self.app_config.get("OpenAiModel", DEFAULT_ASSISTANT_MODEL)
+        self.fingerprint = instructions_hash(self.instructions, self.model)
+
+        entry = self.assistant_state.get(self.prop_config["Name"])
+        configured_id = self.prop_config.get("AssistantId") or None
+        # a configured assistant that was deleted is replaced, the replacement is remembered in the state file
+        if configured_id and entry.get("Replaces") != configured_id:
+            self.assistant_id = configured_id
         else:
-            # This whole scenario is VERY unlikely, but we need to handle it.
-            if assistant_id:
-                # fetch this assistant from the api and just assume it's not the same (update it).
-                self.active_assistant = self._update_assistant(assistant_id, assistant_instructions)       
-                self.logger.warning(f"Assistant {assistant_id} exists, but is not active.  Updating instructions and activating.")
-                self.logger.info(f"Assistant {assistant_id} is now configured with the following instructions:\n{assistant_instructions}")
-            else:
-                self.logger.warning(f"Creating an assistant from scratch, this is unexpected.")
-                # we don't even know what is going on, create the new one from the data provided.
-                self.active_assistant = self.openai_client.beta.assistants.create(
-                    display_name=self.prop_config["Name"],
-                    description=self.prop_config["Description"],
-                    instructions=assistant_instructions,
-                    model=self.app_config["OpenAiModel"]
-                )
-                self.logger.info(f"Assistant {assistant_id} is now set as the active assistant and configured with the following instructions:\n{assistant_instructions} ")
-    
-    def _update_assistant(self, assistant_id, instructions):
-        # don't waste time calling the api if the current assistant already has the same instructions.
-        current_assistant = self.active_assistant
-        if current_assistant.instructions == instructions:
-            return current_assistant
+            self.assistant_id = entry.get("AssistantId")
+        self.assistant_verified = bool(self.assistant_id) and entry.get("AssistantId") == self.assistant_id and entry.get("InstructionsHash") == self.fingerprint
+
+        if self.assistant_id:
+            self._assistant_ready.set()
         else:
-            return self.openai_client.beta.assistants.update(assistant_id, instructions=instructions,model="gpt-4o-mini")
+            self._assistant_ready.clear()
+
+    def _require_assistant(self) -> str:
+        # only the very first run of a prop without any assistant waits for one to be created
+        if not self._assistant_ready.is_set():
+            self.verify_assistant_async()
+            if not self._assistant_ready.wait(timeout=self.budgets["Request"]):
+                raise BudgetExceeded("The assistant is still being created.")
+        return self.assistant_id
+
+    def verify_assistant_async(self):
+        """
+        Checks the assistant on a background thread, see verify_assistant.
+        """
+        threading.Thread(target=self.verify_assistant, name="VerifyAssistant", daemon=True).start()
 
-    def _wait_on_run(self, run, thread):
+    def verify_assistant(self):
+        """
+        Makes sure the assistant exists and has the current instructions and model, then records it in the state file.
+
+        An assistant the state file already vouches for costs one retrieve call, a changed one is
+        updated and a prop without any assistant gets one created. Failures are logged and the prop
+        keeps using the assistant it resolved at startup.
+        """
+        with self._verify_lock:
+            assistant_id, fingerprint = self.assistant_id, self.fingerprint
+            replaces = None
+            try:
+                assistant = None
+                if assistant_id:
+                    try:
+                        assistant = self.get_assistant(assistant_id)
+                    except NotFoundError:
+                        self.logger.error(f"Assistant {assistant_id} no longer exists, creating a replacement.")
+                        replaces = self.prop_config.get("AssistantId") or None
+
+                if assistant is None:
+                    self.logger.warning("No usable assistant is configured, creating one.")
+                    assistant = self.openai_client.beta.assistants.create(
+                        name=self.prop_config["Name"],
+                        description=self.prop_config["Description"],
+                        instructions=self.instructions,
+                        model=self.model
+                    )
+                elif assistant.instructions != self.instructions or assistant.model != self.model:
+                    self.logger.info(f"Updating assistant {assistant.id} with the current instructions and model {self.model}.")
+                    assistant = self.openai_client.beta.assistants.update(assistant.id, instructions=self.instructions, model=self.model)
+                else:
+                    self.logger.info(f"Assistant {assistant.id} is up to date.")
+            except Exception as e:
+                self.logger.warning(f"Could not verify the assistant, using {assistant_id or 'none'} as resolved at startup: {str(e)}")
+                return
+
+            # the configuration may have changed while the api was busy, the next check picks that up
+            if fingerprint != self.fingerprint:
+                return
+            self.assistant_id = assistant.id
+            self.assistant_verified = True
+            self.assistant_state.put(self.prop_config["Name"], assistant.id, fingerprint, self.model, replaces)
+            self._assistant_ready.set()
+
+    def _wait_on_run(self, run, thread, deadline=None):
         while run.status == "queued" or run.status == "in_progress":
+            if deadline is not None and time.monotonic() >= deadline:
+                self._cancel_run(run, thread)
+                raise BudgetExceeded(f"Run {run.id} did not finish in time.")
+
             run = self.openai_client.beta.threads.runs.retrieve(
                 thread_id=thread.id,
                 run_id=run.id,
             )
-            time.sleep(0.5)
+            if run.status == "queued" or run.status == "in_progress":
+                time.sleep(0.5 if deadline is None else max(0.0, min(0.5, deadline - time.monotonic())))
+
+        if run.status != "completed":
+            raise RuntimeError(f"Run {run.id} ended with status {run.status}.")
         return run
+
+    def _cancel_run(self, run, thread):
+        # a cancelled run stops using tokens, the thread takes new messages again once it has stopped
+        try:
+            run = self.openai_client.beta.threads.runs.cancel(thread_id=thread.id, run_id=run.id)
+            give_up = time.monotonic() + RUN_CANCEL_WAIT
+            while run.status not in RUN_TERMINAL_STATES and time.monotonic() < give_up:
+                time.sleep(0.2)
+                run = self.openai_client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+            if run.status not in RUN_TERMINAL_STATES:
+                self.logger.warning(f"Run {run.id} was still {run.status} {RUN_CANCEL_WAIT}s after it was cancelled.")
+        except Exception as e:
+            self.logger.warning(f"Failed to cancel run {run.id}: {str(e)}")
     
     def get_assistants(self):
         return self.openai_client.beta.assistants.list()
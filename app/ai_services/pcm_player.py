@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import itertools
+import threading
+from functools import lru_cache
+from app.logging.latency_report import StreamingHistogram
+from app.configuration import merge_defaults
+
+# Defaults for the Playback configuration section.
+DEFAULT_PLAYBACK_CONFIG = {
+    # 16000 | 22050 | 24000 | 44100, the rate the speech synthesis sends raw PCM at (44100 needs a Pro plan)
+    "SampleRate": 22050,
+    # audio collected before playback starts, and again after the stream ran dry, so a late chunk does not cut a word
+    "JitterBufferMs": 100,
+    # audio written to the device at a time, an interruption stops playback within a block
+    "BlockMs": 20
+}
+
+SUPPORTED_SAMPLE_RATES = (16000, 22050, 24000, 44100)
+
+# ElevenLabs PCM is 16 bit mono.
+SAMPLE_WIDTH = 2
+
+# Audio files the player can decode, cached phrases are wav and the bundled lines mp3.
+SUPPORTED_FILE_EXTENSIONS = ('.wav', '.mp3')
+
+
+@lru_cache(maxsize=32)
+def decode_file(path: str, sample_rate: int, modified: float = None) -> bytes:
+    """
+    Decodes an audio file to 16 bit mono PCM at the sample rate, the few lines that play from files stay decoded.
+
+    Args:
+        path (str): A wav or mp3 file.
+        sample_rate (int): The rate the player's stream is open at.
+        modified (float): The file's modification time, a rewritten file is decoded again.
+
+    Returns:
+        bytes: The raw PCM.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SUPPORTED_FILE_EXTENSIONS:
+        raise ValueError(f"Unsupported file extension: {extension}")
+
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path, format=extension[1:])
+    return audio.set_channels(1).set_frame_rate(sample_rate).set_sample_width(SAMPLE_WIDTH).raw_data
+
+
+class PcmPlayer:
+    """
+    Plays streamed speech through one PyAudio output stream that stays open between lines, so a
+    line starts without spawning a player process or decoding mp3.
+
+    Chunks go through a small jitter buffer: playback starts once JitterBufferMs has arrived, and
+    when the device plays out everything before the next chunk arrives that is counted as an
+    underrun and the buffer fills up again before playback resumes.
+
+    Args:
+        config (dict): The Playback configuration section, missing keys use DEFAULT_PLAYBACK_CONFIG.
+        output_device_index (int): The output device, None plays through the system default.
+        logger (Logger): Logger for device failures.
+    """
+    def __init__(self, config: dict = None, output_device_index=None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.output_device_index = output_device_index
+        self._audio = None
+        self._stream = None
+        self._lock = threading.Lock()
+        self.lines = 0
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+        # from the synthesis request to the first samples handed to the device
+        self.first_sample = StreamingHistogram()
+        # when the last line started playing, wall clock time for the time to first audio report
+        self.last_first_sample_at = None
+        self.apply_config(config)
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the Playback configuration section, a new sample rate reopens the stream for the next line.
+        """
+        playback_config = merge_defaults(DEFAULT_PLAYBACK_CONFIG, configuration)
+        if playback_config["SampleRate"] not in SUPPORTED_SAMPLE_RATES:
+            raise ValueError(f"Unsupported playback sample rate: {playback_config['SampleRate']}")
+
+        with self._lock:
+            if self._stream is not None and playback_config["SampleRate"] != self.config["SampleRate"]:
+                self._close_stream()
+            self.config = playback_config
+
+    def set_output_device(self, output_device_index):
+        with self._lock:
+            if output_device_index != self.output_device_index:
+                self._close_stream()
+                self.output_device_index = output_device_index
+
+    @property
+    def sample_rate(self) -> int:
+        return self.config["SampleRate"]
+
+    @property
+    def output_format(self) -> str:
+        return f"pcm_{self.sample_rate}"
+
+    def _block_bytes(self) -> int:
+        return max(1, self.sample_rate * self.config["BlockMs"] // 1000) * SAMPLE_WIDTH
+
+    def _open_stream(self):
+        if self._stream is None:
+            import pyaudio
+            if self._audio is None:
+                self._audio = pyaudio.PyAudio()
+            self._stream = self._audio.open(format=pyaudio.paInt16,
+                                            channels=1,
+                                            rate=self.sample_rate,
+                                            output=True,
+                                            frames_per_buffer=self._block_bytes() // SAMPLE_WIDTH,
+                                            output_device_index=self.output_device_index)
+        elif self._stream.is_stopped():
+            self._stream.start_stream()
+        return self._stream
+
+    def _close_stream(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+
+    def close(self):
+        with self._lock:
+            self._close_stream()
+            if self._audio is not None:
+                self._audio.terminate()
+                self._audio = None
+
+    def record_first_sample(self, seconds: float):
+        self.first_sample.add(seconds)
+        self.last_first_sample_at = time.time()
+
+    def play_file(self, path: str, interrupted: threading.Event = None) -> bool:
+        """
+        Plays a wav or mp3 file through the same output stream as the streamed speech.
+
+        Returns:
+            bool: True when the playback was interrupted.
+        """
+        pcm = decode_file(os.path.abspath(path), self.sample_rate, os.path.getmtime(path))
+        return self.play([pcm], None, interrupted)
+
+    def play(self, chunks, requested_at: float, interrupted: threading.Event = None) -> bool:
+        """
+        Plays 16 bit mono PCM chunks at the configured sample rate as they arrive.
+
+        Args:
+            chunks (iterable): The audio, chunk boundaries do not have to fall on a sample.
+            requested_at (float): time.perf_counter() when the synthesis was requested, for the time to first sample.
+                None for audio that was not synthesized, it is left out of the time to first sample.
+            interrupted (Event): Playback stops as soon as it is set.
+
+        Returns:
+            bool: True when the playback was interrupted.
+        """
+        interrupted = interrupted or threading.Event()
+        bytes_per_second = self.sample_rate * SAMPLE_WIDTH
+        prebuffer = bytes_per_second * self.config["JitterBufferMs"] // 1000
+        block = self._block_bytes()
+
+        with self._lock:
+            self.lines += 1
+            self.last_first_sample_at = None
+            stream = self._open_stream()
+            pending = bytearray()
+            # when the device finishes the audio written so far, None while the buffer fills
+            played_until = None
+            first_write = True
+            try:
+                # None marks the end of the stream, what is left plays even when it is less than the jitter buffer
+                for chunk in itertools.chain(chunks, [None]):
+                    if interrupted.is_set():
+                        break
+                    now = time.perf_counter()
+                    if played_until is not None and now > played_until:
+                        self.underruns += 1
+                        self.underrun_seconds += now - played_until
+                        played_until = None
+
+                    if chunk is not None:
+                        pending += chunk
+                        if played_until is None and len(pending) < prebuffer:
+                            continue
+
+                    offset = 0
+                    end = len(pending) - len(pending) % SAMPLE_WIDTH
+                    while offset < end and not interrupted.is_set():
+                        data = bytes(pending[offset:min(offset + block, end)])
+                        stream.write(data)
+                        now = time.perf_counter()
+                        if first_write:
+                            first_write = False
+                            if requested_at is not None:
+                                self.record_first_sample(now - requested_at)
+                            else:
+                                self.last_first_sample_at = time.time()
+                        played_until = max(played_until or now, now) + len(data) / bytes_per_second
+                        offset += len(data)
+                    del pending[:offset]
+
+                # stopping waits for the device to play what is still buffered, at most a few blocks
+                stream.stop_stream()
+            except Exception:
+                self._close_stream()
+                raise
+        return interrupted.is_set()
+
+    def get_status(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'lines': self.lines,
+            'underruns': self.underruns,
+            'underrun_seconds': round(self.underrun_seconds, 3),
+            'first_sample_p50_seconds': round(self.first_sample.percentile(50) or 0.0, 3),
+            'first_sample_p99_seconds': round(self.first_sample.percentile(99) or 0.0, 3)
+        }
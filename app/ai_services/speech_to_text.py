@@ -0,0 +1,169 @@
+import io
+import os
+from abc import ABC, abstractmethod
+import time
+import logging
+import numpy as np
+import soundfile as sf
+from app.ai_services.audio_encoder import encode_for_upload
+from app.configuration import merge_defaults
+
+# Defaults for the SpeechToText configuration section.
+DEFAULT_STT_CONFIG = {
+    # openai | local | local_fallback
+    "Backend": "openai",
+    # Whisper model name (tiny.en, base.en, ...) or the path to a checkpoint file.
+    "LocalModel": "tiny.en",
+    # Directory the local model is loaded from (and downloaded to when missing).
+    "LocalModelPath": "app/ai_services/models",
+    "Language": "en",
+    # In local_fallback mode, transcriptions with an average log probability below this value go to the cloud.
+    "FallbackMinLogProb": -1.0,
+    # Codec used for cloud uploads: wav | flac | opus
+    "UploadFormat": "flac",
+    # Trim leading and trailing silence before uploading.
+    "TrimSilence": True,
+    "SilenceThresholdDb": -40.0,
+    "SilencePaddingMs": 250
+}
+
+
+class SpeechToTextBackend(ABC):
+    """
+    Base class for the speech-to-text engines used by the VoiceService.
+
+    Implementations receive a complete 16kHz WAV capture and return the transcribed text.
+    """
+    name = "base"
+
+    @abstractmethod
+    def transcribe(self, wav_bytes: bytes) -> str:
+        pass
+
+
+class OpenAISpeechToText(SpeechToTextBackend):
+    """
+    Sends the capture to OpenAI's whisper-1 model through the OpenAIService.
+
+    The capture is trimmed and compressed in memory first, the uplink is usually the slowest part of the trip.
+    """
+    name = "openai"
+
+    def __init__(self, openai_service, logger=None, stt_config: dict = None):
+        self.openai_service = openai_service
+        self.logger = logger or logging.getLogger(__name__)
+        self.stt_config = merge_defaults(DEFAULT_STT_CONFIG, stt_config)
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        try:
+            encoded = encode_for_upload(
+                wav_bytes,
+                upload_format=self.stt_config["UploadFormat"],
+                trim=self.stt_config["TrimSilence"],
+                threshold_db=self.stt_config["SilenceThresholdDb"],
+                padding_ms=self.stt_config["SilencePaddingMs"]
+            )
+        except Exception as e:
+            self.logger.exception(f"Failed to encode audio for upload, sending the raw capture: {str(e)}", exc_info=e)
+            return self.openai_service.transcribe_speech_stream(io.BytesIO(wav_bytes))
+
+        self.logger.info(f"Upload Metrics: {encoded.size} bytes ({encoded.original_size} raw, {encoded.file_name}) - "
+                         f"trimmed: {encoded.trimmed_seconds:.2f}s - encode time: {encoded.encode_time:.3f}")
+
+        return self.openai_service.transcribe_speech_stream(encoded.as_stream(), encoded.file_name, encoded.content_type)
+
+
+class LocalSpeechToText(SpeechToTextBackend):
+    """
+    Runs a small whisper model on the CPU, the model is loaded once from disk at startup.
+    """
+    name = "local"
+
+    def __init__(self, model: str, model_path: str, language: str = "en", logger=None):
+        # whisper pulls in torch, only pay for that import when the local engine is selected.
+        import whisper
+
+        self.logger = logger or logging.getLogger(__name__)
+        self.language = language or None
+        self.last_avg_logprob = None
+
+        start_time = time.time()
+        self.model = whisper.load_model(model, device="cpu", download_root=model_path)
+        self.logger.info(f"Loaded local speech model {model} in {time.time() - start_time:.2f}s")
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        audio, sample_rate = sf.read(io.BytesIO(wav_bytes), dtype='float32')
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        if sample_rate != 16000:
+            # whisper expects 16kHz mono, resample with a simple linear interpolation
+            target_length = int(len(audio) * 16000 / sample_rate)
+            audio = np.interp(np.linspace(0, len(audio), target_length, endpoint=False), np.arange(len(audio)), audio).astype(np.float32)
+
+        result = self.model.transcribe(audio, language=self.language, fp16=False)
+
+        segments = result.get("segments") or []
+        if segments:
+            self.last_avg_logprob = sum(segment["avg_logprob"] for segment in segments) / len(segments)
+        else:
+            self.last_avg_logprob = None
+
+        return result.get("text", "").strip()
+
+
+class FallbackSpeechToText(SpeechToTextBackend):
+    """
+    Tries the local engine first and falls back to the cloud when it fails or is unsure of the result.
+    """
+    name = "local_fallback"
+
+    def __init__(self, local: LocalSpeechToText, cloud: SpeechToTextBackend, min_avg_logprob: float = -1.0, logger=None):
+        self.local = local
+        self.cloud = cloud
+        self.min_avg_logprob = min_avg_logprob
+        self.logger = logger or logging.getLogger(__name__)
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        try:
+            text = self.local.transcribe(wav_bytes)
+            confidence = self.local.last_avg_logprob
+            if text and (confidence is None or confidence >= self.min_avg_logprob):
+                return text
+            self.logger.info(f"Local transcription was not confident enough (avg logprob: {confidence}), falling back to {self.cloud.name}.")
+        except Exception as e:
+            self.logger.exception(f"Local transcription failed, falling back to {self.cloud.name}: {str(e)}", exc_info=e)
+
+        return self.cloud.transcribe(wav_bytes)
+
+
+def create_speech_to_text(config: dict, openai_service=None, logger=None, backend: str = None) -> SpeechToTextBackend:
+    """
+    Creates the speech-to-text backend selected in the SpeechToText configuration section.
+
+    Args:
+        config (dict): The full application configuration.
+        openai_service (OpenAIService): The service used by the cloud backend.
+        logger (logging.Logger): The logger to use.
+        backend (str): Overrides the configured backend name.
+
+    Returns:
+        SpeechToTextBackend: The configured backend.
+    """
+    stt_config = merge_defaults(DEFAULT_STT_CONFIG, config.get("SpeechToText"))
+    backend = backend or stt_config["Backend"]
+    logger = logger or logging.getLogger(__name__)
+
+    if backend == "openai":
+        return OpenAISpeechToText(openai_service, logger, stt_config)
+
+    model_path = stt_config["LocalModelPath"]
+    if not os.path.isabs(model_path):
+        model_path = os.path.join(os.path.dirname(__file__), '..', '..', model_path)
+
+    local = LocalSpeechToText(stt_config["LocalModel"], os.path.abspath(model_path), stt_config["Language"], logger)
+    if backend == "local":
+        return local
+    elif backend == "local_fallback":
+        return FallbackSpeechToText(local, OpenAISpeechToText(openai_service, logger, stt_config), stt_config["FallbackMinLogProb"], logger)
+
+    raise ValueError(f"Unsupported speech to text backend: {backend}")
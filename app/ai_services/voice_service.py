@@ -1,73 +1,281 @@
 import json, uuid 
 import time
-from elevenlabs import ElevenLabs, play, stream 
-import speech_recognition as sr
+import hashlib
 import logging
-import numpy as np
-import soundfile as sf
 import io 
 import os
-import pyaudio
-from pydub import AudioSegment
+import queue
+import threading
+from app.ai_services.speech_to_text import create_speech_to_text
+from app.ai_services.budgets import budget_config, BudgetExceeded, CircuitBreaker
+from app.ai_services.barge_in import BargeInDetector
+from app.ai_services.pcm_player import PcmPlayer, SUPPORTED_FILE_EXTENSIONS
+from app.logging.tracing import get_tracer
+
+# Lines synthesized ahead of time, keyed by voice, model and text.
+PHRASE_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'resources', 'phrases')
 
 class VoiceService:
-    def __init__(self, config_path, logger=None, openai_service=None):
-        with open(config_path, 'r') as config_file:
-            config = json.load(config_file)
+    def __init__(self, config_path, logger=None, openai_service=None, config=None, speech_to_text=None):
+        # callers that already parsed the configuration can pass it in to avoid reading the file again
+        if config is None:
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file)
         self.speech_key = config["Azure"]["SpeechKey"]
         self.api_key = config['Keys']['ElevenLabs']
+        self.base_url = config.get('Endpoints', {}).get('ElevenLabs') or None
         self.speech_loc = config["Azure"]["SpeechLocation"]
+        self._client = None
+        self.captures_path = config_path.replace("config.json", "logs/captures/")
+        self.logger = logger or logging.getLogger(__name__)
+        self.tracer = get_tracer(__name__)
+        self.openai_service = openai_service
+        self.budgets = budget_config(config)
+        self.breaker = CircuitBreaker("elevenlabs", self.budgets["BreakerFailures"], self.budgets["BreakerCooldown"])
+        # when the last line started playing, read by the time to first audio report
+        self.last_first_audio_at = None
+
+        audio_path = os.path.join(os.path.dirname(__file__), 'silent_wav_3.wav')
+
+        self._apply_audio_settings(config)
+
+        # one output stream for every streamed line, opened with the first one
+        self.player = PcmPlayer(config.get('Playback'), self.output_device_index, self.logger)
+
+        # listens while the prop speaks, the utterance of a visitor who interrupted waits here for the next listen
+        self.barge_in = BargeInDetector(config.get('BargeIn'), self.microphone_index, self.pause_threshold, self.speaker_time_limit, self.logger)
+        self.pending_interruption = None
+
+        # the engine used to turn the captured audio into text, it can be shared between services
+        self.speech_to_text = speech_to_text or create_speech_to_text(config, openai_service, self.logger)
+
+    @property
+    def client(self):
+        # the ElevenLabs sdk is slow to import, it is loaded the first time the prop speaks
+        if self._client is None:
+            from elevenlabs import ElevenLabs
+            self._client = ElevenLabs(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    def _apply_audio_settings(self, config):
         self.voice = config['Prop']['Voice']
         self.model = config['App']['ElevenModel']
-        self.client = ElevenLabs(api_key=self.api_key)
         self.pause_threshold = config['App']['MaxSilenceDuration']
         self.audio_timeout = config['App']['AudioTimeout']
-        self.captures_path = config_path.replace("config.json", "logs/captures/")
         self.listen_delay = config['App']['ListenDelay'] or 1
-        self.logger = logger or logging.getLogger(__name__)
-        self.openai_service = openai_service
         self.speaker_time_limit = config['App']['SpeakerTimeLimit'] or None
 
-        audio_path = os.path.join(os.path.dirname(__file__), 'silent_wav_3.wav')
-
         # default microphone index, consider making this a configuration option.
         self.microphone_index = config['App']['AudioInputDeviceIndex'] 
+        # None plays through the system default output device
+        self.output_device_index = config['App'].get('AudioOutputDeviceIndex')
         if(self.audio_timeout <= 0):
             self.audio_timeout = None
 
-        if(self.speaker_time_limit <= 0):
+        if(self.speaker_time_limit is not None and self.speaker_time_limit <= 0):
             self.speaker_time_limit = None
 
+    def apply_config(self, config, changes):
+        """
+        Applies a changed configuration without reopening anything that did not change.
+
+        Args:
+            config (dict): The new configuration.
+            changes (dict): The changed keys per section, see app.configuration.diff_config.
+        """
+        self._apply_audio_settings(config)
+        self.barge_in.microphone_index = self.microphone_index
+        self.barge_in.pause_threshold = self.pause_threshold
+        self.barge_in.phrase_time_limit = self.speaker_time_limit
+        self.player.set_output_device(self.output_device_index)
+
+        if 'Playback' in changes:
+            self.player.apply_config(config.get('Playback'))
+
+        if 'BargeIn' in changes:
+            self.barge_in.apply_config(config.get('BargeIn'))
+
+        if 'Budgets' in changes:
+            self.budgets = budget_config(config)
+            self.breaker.apply_config(self.budgets["BreakerFailures"], self.budgets["BreakerCooldown"])
+
+        if 'ElevenLabs' in changes.get('Keys', set()) or 'ElevenLabs' in changes.get('Endpoints', set()):
+            self.api_key = config['Keys']['ElevenLabs']
+            self.base_url = config.get('Endpoints', {}).get('ElevenLabs') or None
+            self._client = None
+
+        if 'SpeechToText' in changes:
+            # only a backend change reloads the local model
+            self.speech_to_text = create_speech_to_text(config, self.openai_service, self.logger)
+
     def generate_audio(self, text:str):
+        self.last_first_audio_at = None
         try:
-            audio_content = self.client.generate(
-                text=text,
-                voice=self.voice,
-                model=self.model
-            )
+            requested_at = time.perf_counter()
+            with self.tracer.start_as_current_span("tts.synthesis"):
+                audio_content = b"".join(self.client.generate(
+                    text=text,
+                    voice=self.voice,
+                    model=self.model,
+                    output_format=self.player.output_format
+                ))
 
-            play(audio_content)
+            with self.tracer.start_as_current_span("audio.playback"):
+                self.player.play([audio_content], requested_at)
+            self.last_first_audio_at = self.player.last_first_sample_at
 
         except Exception as e:
             self.logger.exception(f"Failed to generate audio: {str(e)}", exc_info=e)
 
-    def generate_streaming_audio(self, text:str):
+    def generate_streaming_audio(self, text:str) -> bool:
+        """
+        Synthesizes and plays a line as it streams in.
+
+        The audio arrives as raw PCM and is written straight to the player's output stream. Playback
+        only starts once the first audio has arrived, when it does not arrive within the FirstAudio
+        budget nothing is played.
+
+        With BargeIn enabled the microphone stays open while the line plays. A visitor who talks over
+        the prop stops the playback and the rest of the synthesis, and the next listen picks up what they said.
+
+        Returns:
+            bool: True when the line was played, False when synthesis failed or was too slow.
+        """
+        self._discard_interruption()
+        self.last_first_audio_at = None
         try:
-            audio_content = self.client.generate(
-                text=text,
-                voice=self.voice,
-                model=self.model,
-                stream=True
-            )
+            with self.tracer.start_as_current_span("audio.playback", attributes={"characters": len(text)}) as span:
+                self.breaker.before_call()
+                requested_at = time.perf_counter()
+                audio_content = self.client.generate(
+                    text=text,
+                    voice=self.voice,
+                    model=self.model,
+                    stream=True,
+                    output_format=self.player.output_format
+                )
 
-            stream(audio_content)
+                chunks = self._first_audio_within(self._trace_first_chunk(audio_content), self.budgets["FirstAudio"])
+                monitor = self.barge_in.start() if self.barge_in.enabled else None
+                underruns = self.player.underruns
+                try:
+                    interrupted = self.player.play(chunks, requested_at, monitor.interrupted if monitor else None)
+                except Exception:
+                    if monitor:
+                        monitor.stop()
+                    raise
+                finally:
+                    # closing the stream abandons the rest of the synthesis request
+                    chunks.close()
+                self.last_first_audio_at = self.player.last_first_sample_at
+                span.set_attribute("underruns", self.player.underruns - underruns)
+                if interrupted:
+                    span.set_attribute("interrupted", True)
+                    # the visitor can talk before the jitter buffer filled, nothing had played yet
+                    played = max(0.0, monitor.interrupted_at - self.last_first_audio_at) if self.last_first_audio_at is not None else 0.0
+                    self.logger.info(f"Visitor interrupted the line after {played:.2f}s of playback.")
+                    self.pending_interruption = monitor
+                elif monitor:
+                    monitor.stop()
+            return True
 
         except Exception as e:
             self.logger.exception(f"Failed to generate audio: {str(e)}", exc_info=e)
+            return False
+
+    def _first_audio_within(self, audio_stream, timeout):
+        """
+        Reads the stream on a background thread and waits at most timeout seconds for the first chunk.
+
+        Raises BudgetExceeded when the first chunk is late, the request is abandoned and the player
+        is never started. A stream that stalls for as long later on is cut short.
+        """
+        chunks = queue.Queue()
+        abandoned = threading.Event()
+
+        def pump():
+            try:
+                for chunk in audio_stream:
+                    if abandoned.is_set():
+                        return
+                    chunks.put(chunk)
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+
+        threading.Thread(target=pump, name="AudioPrefetch", daemon=True).start()
+
+        def next_chunk():
+            try:
+                chunk = chunks.get(timeout=timeout)
+            except queue.Empty:
+                abandoned.set()
+                raise BudgetExceeded(f"No audio within {timeout}s.")
+            if isinstance(chunk, Exception):
+                raise chunk
+            return chunk
+
+        try:
+            first = next_chunk()
+            if first is None:
+                raise ValueError("The speech synthesis returned no audio.")
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        def remaining():
+            try:
+                yield first
+                while True:
+                    try:
+                        chunk = next_chunk()
+                    except BudgetExceeded:
+                        self.logger.warning("The speech synthesis stalled, the rest of the line is skipped.")
+                        return
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                # the player stopped early, the pump drops the rest of the stream
+                abandoned.set()
+
+        return remaining()
+
+    def _discard_interruption(self):
+        # an interruption nobody listened to, the prop moved on to another line
+        if self.pending_interruption is not None:
+            self.pending_interruption.stop()
+            self.pending_interruption = None
+
+    def _trace_first_chunk(self, audio_stream):
+        # the request is only sent once the generator is consumed, so time to first byte is measured from here.
+        first_byte_span = self.tracer.start_span("tts.first_byte")
+        waiting = True
+        try:
+            for chunk in audio_stream:
+                if waiting:
+                    first_byte_span.end()
+                    waiting = False
+                yield chunk
+        finally:
+            if waiting:
+                first_byte_span.end()
 
     def listen_for_response_openai(self):
+        import speech_recognition as sr
          # use sr to listen for user response
-        try:            
+        try:
+            if self.pending_interruption is not None:
+                # the visitor talked over the last line, their utterance has been recording since
+                monitor, self.pending_interruption = self.pending_interruption, None
+                start_time = monitor.interrupted_at
+                with self.tracer.start_as_current_span("voice.listen", attributes={"barge_in": True}):
+                    wav_bytes = monitor.wav_bytes(timeout=(self.speaker_time_limit or 30) + self.pause_threshold)
+                listen_complete_time = time.time()
+                self.logger.info(f"Interrupting response captured at {listen_complete_time} - recording time: {listen_complete_time - start_time}")
+                return self._transcribe(wav_bytes, start_time, listen_complete_time)
+
             rec = sr.Recognizer()
             rec.pause_threshold = self.pause_threshold
         
@@ -83,7 +291,8 @@ class VoiceService:
                 self.logger.info(f"Listening for user response at {start_time}...")
 
                 # Listen for the audio
-                audio = rec.listen(source, timeout=self.audio_timeout, phrase_time_limit=self.speaker_time_limit)
+                with self.tracer.start_as_current_span("voice.listen"):
+                    audio = rec.listen(source, timeout=self.audio_timeout, phrase_time_limit=self.speaker_time_limit)
                 
                 # Log timings
                 listen_complete_time = time.time()
@@ -91,15 +300,9 @@ class VoiceService:
                 
                 # Convert the audio to text
                 wav_bytes = audio.get_wav_data(convert_rate=16000)
-                wav_stream = io.BytesIO(wav_bytes)
                 
                 # now send it off for transcription
-                user_response = self.openai_service.transcribe_speech_stream(wav_stream)
-
-                self.logger.info(f"User response: {user_response}")
-                self.logger.info(f"Transciption Metrics: {time.time() - listen_complete_time} - total time: {time.time() - start_time}")
-                
-                return user_response
+                return self._transcribe(wav_bytes, start_time, listen_complete_time)
         except sr.UnknownValueError:
             self.logger.exception("Whisper could not understand audio")
             return "*silence*"
@@ -110,37 +313,72 @@ class VoiceService:
             self.logger.exception(f"Failed to capture user response: {str(ex)}", exc_info=ex)
             return "*silence*"
 
+    def _transcribe(self, wav_bytes, start_time, listen_complete_time):
+        with self.tracer.start_as_current_span("voice.transcription", attributes={"backend": self.speech_to_text.name}):
+            user_response = self.speech_to_text.transcribe(wav_bytes)
+
+        self.logger.info(f"User response: {user_response}")
+        self.logger.info(f"Transciption Metrics: {time.time() - listen_complete_time} - total time: {time.time() - start_time} - backend: {self.speech_to_text.name}")
+
+        return user_response
+
+    def cache_phrase(self, text: str) -> str:
+        """
+        Synthesizes a line once and keeps it on disk, so it plays without waiting on text to speech.
+
+        Args:
+            text (str): The line to synthesize.
+
+        Returns:
+            str: The path of the cached wav file.
+        """
+        path = self._phrase_path(text)
+        if os.path.exists(path):
+            return path
+
+        from pydub import AudioSegment
+        os.makedirs(PHRASE_CACHE_DIR, exist_ok=True)
+        audio = b"".join(self.client.generate(text=text, voice=self.voice, model=self.model))
+        # converted once here, play_audio_from_file only resamples the wav to the player's rate
+        AudioSegment.from_mp3(io.BytesIO(audio)).set_channels(1).set_frame_rate(44100).set_sample_width(2).export(path + '.tmp', format='wav')
+        os.replace(path + '.tmp', path)
+        return path
+
+    def play_phrase(self, text: str) -> bool:
+        """
+        Plays a cached line, lines that are not cached yet are streamed.
+
+        Returns:
+            bool: True when the line was played.
+        """
+        if self.has_phrase(text):
+            with self.tracer.start_as_current_span("audio.playback", attributes={"characters": len(text), "cached": True}):
+                self.play_audio_from_file(self._phrase_path(text))
+            return True
+        return self.generate_streaming_audio(text)
+
+    def has_phrase(self, text: str) -> bool:
+        return os.path.exists(self._phrase_path(text))
+
+    def _phrase_path(self, text: str) -> str:
+        key = hashlib.sha1(f"{self.voice}|{self.model}|{text}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(PHRASE_CACHE_DIR, f"{key}.wav")
+
     def play_listening_message(self):
         self.play_audio_from_file(os.path.join(os.path.dirname(__file__), 'resources/listening.mp3'))
     
     def play_audio_from_file(self, file_path):
         print(f"Playing file at path: {file_path}")
+        self._discard_interruption()
+        self.last_first_audio_at = None
 
-        # look at the extension of the file to determine how to play it or covert it to a format that can be played
+        # wav and mp3 files are decoded to PCM and played through the player's stream, no second output is opened
         file_extension = os.path.splitext(file_path)[1].lower()
-
-        if file_extension == '.wav':
-            # WAV files can be played directly
-            pass
-        elif file_extension == '.mp3':
-            # Convert MP3 to WAV using pydub
-            audio = AudioSegment.from_mp3(file_path)
-            file_path = file_path.replace('.mp3', '.wav')
-            audio.export(file_path, format='wav')
-        else:
+        if file_extension not in SUPPORTED_FILE_EXTENSIONS:
             raise ValueError(f"Unsupported file extension: {file_extension}")
 
         try:
-            with sf.SoundFile(file_path) as f:
-                p = pyaudio.PyAudio()
-                stream = p.open(format=pyaudio.paInt16,
-                                channels=1,
-                                rate=44100,
-                                output=True)
-                data = f.read(dtype='int16')
-                stream.write(data.tobytes())
-                stream.stop_stream()
-                stream.close()
-                p.terminate()
+            self.player.play_file(file_path)
+            self.last_first_audio_at = self.player.last_first_sample_at
         except Exception as e:
             self.logger.exception(f"Failed to play audio from file: {str(e)}", exc_info=e)
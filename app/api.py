@@ -1,9 +1,230 @@
 # app/api.py
 
-from fastapi import FastAPI
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 
-app = FastAPI()
 
-@app.get("/", tags=["root"])
-async def read_root() -> dict:
-    return {"message": "Welcome to your Spooky API!"}
\ No newline at end of file
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SpookyPi loads the YOLO network and talks to OpenAI, build it when the server starts rather than at import time.
+    # create_app builds a PropOrchestrator instead when several props are configured, both have the same control interface.
+    from main import create_app
+    from app.logging import startup_profile
+    app.state.spooky_pi = await run_in_threadpool(create_app)
+    startup_profile.finish_profiling("Host startup")
+    yield
+    if app.state.spooky_pi.running:
+        await run_in_threadpool(app.state.spooky_pi.stop)
+
+
+app = FastAPI(lifespan=lifespan)
+
+CONTROL_PAGE = '''
+<!DOCTYPE html>
+<html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+        <link href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css" rel="stylesheet">
+        <title>Spooky Season Control</title>
+    </head>
+    <body class="container">
+        <div class="row justify-content-center">
+            <div class="col-md-6 col-sm-8 col-12 text-center">
+                <h1 class="my-4">Spooky Season Control</h1>
+                <button id="start" class="btn btn-success btn-lg btn-block" onclick="control('start')">Start</button>
+                <button id="stop" class="btn btn-danger btn-lg btn-block" onclick="control('stop')">Stop</button>
+                <p id="status" class="my-3 text-muted"></p>
+                <img id="preview" class="img-fluid" alt="Live preview" style="display: none">
+                <button class="btn btn-secondary btn-sm my-2" onclick="togglePreview()">Toggle preview</button>
+            </div>
+        </div>
+        <script>
+            async function control(action) {
+                await fetch('/' + action, {method: 'POST'});
+                refresh();
+            }
+            function togglePreview() {
+                const preview = document.getElementById('preview');
+                const visible = preview.style.display !== 'none';
+                preview.src = visible ? '' : '/preview.mjpeg';
+                preview.style.display = visible ? 'none' : 'block';
+            }
+            async function refresh() {
+                const status = await (await fetch('/status')).json();
+                document.getElementById('start').style.display = status.running ? 'none' : 'block';
+                document.getElementById('stop').style.display = status.running ? 'block' : 'none';
+                const conversation = status.conversation.active ? (status.conversation.listening ? 'listening' : 'talking') : 'idle';
+                document.getElementById('status').innerText =
+                    `${status.detector.fps} fps - ${status.detector.tracked_objects.length} tracked - ${conversation}`;
+            }
+            refresh();
+            setInterval(refresh, 2000);
+        </script>
+    </body>
+</html>
+'''
+
+
+@app.get("/", tags=["root"], response_class=HTMLResponse)
+async def read_root() -> str:
+    return CONTROL_PAGE
+
+
+@app.post("/start", tags=["control"])
+async def start(request: Request) -> dict:
+    spooky_pi = request.app.state.spooky_pi
+    if not spooky_pi.running:
+        # detection runs on its own thread, but starting it opens the camera
+        await run_in_threadpool(spooky_pi.start)
+    return {"running": spooky_pi.running}
+
+
+@app.post("/stop", tags=["control"])
+async def stop(request: Request) -> dict:
+    spooky_pi = request.app.state.spooky_pi
+    if spooky_pi.running:
+        # stopping joins the detector thread, keep it off the event loop
+        await run_in_threadpool(spooky_pi.stop)
+    return {"running": spooky_pi.running}
+
+
+@app.post("/config/reload", tags=["control"])
+async def reload_config(request: Request) -> dict:
+    # re-reads config.json and applies only what changed, the detector keeps running
+    changes = await run_in_threadpool(request.app.state.spooky_pi.reload_config)
+    return {"changed": {section: sorted(keys) for section, keys in changes.items()}}
+
+
+@app.get("/status", tags=["status"])
+async def status(request: Request) -> dict:
+    return request.app.state.spooky_pi.get_status()
+
+
+@app.get("/metrics", tags=["status"], response_class=PlainTextResponse)
+async def metrics(request: Request) -> str:
+    spooky_pi = request.app.state.spooky_pi
+    state = spooky_pi.get_status()
+    detector = state['detector']
+    preview = spooky_pi.object_detector.preview
+
+    # Prometheus text exposition format
+    values = [
+        ("spookypi_running", "gauge", int(state['running'])),
+        ("spookypi_detector_fps", "gauge", detector['fps']),
+        ("spookypi_detector_frames_total", "counter", detector['frames']),
+        ("spookypi_detector_inference_seconds", "gauge", detector['inference_seconds']),
+        ("spookypi_tracked_objects", "gauge", len(detector['tracked_objects'])),
+        ("spookypi_conversation_active", "gauge", int(state['conversation']['active'])),
+        ("spookypi_conversation_listening", "gauge", int(state['conversation']['listening'])),
+        ("spookypi_conversation_exchanges", "gauge", state['conversation']['exchange_count']),
+        ("spookypi_captures_evicted_total", "counter", state['captures_evicted']),
+        ("spookypi_detection_log_dropped_total", "counter", state['detection_log_dropped']),
+        ("spookypi_log_records_dropped_total", "counter", state['log_records_dropped']),
+        ("spookypi_preview_viewers", "gauge", preview.viewers),
+        ("spookypi_event_subscribers", "gauge", state['event_subscribers']),
+        ("spookypi_events_published_total", "counter", spooky_pi.events.published),
+        ("spookypi_preview_frames_encoded_total", "counter", preview.frames_encoded),
+    ]
+
+    # a single prop tracks its sessions, revisits, speculation, playback and budgets, several props report per prop
+    if 'sessions' in state:
+        values += [
+            ("spookypi_sessions_waiting", "gauge", state['sessions']['waiting']),
+            ("spookypi_sessions_completed_total", "counter", state['sessions']['completed']),
+            ("spookypi_sessions_cancelled_total", "counter", state['sessions']['cancelled']),
+            ("spookypi_session_queue_wait_seconds", "gauge", state['sessions']['mean_queue_wait_seconds']),
+            ("spookypi_sessions_per_hour", "gauge", state['sessions']['sessions_per_hour']),
+            ("spookypi_returning_visitors_total", "counter", state['revisits']['returning']),
+            ("spookypi_duplicate_detections_total", "counter", state['revisits']['duplicates']),
+            ("spookypi_api_calls_saved_total", "counter", state['revisits']['api_calls_saved']),
+            ("spookypi_visitor_lookup_seconds", "gauge", state['revisits']['mean_lookup_ms'] / 1000),
+            ("spookypi_speculation_hits_total", "counter", state['speculation']['hits']),
+            ("spookypi_speculation_misses_total", "counter", state['speculation']['misses']),
+            ("spookypi_speculation_wasted_api_calls_total", "counter", state['speculation']['wasted_api_calls']),
+            ("spookypi_speculation_saved_seconds_total", "counter", state['speculation']['saved_seconds']),
+            ("spookypi_barge_ins_total", "counter", state['barge_in']['interruptions']),
+            ("spookypi_playback_underruns_total", "counter", state['playback']['underruns']),
+            ("spookypi_playback_underrun_seconds_total", "counter", state['playback']['underrun_seconds']),
+            ("spookypi_first_sample_p50_seconds", "gauge", state['playback']['first_sample_p50_seconds']),
+            ("spookypi_first_sample_p99_seconds", "gauge", state['playback']['first_sample_p99_seconds']),
+            ("spookypi_greeting_first_audio_p99_seconds", "gauge", state['budgets']['first_audio']['greeting']['p99_seconds']),
+            ("spookypi_reply_first_audio_p99_seconds", "gauge", state['budgets']['first_audio']['reply']['p99_seconds']),
+            ("spookypi_fallbacks_total", "counter", sum(state['budgets']['fallbacks'].values())),
+            ("spookypi_open_circuit_breakers", "gauge", sum(1 for breaker in state['budgets']['breakers'].values() if breaker['state'] != 'closed')),
+        ]
+    else:
+        values += [
+            ("spookypi_visitors_total", "counter", state['visitors']),
+            ("spookypi_api_calls_per_visitor", "gauge", state['api_calls_per_visitor']),
+            ("spookypi_fallbacks_total", "counter", sum(state['fallbacks'].values())),
+        ]
+
+    lines = []
+    for name, metric_type, value in values:
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/preview.mjpeg", tags=["status"])
+async def preview(request: Request):
+    broadcaster = request.app.state.spooky_pi.object_detector.preview
+
+    async def frames():
+        broadcaster.add_viewer()
+        last_sequence = -1
+        try:
+            while not await request.is_disconnected():
+                if broadcaster.sequence != last_sequence and broadcaster.jpeg is not None:
+                    # every viewer sends the same encoded bytes
+                    last_sequence = broadcaster.sequence
+                    jpeg = broadcaster.jpeg
+                    yield b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n"
+                await asyncio.sleep(broadcaster.interval / 2)
+        finally:
+            broadcaster.remove_viewer()
+
+    return StreamingResponse(frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+
+
+@app.get("/events", tags=["events"])
+async def events(request: Request):
+    # Server-sent events, one message per detection or conversation event
+    broadcaster = request.app.state.spooky_pi.events
+    subscription = broadcaster.subscribe()
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    batch = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # keep the connection alive through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in batch:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket):
+    broadcaster = websocket.app.state.spooky_pi.events
+    await websocket.accept()
+    subscription = broadcaster.subscribe()
+    try:
+        while True:
+            for event in await subscription.get():
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(subscription)
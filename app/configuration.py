@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import logging
+import threading
+
+
+def load_config(config_path: str) -> dict:
+    with open(config_path, 'r') as config_file:
+        return json.load(config_file)
+
+
+def merge_defaults(defaults: dict, section: dict = None) -> dict:
+    """
+    Fills in the defaults of a configuration section.
+
+    Args:
+        defaults (dict): The section's DEFAULT_*_CONFIG.
+        section (dict): The section as configured, None when it is missing.
+
+    Returns:
+        dict: A new dict, the configured values override the defaults.
+    """
+    merged = dict(defaults)
+    merged.update(section or {})
+    return merged
+
+
+def diff_config(old: dict, new: dict) -> dict:
+    """
+    Compares two configurations section by section.
+
+    Args:
+        old (dict): The configuration currently in use.
+        new (dict): The configuration to compare it with.
+
+    Returns:
+        dict: The names of the changed keys for each section that changed, e.g. {"Detection": {"IouThreshold"}}.
+    """
+    changes = {}
+    for section in set(old) | set(new):
+        old_section = old.get(section)
+        new_section = new.get(section)
+        if old_section == new_section:
+            continue
+
+        if isinstance(old_section, dict) and isinstance(new_section, dict):
+            changes[section] = {key for key in set(old_section) | set(new_section) if old_section.get(key) != new_section.get(key)}
+        else:
+            changes[section] = set(new_section) if isinstance(new_section, dict) else {section}
+    return changes
+
+
+class ConfigWatcher:
+    """
+    Polls the configuration file and calls back when it changes.
+
+    Polling the modification time keeps this dependency free, a check every couple of seconds costs nothing.
+    """
+    def __init__(self, config_path: str, on_change, interval: float = 2.0, logger=None):
+        self.config_path = config_path
+        self.on_change = on_change
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._last_mtime = self._get_mtime()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            mtime = self._get_mtime()
+            if mtime is None or mtime == self._last_mtime:
+                continue
+            self._last_mtime = mtime
+
+            # editors often write the file in several steps, give it a moment to settle
+            time.sleep(0.2)
+            try:
+                new_config = load_config(self.config_path)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Ignoring configuration change, the file could not be read: {str(e)}")
+                continue
+
+            try:
+                self.on_change(new_config)
+            except Exception as e:
+                self.logger.exception(f"Failed to apply the configuration change: {str(e)}", exc_info=e)
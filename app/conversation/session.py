@@ -0,0 +1,177 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConversationSession:
+    """
+    The conversation with one group of visitors: their detection, their conversation engine and thread and how far along they are.
+    """
+    def __init__(self, data: dict, capture):
+        self.object_id = data['object_id']
+        self.class_name = data['class_name']
+        self.data = data
+        self.capture = capture
+
+        self.engine = None
+        self.thread = None
+        self.greeting = None
+        self.exchange_count = 0
+        self.listening = False
+        # the visitor index entry for the group, kept up to date with the session's state
+        self.record = None
+        self.state = 'queued'
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        if self.record is not None:
+            self.record.update(self)
+
+    @property
+    def queue_wait(self):
+        return (self.started_at or time.time()) - self.created_at
+
+    def end(self):
+        self.state = 'ended'
+        self.listening = False
+
+
+class SessionManager:
+    """
+    Creates a session for every group that arrives and runs them one at a time on the prop,
+    while the API work for the groups still waiting runs concurrently on a worker pool.
+
+    The next group's greeting is written (thread created, image uploaded, assistant run) while the
+    current group is finishing up, so it is ready the moment they get their turn.
+
+    Args:
+        prepare (callable): Called on the worker pool with a session, returns the greeting.
+        run (callable): Called on the stage thread with a session once its turn comes.
+        workers (int): Size of the worker pool.
+        max_queued (int): Groups waiting beyond this are turned away.
+        max_wait (float): Seconds a group may wait before their session is dropped.
+    """
+    def __init__(self, prepare, run, workers: int = 2, max_queued: int = 3, max_wait: float = 60.0, logger=None):
+        self.prepare = prepare
+        self.run = run
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SessionWorker")
+        self.active = None
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.first_session_at = None
+
+        self._waiting = queue.Queue()
+        self._stage = threading.Thread(target=self._stage_loop, name="SessionStage", daemon=True)
+        self._stage.start()
+
+    def open(self, data: dict, capture):
+        """
+        Opens a session for a newly detected group and starts preparing its greeting.
+
+        Returns:
+            ConversationSession: The session, or None when too many groups are already waiting.
+        """
+        if self._waiting.qsize() >= self.max_queued:
+            self.rejected += 1
+            self.logger.warning(f"{self._waiting.qsize()} groups are already waiting, not starting a session for object {data['object_id']}.")
+            return None
+
+        session = ConversationSession(data, capture)
+        session.greeting = self.pool.submit(self.prepare, session)
+        if self.first_session_at is None:
+            self.first_session_at = session.created_at
+        self._waiting.put(session)
+        return session
+
+    def cancel_waiting(self):
+        """
+        Drops every session that has not started yet.
+        """
+        while True:
+            try:
+                session = self._waiting.get_nowait()
+            except queue.Empty:
+                return
+            self._cancel(session, "cancelled")
+            self._waiting.task_done()
+
+    @property
+    def idle(self):
+        """
+        True when no session is waiting or running.
+        """
+        return self._waiting.unfinished_tasks == 0
+
+    def end_active(self):
+        if self.active:
+            self.active.end()
+
+    def _cancel(self, session, reason):
+        session.state = 'cancelled'
+        session.greeting.cancel()
+        self.cancelled += 1
+        self.logger.info(f"Session for object {session.object_id} {reason} after waiting {session.queue_wait:.1f}s.")
+
+    def _stage_loop(self):
+        while True:
+            session = self._waiting.get()
+            try:
+                self._run_session(session)
+            finally:
+                self._waiting.task_done()
+
+    def _run_session(self, session):
+        if session.state == 'cancelled':
+            return
+        if self.max_wait and session.queue_wait > self.max_wait:
+            self._cancel(session, "expired")
+            return
+
+        session.started_at = time.time()
+        self.total_queue_wait += session.queue_wait
+        self.max_queue_wait = max(self.max_queue_wait, session.queue_wait)
+        self.logger.info(f"Starting session for object {session.object_id}, queue wait: {session.queue_wait:.2f}s")
+
+        self.active = session
+        try:
+            session.state = 'active'
+            self.run(session)
+        except Exception as e:
+            self.logger.exception(f"Session for object {session.object_id} failed: {str(e)}", exc_info=e)
+        finally:
+            session.end()
+            session.ended_at = time.time()
+            self.active = None
+            self.completed += 1
+
+    def get_status(self):
+        elapsed_hours = (time.time() - self.first_session_at) / 3600 if self.first_session_at else 0
+        started = self.completed + (1 if self.active else 0)
+        return {
+            'waiting': self._waiting.qsize(),
+            'active_object_id': self.active.object_id if self.active else None,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'mean_queue_wait_seconds': round(self.total_queue_wait / started, 3) if started else 0.0,
+            'max_queue_wait_seconds': round(self.max_queue_wait, 3),
+            'sessions_per_hour': round(self.completed / elapsed_hours, 1) if elapsed_hours > 0 else 0.0
+        }
@@ -0,0 +1,244 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.configuration import merge_defaults
+
+# Defaults for the Speculation configuration section.
+DEFAULT_SPECULATION_CONFIG = {
+    "Enabled": False,
+    # candidates prepared at once, more candidates than this are not speculated on
+    "MaxInFlight": 3,
+    # seconds a confirmed visitor's greeting waits for unfinished speculative work before doing it itself
+    "CommitTimeout": 5.0
+}
+
+
+class Speculation:
+    """
+    The work started for one candidate: its assistant thread and its pre-uploaded image.
+    """
+    def __init__(self, candidate_id: int, data: dict):
+        self.candidate_id = candidate_id
+        self.best = data
+        self.capture = None
+        self.thread = None
+        self.image_url = None
+        self.api_calls = 0
+        self.work_time = 0.0
+        self.cancelled = False
+        self.future = None
+        self.lock = threading.Lock()
+
+    def improve(self, data: dict) -> bool:
+        """
+        Replaces the frame to upload with a more confident one, until the upload has started.
+        """
+        with self.lock:
+            if self.capture is not None or data['confidence'] <= self.best['confidence']:
+                return False
+            self.best = data
+            return True
+
+    def take_best(self) -> dict:
+        with self.lock:
+            return self.best
+
+
+class Speculator:
+    """
+    Starts the slow part of a greeting for candidates, detections that are likely but not yet
+    confirmed visitors.
+
+    A candidate gets its assistant thread created, which also opens the connection to the api,
+    and its best frame so far encoded and uploaded. When the candidate is confirmed the greeting
+    commits that work and only has to send the message and run the assistant. When the candidate
+    is lost the work is thrown away and counted as waste.
+
+    Nothing is started while the conversation engine keeps its history on the prop, its threads
+    cost no api call and its images are sent inline.
+
+    Args:
+        engine (ConversationEngine): Creates the threads and uploads the images.
+        capture_store (CaptureStore): Encodes the frames, speculative frames are not written to disk.
+        config (dict): The Speculation configuration section, missing keys use DEFAULT_SPECULATION_CONFIG.
+        logger (Logger): Logger for failed speculative work.
+    """
+    def __init__(self, engine, capture_store, config: dict = None, logger=None):
+        self.engine = engine
+        self.capture_store = capture_store
+        self.logger = logger or logging.getLogger(__name__)
+        self.apply_config(config)
+
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Speculation")
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_api_calls = 0
+        self.wasted_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the Speculation configuration section.
+        """
+        speculation_config = merge_defaults(DEFAULT_SPECULATION_CONFIG, configuration)
+        self.config = speculation_config
+        self.enabled = speculation_config["Enabled"]
+        self.max_in_flight = speculation_config["MaxInFlight"]
+        self.commit_timeout = speculation_config["CommitTimeout"]
+
+    def begin(self, data: dict):
+        """
+        Starts preparing a greeting for a new candidate.
+
+        Args:
+            data (dict): The candidate_detected event data.
+        """
+        if not self.engine.remote_history:
+            return
+
+        with self.lock:
+            if len(self.pending) >= self.max_in_flight:
+                self.skipped += 1
+                return
+            speculation = Speculation(data['candidate_id'], data)
+            speculation.future = self.pool.submit(self._prepare, speculation)
+            self.pending[speculation.candidate_id] = speculation
+            self.started += 1
+
+    def improve(self, data: dict):
+        """
+        Offers a better frame of a candidate, used if its image is not being uploaded yet.
+
+        Args:
+            data (dict): The candidate_improved event data.
+        """
+        speculation = self.pending.get(data['candidate_id'])
+        if speculation is not None:
+            speculation.improve(data)
+
+    def commit(self, candidate_id: int):
+        """
+        Hands the work done for a candidate to the visitor it turned out to be.
+
+        Args:
+            candidate_id (int): The candidate id from the new_object_detected event.
+
+        Returns:
+            Speculation: The speculation, or None when nothing was started for the candidate.
+        """
+        with self.lock:
+            speculation = self.pending.pop(candidate_id, None)
+            if speculation is None:
+                return None
+            self.hits += 1
+        return speculation
+
+    def resolve(self, speculation: Speculation):
+        """
+        Waits for a committed speculation to finish, at most CommitTimeout seconds.
+
+        Returns:
+            tuple: The assistant thread and image url, either is None when it is not ready or failed.
+        """
+        try:
+            speculation.future.result(timeout=self.commit_timeout)
+        except Exception as e:
+            self.logger.warning(f"Speculative work for candidate {speculation.candidate_id} was not usable: {e}")
+
+        with speculation.lock:
+            # whatever is not finished by now is redone on the greeting path
+            speculation.cancelled = True
+            self.saved_seconds += speculation.work_time
+            return speculation.thread, speculation.image_url
+
+    def cancel(self, candidate_id: int):
+        """
+        Throws away the work for a candidate that left or was never confirmed.
+
+        Args:
+            candidate_id (int): The candidate id from the candidate_lost event.
+        """
+        with self.lock:
+            speculation = self.pending.pop(candidate_id, None)
+            if speculation is None:
+                return
+            self.misses += 1
+        self._abandon(speculation)
+
+    def discard(self, speculation: Speculation):
+        """
+        Throws away a committed speculation whose visitor was turned away after all.
+        """
+        with self.lock:
+            self.hits -= 1
+            self.misses += 1
+        self._abandon(speculation)
+
+    def _abandon(self, speculation: Speculation):
+        # work that has not started is dropped, running work stops after its current step and is counted once it does
+        with speculation.lock:
+            speculation.cancelled = True
+        if not speculation.future.cancel():
+            speculation.future.add_done_callback(lambda _: self._count_waste(speculation))
+
+    def _count_waste(self, speculation: Speculation):
+        with self.lock:
+            self.wasted_api_calls += speculation.api_calls
+            self.wasted_seconds += speculation.work_time
+
+    def _step(self, speculation: Speculation, work):
+        # each step checks for cancellation first, a lost candidate stops making api calls
+        with speculation.lock:
+            if speculation.cancelled:
+                return None
+        start = time.perf_counter()
+        result = work()
+        with speculation.lock:
+            speculation.work_time += time.perf_counter() - start
+        return result
+
+    def _prepare(self, speculation: Speculation):
+        thread = self._step(speculation, self.engine.create_thread)
+        if thread is None:
+            return
+        with speculation.lock:
+            speculation.thread = thread
+            speculation.api_calls += 1
+
+        # the best frame is taken as late as possible, the candidate may have come closer by now
+        best = speculation.take_best()
+        file_name = f"candidate_{best['class_name']}_{best['timestamp']}_{speculation.candidate_id}.jpg"
+        capture = self._step(speculation, lambda: self.capture_store.encode(best['frame'], file_name))
+        if capture is None:
+            return
+        with speculation.lock:
+            speculation.capture = capture
+
+        image_url = self._step(speculation, lambda: self.engine.upload_image(capture.path, capture.data))
+        if image_url is None:
+            return
+        with speculation.lock:
+            speculation.image_url = image_url
+            speculation.api_calls += 1
+
+    def get_status(self):
+        """
+        Returns the hit rate of the speculation and the work it wasted.
+        """
+        resolved = self.hits + self.misses
+        return {
+            'pending': len(self.pending),
+            'started': self.started,
+            'skipped': self.skipped,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / resolved, 3) if resolved else None,
+            'wasted_api_calls': self.wasted_api_calls,
+            'wasted_seconds': round(self.wasted_seconds, 3),
+            'saved_seconds': round(self.saved_seconds, 3)
+        }
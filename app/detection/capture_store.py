@@ -0,0 +1,166 @@
+import cv2
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from app.configuration import merge_defaults
+
+# Defaults for the Captures configuration section.
+DEFAULT_CAPTURE_CONFIG = {
+    "JpegQuality": 85,
+    # Frames wider than this are downscaled before encoding, 0 keeps the camera resolution.
+    "MaxWidth": 1280,
+    # Retention limits for the captures directory, 0 disables the limit.
+    "MaxDirectorySizeMB": 512,
+    "MaxAgeDays": 14
+}
+
+# Captures are the store's own JPEG files, anything else in the directory is left alone.
+CAPTURE_EXTENSION = ".jpg"
+
+# How often the age limit is checked while no captures are written.
+RETENTION_INTERVAL = 60 * 60
+
+
+class Capture:
+    """
+    An encoded detection image: the path it is (or will shortly be) written to and the JPEG bytes.
+    """
+    def __init__(self, path: str, data: bytes, encode_time: float):
+        self.path = path
+        self.data = data
+        self.encode_time = encode_time
+
+
+class CaptureStore:
+    """
+    Encodes detection frames and writes them to the captures directory on a background thread.
+
+    The encoded bytes are returned to the caller straight away so the upload does not have to wait
+    for (or read back) the file. The directory is kept within the configured size and age limits
+    by evicting the oldest captures.
+    """
+    def __init__(self, capture_dir: str, configuration: dict = None, logger=None):
+        self.capture_dir = capture_dir
+        self.logger = logger or logging.getLogger(__name__)
+        self.apply_config(configuration)
+
+        self.evicted = 0
+        self._files = deque()
+        self._total_bytes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="CaptureWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the Captures configuration section, new limits are enforced on the next write.
+        """
+        capture_config = merge_defaults(DEFAULT_CAPTURE_CONFIG, configuration)
+
+        self.jpeg_quality = int(capture_config["JpegQuality"])
+        self.max_width = int(capture_config["MaxWidth"])
+        self.max_bytes = int(capture_config["MaxDirectorySizeMB"] * 1024 * 1024)
+        self.max_age = capture_config["MaxAgeDays"] * 24 * 60 * 60
+
+    def save(self, frame, file_name: str) -> Capture:
+        """
+        Encodes a frame as JPEG and queues it to be written to the captures directory.
+
+        Args:
+            frame (np.ndarray): The BGR frame from the detector.
+            file_name (str): The name of the capture file.
+
+        Returns:
+            Capture: The capture, its data can be used right away.
+        """
+        capture = self.encode(frame, file_name)
+        self._queue.put(capture)
+        return capture
+
+    def encode(self, frame, file_name: str) -> Capture:
+        """
+        Encodes a frame as JPEG without writing it, for images that may never be needed.
+        """
+        start_time = time.time()
+
+        height, width = frame.shape[:2]
+        if self.max_width and width > self.max_width:
+            scale = self.max_width / width
+            frame = cv2.resize(frame, (self.max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ok:
+            raise ValueError(f"Unable to encode capture {file_name}")
+
+        return Capture(os.path.join(self.capture_dir, file_name), encoded.tobytes(), time.time() - start_time)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+
+    def _write_loop(self):
+        # the directory is scanned and trimmed to the limits before the first capture is written
+        self._load_existing()
+
+        while True:
+            try:
+                capture = self._queue.get(timeout=RETENTION_INTERVAL)
+            except queue.Empty:
+                # a quiet night still ages captures out
+                self._apply_retention()
+                continue
+            if capture is None:
+                return
+
+            try:
+                with open(capture.path, 'wb') as capture_file:
+                    capture_file.write(capture.data)
+                self._files.append((time.time(), len(capture.data), capture.path))
+                self._total_bytes += len(capture.data)
+            except OSError as e:
+                self.logger.exception(f"Failed to write capture {capture.path}: {str(e)}", exc_info=e)
+
+            self._apply_retention()
+
+    def _load_existing(self):
+        # one scan at startup, after that the writer keeps the index up to date itself
+        existing = []
+        try:
+            with os.scandir(self.capture_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(CAPTURE_EXTENSION):
+                        stat = entry.stat()
+                        existing.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            self.logger.exception(f"Failed to scan the captures directory: {str(e)}", exc_info=e)
+
+        existing.sort()
+        self._files.extend(existing)
+        self._total_bytes = sum(size for _, size, _ in existing)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        cutoff = time.time() - self.max_age if self.max_age else None
+
+        while self._files:
+            written, size, path = self._files[0]
+            too_old = cutoff is not None and written < cutoff
+            too_big = self.max_bytes and self._total_bytes > self.max_bytes
+            if not (too_old or too_big):
+                break
+
+            self._files.popleft()
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"Unable to evict capture {path}: {str(e)}")
@@ -0,0 +1,158 @@
+import os
+import time
+import logging
+import cv2
+import numpy as np
+from app.configuration import merge_defaults
+
+# Defaults for the Costumes configuration section.
+DEFAULT_COSTUME_CONFIG = {
+    "Enabled": False,
+    # an image classification network exported to ONNX, one output score per line of the labels file
+    "ModelPath": "app/detection/models/costume_classifier.onnx",
+    "LabelsPath": "app/detection/models/costume_labels.txt",
+    "InputSize": 224,
+    # labels scored below this are ignored and the visitor gets the regular greeting
+    "MinConfidence": 0.5,
+    # extra room around the person box so hats, wings and props are part of the crop
+    "CropPadding": 0.1,
+    # label -> lines the prop can say right away, before the assistant's greeting is ready
+    "Openers": {}
+}
+
+# ImageNet normalization, used by most classification backbones.
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(1, 3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(1, 3, 1, 1)
+
+
+class CostumeLabel:
+    """
+    The costume a visitor is most likely wearing.
+    """
+    __slots__ = ("label", "confidence", "inference_time")
+
+    def __init__(self, label: str, confidence: float, inference_time: float):
+        self.label = label
+        self.confidence = confidence
+        self.inference_time = inference_time
+
+    def __repr__(self):
+        return f"CostumeLabel({self.label!r}, {self.confidence:.2f}, {self.inference_time * 1000:.1f}ms)"
+
+
+def crop_box(frame, box=None, padding: float = 0.0):
+    """
+    Cuts a detector box, grown by a fraction of its size on every side, out of the frame.
+    The whole frame is returned when there is no box or the box is outside the frame.
+    """
+    if box is None:
+        return frame
+
+    height, width = frame.shape[:2]
+    x, y, w, h = box
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    left, top = max(0, x - pad_x), max(0, y - pad_y)
+    right, bottom = min(width, x + w + pad_x), min(height, y + h + pad_y)
+    if right <= left or bottom <= top:
+        return frame
+    return frame[top:bottom, left:right]
+
+
+def _resolve(path):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), '..', '..', path)
+
+
+class CostumeClassifier:
+    """
+    Labels the costume in a person crop with a small ONNX network run through OpenCV's dnn module.
+
+    A MobileNet-sized model classifies a 224x224 crop in tens of milliseconds on a Raspberry Pi
+    CPU, so the label is known long before the assistant has looked at the image.
+
+    Args:
+        config (dict): The Costumes configuration section, missing keys use DEFAULT_COSTUME_CONFIG.
+        logger (Logger): Logger for load failures.
+    """
+    def __init__(self, config: dict = None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.config = {}
+        self.net = None
+        self.labels = []
+        self.apply_config(config)
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the Costumes configuration section, the model is only reloaded when its files or Enabled changed.
+        """
+        costume_config = merge_defaults(DEFAULT_COSTUME_CONFIG, configuration)
+        reload = any(costume_config[key] != self.config.get(key) for key in ("Enabled", "ModelPath", "LabelsPath"))
+        self.config = costume_config
+        if reload:
+            self._load()
+
+    def _load(self):
+        self.net = None
+        self.labels = []
+        if not self.config["Enabled"]:
+            return
+
+        model_path = _resolve(self.config["ModelPath"])
+        labels_path = _resolve(self.config["LabelsPath"])
+        if not os.path.exists(model_path) or not os.path.exists(labels_path):
+            self.logger.warning(f"Costume classifier model or labels not found ({model_path}), costume openers are disabled.")
+            return
+
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        with open(labels_path, "r") as labels_file:
+            self.labels = [line.strip() for line in labels_file if line.strip()]
+
+    @property
+    def enabled(self):
+        return self.net is not None
+
+    def crop(self, frame, box=None):
+        """
+        Cuts the padded person box out of the frame, the whole frame is used when there is no box.
+        """
+        return crop_box(frame, box, self.config["CropPadding"])
+
+    def classify(self, frame, box=None):
+        """
+        Classifies the costume of the person in the box.
+
+        Args:
+            frame (ndarray): The BGR camera frame.
+            box (list): The person's [x, y, w, h] box from the detector.
+
+        Returns:
+            CostumeLabel: The best label, or None when the classifier is disabled or not confident.
+        """
+        if not self.enabled:
+            return None
+
+        label = self.predict(frame, box)
+        if label.confidence < self.config["MinConfidence"]:
+            return None
+        return label
+
+    def predict(self, frame, box=None) -> CostumeLabel:
+        """
+        Returns the best label whatever its confidence, the classifier must be enabled.
+        """
+        start = time.perf_counter()
+        size = self.config["InputSize"]
+        blob = cv2.dnn.blobFromImage(self.crop(frame, box), 1.0 / 255, (size, size), (0, 0, 0), swapRB=True, crop=False)
+        self.net.setInput((blob - MEAN) / STD)
+        scores = self.net.forward().reshape(-1)
+
+        # some exports end in a softmax already, only raw logits are normalized
+        if scores.min() < 0 or abs(float(scores.sum()) - 1.0) > 1e-3:
+            scores = np.exp(scores - scores.max())
+            scores /= scores.sum()
+        index = int(np.argmax(scores))
+        return CostumeLabel(self.labels[index] if index < len(self.labels) else str(index), float(scores[index]), time.perf_counter() - start)
+
+    def opener_lines(self, label: str):
+        return self.config["Openers"].get(label, [])
@@ -3,8 +3,12 @@ import numpy as np
 from datetime import datetime, timedelta
 import os
 import threading
+import time
 import json
 from types import SimpleNamespace
+from opentelemetry import trace
+from app.logging.tracing import get_tracer, visitor_context
+from app.detection.preview import PreviewBroadcaster
 
 class ObjectDetector:
     def __init__(self, configuration=None):
@@ -26,7 +30,15 @@ class ObjectDetector:
             # A lower number is more lenient allowing more movement before being considered a new object.
             "IouThreshold": 0.4,
             "VideoInputDeviceIndex": 0,
-            "AllowMultiThreading": True
+            "AllowMultiThreading": True,
+
+            # Detections at or above this confidence are visitors.
+            "ConfirmConfidence": 0.8,
+            # Detections between this and ConfirmConfidence are likely visitors, reported as candidates so
+            # slow work can start early. Set it to ConfirmConfidence to turn candidates off.
+            "CandidateConfidence": 0.5,
+            # Seconds a candidate may go unseen before it is reported lost, low confidence boxes flicker.
+            "CandidateTimeout": 1.0
         }
 
         # Update default config with provided configuration
@@ -42,6 +54,11 @@ class ObjectDetector:
         # Counter for unique object IDs
         self.object_id_counter = 0
 
+        # Likely visitors that are not confirmed yet, keyed by candidate id
+        self.candidates = {}
+        self.candidate_id_counter = 0
+        self.candidate_timeout = timedelta(seconds=self.configuration.CandidateTimeout)
+
         # Create directories for logs and captures
         self.log_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs'))
         self.capture_dir = os.path.join(self.log_dir, 'captures')
@@ -51,6 +68,18 @@ class ObjectDetector:
         self.thread = None
 
         self.observers = []
+        self.tracer = get_tracer(__name__)
+
+        # Performance counters, read by the control api
+        self.fps = 0.0
+        self.frame_count = 0
+        self.last_inference_time = 0.0
+        self.preview = PreviewBroadcaster()
+
+    @property
+    def min_confidence(self):
+        # the lowest confidence anything is done with, candidates or confirmed visitors
+        return min(self.configuration.CandidateConfidence, self.configuration.ConfirmConfidence)
 
     def add_observer(self, observer):
         self.observers.append(observer)
@@ -108,7 +137,7 @@ class ObjectDetector:
                     scores = detection[5:]
                     class_id = np.argmax(scores)
                     confidence = scores[class_id]
-                    if confidence > 0.5 and self.classes[class_id] in self.configuration.MonitoredObjects:
+                    if confidence >= self.min_confidence and self.classes[class_id] in self.configuration.MonitoredObjects:
                         # Object detected
                         center_x = int(detection[0] * width)
                         center_y = int(detection[1] * height)
@@ -123,8 +152,8 @@ class ObjectDetector:
                         confidences.append(float(confidence))
                         class_ids.append(class_id)
 
-            # Apply non-maximum suppression
-            indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
+            # Apply non-maximum suppression, with the same score threshold so no kept detection is dropped here
+            indexes = cv2.dnn.NMSBoxes(boxes, confidences, self.min_confidence, 0.4)
 
             # Current timestamp
             current_time = datetime.now()
@@ -139,7 +168,7 @@ class ObjectDetector:
                     confidence = confidences[i]
 
                     # Check if the object is clearly focused (you may need to adjust this threshold)
-                    if confidence > 0.8:  # Assuming high confidence means clear focus
+                    if confidence >= self.configuration.ConfirmConfidence:  # Assuming high confidence means clear focus
                         # Prepare event data
                         event_data = {
                             'timestamp': timestamp,
@@ -162,133 +191,244 @@ class ObjectDetector:
 
     def _run_v3(self):
         cap = cv2.VideoCapture(self.configuration.VideoInputDeviceIndex)
+        last_frame_at = None
         
         while self.running:
             ret, frame = cap.read()
             if not ret:
                 break
 
-            height, width, channels = frame.shape
-
-            # Detecting objects
-            blob = cv2.dnn.blobFromImage(frame, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-            self.net.setInput(blob)
-            outs = self.net.forward(self.output_layers)
+            with self.tracer.start_as_current_span("detection.frame"):
+                self._process_frame_v3(frame)
+            self.preview.publish(frame)
 
-            # Information to display on screen
-            class_ids = []
-            confidences = []
-            boxes = []
+            # smoothed frames per second from the interval between frames, so waiting on the camera counts too
+            frame_at = time.perf_counter()
+            self.frame_count += 1
+            if last_frame_at is not None and frame_at > last_frame_at:
+                frame_time = frame_at - last_frame_at
+                self.fps = 1.0 / frame_time if self.fps == 0 else 0.9 * self.fps + 0.1 / frame_time
+            last_frame_at = frame_at
 
-            # Loop through detections
-            for out in outs:
-                for detection in out:
-                    scores = detection[5:]
-                    class_id = np.argmax(scores)
-                    confidence = scores[class_id]
-                    if confidence > 0.5 and self.classes[class_id] in self.configuration.MonitoredObjects:
-                        # Object detected
-                        center_x = int(detection[0] * width)
-                        center_y = int(detection[1] * height)
-                        w = int(detection[2] * width)
-                        h = int(detection[3] * height)
-
-                        # Rectangle coordinates
-                        x = int(center_x - w / 2)
-                        y = int(center_y - h / 2)
-
-                        boxes.append([x, y, w, h])
-                        confidences.append(float(confidence))
-                        class_ids.append(class_id)
-
-            # Apply non-maximum suppression
-            indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
-
-            # Current timestamp
-            current_time = datetime.now()
-            timestamp = current_time.strftime("%Y-%m-%d_%H-%M-%S")
-
-            # Keep track of detected objects in this frame
-            detected_in_frame = set()
+            # Display the resulting frame (optional, for debugging)
+            # cv2.imshow('Object Detection', frame)
+            #if cv2.waitKey(1) & 0xFF == ord('q'):
+            #    break
 
-            # Process detections
-            for i in range(len(boxes)):
-                if i in indexes:
-                    x, y, w, h = boxes[i]
-                    class_id = class_ids[i]
-                    class_name = self.classes[class_id]
-                    confidence = confidences[i]
+        cap.release()
+        #cv2.destroyAllWindows()
 
-                    # Check if the object is clearly focused (you may need to adjust this threshold)
-                    if confidence > 0.8:  # Assuming high confidence means clear focus
-                        
-                        # Check if this object has been detected before
-                        object_id = None
-                        for id, obj in self.detected_objects.items():
-                            # The purpose of this line is to determine if the current detection is likely to 
-                            # be the same object as one that was previously detected. It does this by comparing 
-                            # the overlap of their bounding boxes (Intersection over Union).
-                            if self.calculate_iou(obj['box'], [x, y, w, h]) > self.configuration.IouThreshold:  
-                                object_id = id
-                                break
+    def _process_frame_v3(self, frame):
+        height, width, channels = frame.shape
+
+        # Detecting objects
+        blob = cv2.dnn.blobFromImage(frame, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+        inference_start = time.time()
+        self.net.setInput(blob)
+        outs = self.net.forward(self.output_layers)
+        self.last_inference_time = time.time() - inference_start
+
+        # Information to display on screen
+        class_ids = []
+        confidences = []
+        boxes = []
+
+        # Loop through detections
+        for out in outs:
+            for detection in out:
+                scores = detection[5:]
+                class_id = np.argmax(scores)
+                confidence = scores[class_id]
+                if confidence >= self.min_confidence and self.classes[class_id] in self.configuration.MonitoredObjects:
+                    # Object detected
+                    center_x = int(detection[0] * width)
+                    center_y = int(detection[1] * height)
+                    w = int(detection[2] * width)
+                    h = int(detection[3] * height)
+
+                    # Rectangle coordinates
+                    x = int(center_x - w / 2)
+                    y = int(center_y - h / 2)
+
+                    boxes.append([x, y, w, h])
+                    confidences.append(float(confidence))
+                    class_ids.append(class_id)
+
+        # Apply non-maximum suppression, with the same score threshold so no kept detection is dropped here
+        indexes = cv2.dnn.NMSBoxes(boxes, confidences, self.min_confidence, 0.4)
+
+        # Current timestamp
+        current_time = datetime.now()
+        timestamp = current_time.strftime("%Y-%m-%d_%H-%M-%S")
+
+        # Keep track of detected objects in this frame
+        detected_in_frame = set()
+
+        # Process detections
+        for i in range(len(boxes)):
+            if i in indexes:
+                x, y, w, h = boxes[i]
+                class_id = class_ids[i]
+                class_name = self.classes[class_id]
+                confidence = confidences[i]
+
+                # Check if the object is clearly focused, less confident detections are candidates
+                if confidence >= self.configuration.ConfirmConfidence:
+                    
+                    # Check if this object has been detected before
+                    object_id = None
+                    for id, obj in self.detected_objects.items():
+                        # The purpose of this line is to determine if the current detection is likely to 
+                        # be the same object as one that was previously detected. It does this by comparing 
+                        # the overlap of their bounding boxes (Intersection over Union).
+                        if self.calculate_iou(obj['box'], [x, y, w, h]) > self.configuration.IouThreshold:  
+                            object_id = id
+                            break
+                    
+                    if object_id is None:
+                        # This is a new object, assign it a new ID
+                        object_id = self.object_id_counter
+                        self.object_id_counter += 1
                         
-                        if object_id is None:
-                            # This is a new object, assign it a new ID
-                            object_id = self.object_id_counter
-                            self.object_id_counter += 1
-                            
-                            # Prepare event data
-                            event_data = {
-                                'timestamp': timestamp,
-                                'class_name': class_name,
-                                'confidence': confidence,
-                                'object_id': object_id,
-                                'frame': frame.copy()  # Send a copy of the frame
-                            }
-
-                            # Notify observers
-                            self.notify_observers('new_object_detected', event_data)
-
-                            # Store the object information
-                            self.detected_objects[object_id] = {
-                                'class': class_name,
-                                'box': [x, y, w, h],
-                                'last_seen': current_time
-                            }
-
-                        else:
-                            # Update the last seen time and position for the existing object
-                            self.detected_objects[object_id]['last_seen'] = current_time
-                            self.detected_objects[object_id]['box'] = [x, y, w, h]
-
-                        detected_in_frame.add(object_id)
-
-                        # Draw bounding box on the frame (for visualization purposes)
-                        color = (0, 255, 0)  # Green color for bounding box
-                        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                        label = f"{class_name}: {confidence:.2f} ID: {object_id}"
-                        cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                        # Prepare event data
+                        event_data = {
+                            'timestamp': timestamp,
+                            'class_name': class_name,
+                            'confidence': confidence,
+                            'object_id': object_id,
+                            'box': [x, y, w, h],
+                            'frame': frame.copy(),  # Send a copy of the frame
+                            'detected_at': time.time()
+                        }
 
-            # Check for objects that have left the frame
-            objects_to_remove = []
-            for object_id in self.detected_objects:
-                if object_id not in detected_in_frame:
-                    objects_to_remove.append(object_id)
+                        # a candidate that became a visitor is not lost, whatever was started for it is used
+                        candidate_id = self._promote_candidate([x, y, w, h])
+                        if candidate_id is not None:
+                            event_data['candidate_id'] = candidate_id
 
-            for object_id in objects_to_remove:
-                del self.detected_objects[object_id]
+                        # Notify observers, everything they do is traced as part of this visitor's interaction
+                        with visitor_context(object_id), self.tracer.start_as_current_span("detection.dispatch", attributes={"class_name": class_name, "confidence": confidence}):
+                            self.notify_observers('new_object_detected', event_data)
 
-            # Notify if all objects have left the frame
-            if len(self.detected_objects) == 0 and len(objects_to_remove) > 0:
-                self.notify_observers('all_objects_left', {'timestamp': timestamp})
+                        # Store the object information
+                        self.detected_objects[object_id] = {
+                            'class': class_name,
+                            'box': [x, y, w, h],
+                            'last_seen': current_time
+                        }
 
-            # Display the resulting frame (optional, for debugging)
-            # cv2.imshow('Object Detection', frame)
-            #if cv2.waitKey(1) & 0xFF == ord('q'):
-            #    break
+                    else:
+                        # Update the last seen time and position for the existing object
+                        self.detected_objects[object_id]['last_seen'] = current_time
+                        self.detected_objects[object_id]['box'] = [x, y, w, h]
+
+                    detected_in_frame.add(object_id)
+
+                    # Draw bounding box on the frame (for visualization purposes)
+                    color = (0, 255, 0)  # Green color for bounding box
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+                    label = f"{class_name}: {confidence:.2f} ID: {object_id}"
+                    cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+                elif confidence >= self.configuration.CandidateConfidence:
+                    self._track_candidate(class_name, confidence, [x, y, w, h], frame, timestamp, current_time)
+
+        self._expire_candidates(timestamp, current_time)
+
+        # Check for objects that have left the frame
+        objects_to_remove = []
+        for object_id in self.detected_objects:
+            if object_id not in detected_in_frame:
+                objects_to_remove.append(object_id)
+
+        for object_id in objects_to_remove:
+            del self.detected_objects[object_id]
+
+        # Notify if all objects have left the frame
+        if len(self.detected_objects) == 0 and len(objects_to_remove) > 0:
+            self.notify_observers('all_objects_left', {'timestamp': timestamp})
+
+        trace.get_current_span().set_attribute("detections", len(detected_in_frame))
+
+    def _track_candidate(self, class_name, confidence, box, frame, timestamp, current_time):
+        """
+        Follows a detection that is not confident enough to be a visitor yet.
+
+        Observers get 'candidate_detected' the first time and 'candidate_improved' whenever the
+        candidate is seen with a clearly better confidence, both with a copy of the frame.
+        """
+        # a confirmed visitor seen less clearly for a frame is not a new candidate
+        if any(self.calculate_iou(obj['box'], box) > self.configuration.IouThreshold for obj in self.detected_objects.values()):
+            return
+
+        for candidate_id, candidate in self.candidates.items():
+            if self.calculate_iou(candidate['box'], box) > self.configuration.IouThreshold:
+                candidate['box'] = box
+                candidate['last_seen'] = current_time
+                if confidence < candidate['confidence'] + 0.05:
+                    return
+                candidate['confidence'] = confidence
+                event_type = 'candidate_improved'
+                break
+        else:
+            candidate_id = self.candidate_id_counter
+            self.candidate_id_counter += 1
+            self.candidates[candidate_id] = {'class': class_name, 'box': box, 'confidence': confidence, 'last_seen': current_time}
+            event_type = 'candidate_detected'
+
+        self.notify_observers(event_type, {
+            'timestamp': timestamp,
+            'class_name': class_name,
+            'confidence': confidence,
+            'candidate_id': candidate_id,
+            'box': box,
+            'frame': frame.copy()
+        })
+
+    def _promote_candidate(self, box):
+        for candidate_id, candidate in self.candidates.items():
+            if self.calculate_iou(candidate['box'], box) > self.configuration.IouThreshold:
+                del self.candidates[candidate_id]
+                return candidate_id
+        return None
 
-        cap.release()
-        #cv2.destroyAllWindows()
+    def _expire_candidates(self, timestamp, current_time):
+        expired = [candidate_id for candidate_id, candidate in self.candidates.items()
+                   if current_time - candidate['last_seen'] > self.candidate_timeout]
+        for candidate_id in expired:
+            del self.candidates[candidate_id]
+            self.notify_observers('candidate_lost', {'timestamp': timestamp, 'candidate_id': candidate_id})
+
+    def apply_configuration(self, configuration: dict):
+        """
+        Updates the detection settings of a running detector, the network stays loaded.
+
+        Args:
+            configuration (dict): The Detection section of the configuration.
+        """
+        video_index = self.configuration.VideoInputDeviceIndex
+        for key, value in configuration.items():
+            setattr(self.configuration, key, value)
+        self.candidate_timeout = timedelta(seconds=self.configuration.CandidateTimeout)
+
+        if self.configuration.VideoInputDeviceIndex != video_index and self.running:
+            print("The video input device change will take effect the next time the detector is started.")
+
+    def get_status(self):
+        """
+        Returns a snapshot of the detector's state for the control api.
+        """
+        tracked = dict(self.detected_objects)
+        return {
+            'running': self.running,
+            'fps': round(self.fps, 2),
+            'frames': self.frame_count,
+            'inference_seconds': round(self.last_inference_time, 4),
+            'tracked_objects': [
+                {'object_id': object_id, 'class_name': obj['class'], 'box': obj['box'], 'last_seen': obj['last_seen'].isoformat()}
+                for object_id, obj in tracked.items()
+            ]
+        }
 
     # Placeholder for future implementation of YOLOv9 detection model.
     def _run_v9(self):
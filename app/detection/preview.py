@@ -0,0 +1,69 @@
+import cv2
+import time
+import threading
+
+
+class PreviewBroadcaster:
+    """
+    Shares a JPEG preview of the detector's frames with any number of viewers.
+
+    The detector only hands over a reference to its latest frame. A single encoder thread turns it
+    into JPEG at most `fps` times per second, and only while someone is watching, so every viewer
+    reuses the same encoded bytes and the detection loop never waits on an encode.
+    """
+    def __init__(self, fps: float = 5.0, jpeg_quality: int = 70, max_width: int = 640):
+        self.interval = 1.0 / fps if fps > 0 else 0.2
+        self.jpeg_quality = jpeg_quality
+        self.max_width = max_width
+
+        self.viewers = 0
+        self.frames_encoded = 0
+        self.jpeg = None
+        self.sequence = 0
+
+        self._latest_frame = None
+        self._frame_ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._encode_loop, name="PreviewEncoder", daemon=True)
+        self._thread.start()
+
+    def publish(self, frame):
+        """
+        Called by the detector with each annotated frame, this only stores a reference.
+        """
+        if self.viewers > 0:
+            self._latest_frame = frame
+            self._frame_ready.set()
+
+    def add_viewer(self):
+        with self._lock:
+            self.viewers += 1
+
+    def remove_viewer(self):
+        with self._lock:
+            self.viewers = max(0, self.viewers - 1)
+
+    def _encode_loop(self):
+        while True:
+            self._frame_ready.wait()
+            self._frame_ready.clear()
+
+            frame, self._latest_frame = self._latest_frame, None
+            if frame is None:
+                continue
+
+            started = time.time()
+            height, width = frame.shape[:2]
+            if self.max_width and width > self.max_width:
+                frame = cv2.resize(frame, (self.max_width, int(height * self.max_width / width)), interpolation=cv2.INTER_AREA)
+
+            ok, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            if ok:
+                self.jpeg = encoded.tobytes()
+                self.sequence += 1
+                self.frames_encoded += 1
+
+            # cap the encode rate, frames published in the meantime simply replace each other
+            remaining = self.interval - (time.time() - started)
+            if remaining > 0:
+                time.sleep(remaining)
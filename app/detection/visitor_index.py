@@ -0,0 +1,217 @@
+import time
+import threading
+import cv2
+import numpy as np
+from app.detection.costume_classifier import crop_box
+from app.logging.latency_report import StreamingHistogram
+from app.configuration import merge_defaults
+
+# Defaults for the Revisits configuration section.
+DEFAULT_REVISIT_CONFIG = {
+    "Enabled": False,
+    # visitors remembered at once, the least recently seen is replaced when the index is full
+    "Capacity": 4096,
+    # visitors not seen for this long are forgotten
+    "ForgetAfterMinutes": 90,
+    # similarity (0-1) of two appearances that are taken to be the same visitor
+    "MatchThreshold": 0.9,
+    # spoken from the phrase cache instead of writing a new greeting, the conversation resumes on their thread
+    "WelcomeBackLines": ["Back again? I knew you could not stay away!"]
+}
+
+# Hue and saturation bins, value is left out so a kid walking from a porch light into shadow still matches.
+HUE_BINS = 16
+SATURATION_BINS = 4
+
+# The top and bottom half of the person are described separately, a red hat on blue jeans
+# is not the same visitor as a blue hat on red jeans.
+EMBEDDING_SIZE = 2 * HUE_BINS * SATURATION_BINS
+
+# API calls a greeting takes: the image upload, the thread, the assistant run and the speech synthesis.
+GREETING_API_CALLS = 4
+
+
+def appearance_embedding(frame, box=None):
+    """
+    Describes how a visitor looks as the square root of the hue/saturation histograms of the
+    top and bottom half of their box.
+
+    The result has unit length, so the dot product of two embeddings is their Bhattacharyya
+    coefficient: 1 for identical color distributions and 0 when they share no colors.
+
+    Args:
+        frame (ndarray): The BGR camera frame.
+        box (list): The person's [x, y, w, h] box from the detector.
+
+    Returns:
+        ndarray: A float32 vector of EMBEDDING_SIZE values.
+    """
+    hsv = cv2.cvtColor(crop_box(frame, box), cv2.COLOR_BGR2HSV)
+    middle = max(1, hsv.shape[0] // 2)
+    halves = []
+    for half in (hsv[:middle], hsv[middle:] if hsv.shape[0] > 1 else hsv):
+        histogram = cv2.calcHist([half], [0, 1], None, [HUE_BINS, SATURATION_BINS], [0, 180, 0, 256]).reshape(-1)
+        total = histogram.sum()
+        halves.append(histogram / total if total > 0 else histogram)
+
+    # each half is a distribution, together they are normalized to unit length
+    embedding = np.sqrt(np.concatenate(halves) / 2).astype(np.float32)
+    return embedding
+
+
+class VisitorRecord:
+    """
+    What the index keeps about a visitor: their object id, how far along their session is and the
+    engine and thread to resume the conversation on. The session itself, with its frame and
+    capture, is not kept.
+    """
+    __slots__ = ("object_id", "state", "engine", "thread")
+
+    def __init__(self, object_id, state: str = 'queued', engine=None, thread=None):
+        self.object_id = object_id
+        self.state = state
+        self.engine = engine
+        self.thread = thread
+
+    def update(self, session):
+        self.state = session.state
+        self.engine = session.engine
+        self.thread = session.thread
+
+
+class VisitorMatch:
+    """
+    A visitor the index has seen before.
+    """
+    __slots__ = ("slot", "payload", "similarity", "last_seen")
+
+    def __init__(self, slot: int, payload, similarity: float, last_seen: float):
+        self.slot = slot
+        self.payload = payload
+        self.similarity = similarity
+        self.last_seen = last_seen
+
+
+class VisitorIndex:
+    """
+    Remembers what recent visitors looked like so a returning visitor is recognized.
+
+    Embeddings live in one preallocated array, a lookup is a single matrix-vector product over
+    the occupied rows, which stays well under a millisecond for thousands of visitors. Entries
+    older than ForgetAfterMinutes are ignored, their payloads are dropped and their rows are the
+    first to be reused.
+
+    Args:
+        config (dict): The Revisits configuration section, missing keys use DEFAULT_REVISIT_CONFIG.
+    """
+    def __init__(self, config: dict = None):
+        self.config = {}
+        self.lock = threading.Lock()
+        self.lookup_time = StreamingHistogram(minimum=0.000001, maximum=1.0)
+        self.returning = 0
+        self.duplicates = 0
+        self.apply_config(config)
+
+    def apply_config(self, configuration: dict = None):
+        """
+        Applies the Revisits configuration section, a new Capacity starts with an empty index.
+        """
+        revisit_config = merge_defaults(DEFAULT_REVISIT_CONFIG, configuration)
+        resize = revisit_config["Capacity"] != self.config.get("Capacity")
+        self.config = revisit_config
+        self.max_age = revisit_config["ForgetAfterMinutes"] * 60
+        self.threshold = revisit_config["MatchThreshold"]
+
+        if resize:
+            with self.lock:
+                capacity = max(1, int(revisit_config["Capacity"]))
+                self.embeddings = np.zeros((capacity, EMBEDDING_SIZE), dtype=np.float32)
+                self.last_seen = np.zeros(capacity, dtype=np.float64)
+                self.payloads = [None] * capacity
+                self.has_payload = np.zeros(capacity, dtype=bool)
+                self.size = 0
+
+    @property
+    def enabled(self):
+        return self.config["Enabled"]
+
+    @property
+    def api_calls_saved(self):
+        return (self.returning + self.duplicates) * GREETING_API_CALLS
+
+    def lookup(self, embedding, now: float = None):
+        """
+        Finds the remembered visitor that looks most like the embedding.
+
+        Args:
+            embedding (ndarray): The visitor's appearance embedding.
+            now (float): The current time, defaults to time.time().
+
+        Returns:
+            VisitorMatch: The best match, or None when nobody recent is similar enough.
+        """
+        now = time.time() if now is None else now
+        start = time.perf_counter()
+        with self.lock:
+            size = self.size
+            if size == 0:
+                self.lookup_time.add(time.perf_counter() - start)
+                return None
+
+            expired = self.last_seen[:size] < now - self.max_age
+            self._forget(expired)
+            similarities = self.embeddings[:size] @ embedding
+            similarities[expired] = -1.0
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            match = VisitorMatch(slot, self.payloads[slot], similarity, float(self.last_seen[slot])) if similarity >= self.threshold else None
+        self.lookup_time.add(time.perf_counter() - start)
+        return match
+
+    def _forget(self, expired):
+        # every entry is forgotten once, so this only walks the rows that expired since the last lookup
+        for slot in np.nonzero(expired & self.has_payload[:len(expired)])[0]:
+            self.payloads[slot] = None
+            self.has_payload[slot] = False
+
+    def remember(self, embedding, payload, slot: int = None, now: float = None) -> int:
+        """
+        Stores a visitor, or refreshes the appearance and payload of a visitor that was matched.
+
+        Args:
+            embedding (ndarray): The visitor's appearance embedding.
+            payload: What to hand back when the visitor is matched, usually their VisitorRecord.
+            slot (int): The slot of the matched visitor, None stores a new visitor.
+            now (float): The current time, defaults to time.time().
+
+        Returns:
+            int: The visitor's slot.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if slot is None:
+                if self.size < len(self.last_seen):
+                    slot = self.size
+                    self.size += 1
+                else:
+                    # forgotten visitors have the oldest timestamps, so they are replaced first
+                    slot = int(np.argmin(self.last_seen))
+
+            self.embeddings[slot] = embedding
+            self.last_seen[slot] = now
+            self.payloads[slot] = payload
+            self.has_payload[slot] = payload is not None
+        return slot
+
+    def get_status(self):
+        """
+        Returns the index size, how many visitors came back and the API calls that saved.
+        """
+        return {
+            'remembered': self.size,
+            'returning': self.returning,
+            'duplicates': self.duplicates,
+            'api_calls_saved': self.api_calls_saved,
+            'mean_lookup_ms': round((self.lookup_time.mean or 0.0) * 1000, 4),
+            'max_lookup_ms': round((self.lookup_time.max or 0.0) * 1000, 4)
+        }
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+
+class Subscription:
+    """
+    One consumer of the broadcaster, events wait in a bounded buffer until the consumer reads them.
+
+    When the consumer falls behind the oldest events are dropped, the producer never waits.
+    """
+    def __init__(self, loop, max_size: int):
+        self.loop = loop
+        self.buffer = deque(maxlen=max_size)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self._wake_pending = False
+
+    def push(self, event: dict):
+        with self._lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(event)
+            wake = not self._wake_pending
+            self._wake_pending = True
+
+        # only one wake up is queued on the event loop no matter how many events arrive
+        if wake:
+            try:
+                self.loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # the loop has closed, the subscriber is gone
+                pass
+
+    async def get(self) -> list:
+        """
+        Waits for events and returns everything buffered so far.
+        """
+        while True:
+            with self._lock:
+                if self.buffer:
+                    events = list(self.buffer)
+                    self.buffer.clear()
+                    return events
+                self._wake_pending = False
+                self._ready.clear()
+            await self._ready.wait()
+
+
+class EventBroadcaster:
+    """
+    Fans detection and conversation events out to any number of live dashboards.
+
+    Publishing is safe from any thread and never blocks: each subscriber has its own bounded
+    buffer and slow subscribers lose their oldest events instead of slowing the producer.
+    """
+    def __init__(self, buffer_size: int = 100):
+        self.buffer_size = buffer_size
+        self.published = 0
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def publish(self, event_type: str, data: dict = None):
+        """
+        Publishes an event to every subscriber.
+
+        Args:
+            event_type (str): The type of the event.
+            data (dict): The event payload, frames and other non-serializable values are removed.
+        """
+        self.published += 1
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+
+        event = {'type': event_type, 'time': time.time(), 'data': _to_serializable(data or {})}
+        for subscription in subscriptions:
+            subscription.push(event)
+
+
+def _to_serializable(data: dict) -> dict:
+    result = {}
+    for key, value in data.items():
+        if key == 'frame':
+            continue
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            result[key] = value
+        elif isinstance(value, (list, tuple)):
+            result[key] = [v if isinstance(v, (str, int, float, bool)) else str(v) for v in value]
+        elif hasattr(value, 'item'):
+            # numpy scalars
+            result[key] = value.item()
+        else:
+            result[key] = str(value)
+    return result
@@ -0,0 +1,429 @@
+import time
+import socket
+import struct
+import logging
+import selectors
+import threading
+from app.configuration import merge_defaults
+
+# Message types
+DETECTION = 1
+SPEAKING_STARTED = 2
+SPEAKING_FINISHED = 3
+HANDOFF = 4
+SUBSCRIBE = 255
+
+MESSAGE_NAMES = {DETECTION: "detection", SPEAKING_STARTED: "speaking_started", SPEAKING_FINISHED: "speaking_finished", HANDOFF: "handoff"}
+
+PROTOCOL_VERSION = 1
+
+# frame length, version, type, sequence, object id, sent time (ns since the epoch), source length, payload length
+HEADER = struct.Struct("!HBBIiqBH")
+LENGTH = struct.Struct("!H")
+
+# Defaults for the EventBus configuration section.
+DEFAULT_BUS_CONFIG = {
+    "Enabled": False,
+    "Host": "127.0.0.1",
+    "Port": 47700,
+    # start the broker in this process when no other prop already runs one
+    "RunBroker": True
+}
+
+
+class BusMessage:
+    """
+    A decoded event bus message.
+    """
+    __slots__ = ("message_type", "sequence", "object_id", "sent_ns", "source", "payload", "received_ns")
+
+    def __init__(self, message_type, sequence, object_id, sent_ns, source, payload, received_ns=None):
+        self.message_type = message_type
+        self.sequence = sequence
+        self.object_id = object_id
+        self.sent_ns = sent_ns
+        self.source = source
+        self.payload = payload
+        self.received_ns = received_ns
+
+    @property
+    def name(self):
+        return MESSAGE_NAMES.get(self.message_type, str(self.message_type))
+
+    @property
+    def latency(self):
+        # both ends read the same clock when they run on one box
+        return (self.received_ns - self.sent_ns) / 1e9 if self.received_ns else None
+
+
+def encode_message(message_type: int, sequence: int, object_id: int, source: str, payload: str = "", sent_ns: int = None) -> bytes:
+    source_bytes = source.encode('utf-8')[:255]
+    payload_bytes = payload.encode('utf-8')[:65535 - HEADER.size - 255]
+    length = HEADER.size - LENGTH.size + len(source_bytes) + len(payload_bytes)
+    header = HEADER.pack(length, PROTOCOL_VERSION, message_type, sequence & 0xFFFFFFFF, object_id,
+                         sent_ns if sent_ns is not None else time.time_ns(), len(source_bytes), len(payload_bytes))
+    return header + source_bytes + payload_bytes
+
+
+def decode_message(frame: bytes) -> BusMessage:
+    """
+    Decodes a complete frame, including its length prefix.
+    """
+    _, version, message_type, sequence, object_id, sent_ns, source_length, payload_length = HEADER.unpack_from(frame)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported event bus protocol version {version}")
+    offset = HEADER.size
+    source = frame[offset:offset + source_length].decode('utf-8')
+    offset += source_length
+    payload = frame[offset:offset + payload_length].decode('utf-8')
+    return BusMessage(message_type, sequence, object_id, sent_ns, source, payload)
+
+
+def _read_frames(buffer: bytearray):
+    # yields every complete frame in the buffer and removes it
+    while len(buffer) >= LENGTH.size:
+        (length,) = LENGTH.unpack_from(buffer)
+        end = LENGTH.size + length
+        if len(buffer) < end:
+            return
+        frame = bytes(buffer[:end])
+        del buffer[:end]
+        yield frame
+
+
+class EventBroker:
+    """
+    A small TCP broker that relays event bus frames between the props on one box.
+
+    Frames are relayed without being decoded. Each client can subscribe to a set of message
+    types, and a client that stops reading loses frames rather than slowing the others down.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 47700, max_pending_bytes: int = 256 * 1024, logger=None):
+        self.host = host
+        self.port = port
+        self.max_pending_bytes = max_pending_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self.relayed = 0
+        self.dropped = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._clients = {}
+        self._server = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen()
+        self._server.setblocking(False)
+        self.port = self._server.getsockname()[1]
+        self._selector.register(self._server, selectors.EVENT_READ)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name="EventBroker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2.0)
+
+    def _serve(self):
+        while self._running:
+            for key, mask in self._selector.select(timeout=0.25):
+                if key.fileobj is self._server:
+                    self._accept()
+                    continue
+
+                client = self._clients.get(key.fileobj)
+                if client is None:
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._read(key.fileobj, client)
+                if mask & selectors.EVENT_WRITE and key.fileobj in self._clients:
+                    self._write(key.fileobj, client)
+
+        for connection in list(self._clients):
+            self._disconnect(connection)
+        self._selector.unregister(self._server)
+        self._server.close()
+
+    def _accept(self):
+        connection, _ = self._server.accept()
+        connection.setblocking(False)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._clients[connection] = {'inbox': bytearray(), 'outbox': bytearray(), 'types': None}
+        self._selector.register(connection, selectors.EVENT_READ)
+
+    def _disconnect(self, connection):
+        self._clients.pop(connection, None)
+        try:
+            self._selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+    def _read(self, connection, client):
+        try:
+            data = connection.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._disconnect(connection)
+            return
+
+        client['inbox'] += data
+        for frame in _read_frames(client['inbox']):
+            message_type = frame[3]
+            if message_type == SUBSCRIBE:
+                payload = decode_message(frame).payload
+                client['types'] = {int(t) for t in payload.split(',') if t} or None
+                continue
+            self._relay(connection, message_type, frame)
+
+    def _relay(self, sender, message_type, frame):
+        self.relayed += 1
+        for connection, client in list(self._clients.items()):
+            if connection is sender or (client['types'] is not None and message_type not in client['types']):
+                continue
+            if len(client['outbox']) + len(frame) > self.max_pending_bytes:
+                self.dropped += 1
+                continue
+            was_empty = not client['outbox']
+            client['outbox'] += frame
+            if was_empty:
+                self._write(connection, client)
+
+    def _write(self, connection, client):
+        try:
+            sent = connection.send(client['outbox'])
+            del client['outbox'][:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._disconnect(connection)
+            return
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client['outbox'] else 0)
+        self._selector.modify(connection, events)
+
+
+class EventBusClient:
+    """
+    Publishes and receives event bus messages through the broker.
+
+    Received messages are handed to the callbacks on a background thread.
+    """
+    def __init__(self, source: str, host: str = "127.0.0.1", port: int = 47700, message_types=None, logger=None):
+        self.source = source
+        self.logger = logger or logging.getLogger(__name__)
+        self.callbacks = []
+        self.received = 0
+        self._sequence = 0
+        self._send_lock = threading.Lock()
+
+        self._socket = socket.create_connection((host, port), timeout=5.0)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(None)
+
+        if message_types:
+            self._send(encode_message(SUBSCRIBE, 0, 0, source, ",".join(str(t) for t in message_types)))
+
+        self._thread = threading.Thread(target=self._receive, name=f"EventBus-{source}", daemon=True)
+        self._thread.start()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def publish(self, message_type: int, object_id: int = -1, payload: str = ""):
+        self._sequence += 1
+        self._send(encode_message(message_type, self._sequence, object_id if object_id is not None else -1, self.source, payload))
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+    def _send(self, frame: bytes):
+        try:
+            with self._send_lock:
+                self._socket.sendall(frame)
+        except OSError as e:
+            self.logger.warning(f"Unable to publish to the event bus: {str(e)}")
+
+    def _receive(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+
+            buffer += data
+            received_ns = time.time_ns()
+            for frame in _read_frames(buffer):
+                message = decode_message(frame)
+                message.received_ns = received_ns
+                self.received += 1
+                for callback in self.callbacks:
+                    try:
+                        callback(message)
+                    except Exception as e:
+                        self.logger.exception(f"Event bus callback failed: {str(e)}", exc_info=e)
+
+
+class PeerSpeakingMonitor:
+    """
+    Tracks which other props are speaking, based on their speaking_started and speaking_finished messages.
+    """
+    def __init__(self, max_speaking_seconds: float = 30.0):
+        self.max_speaking_seconds = max_speaking_seconds
+        self._speaking = {}
+        self._condition = threading.Condition()
+
+    def on_message(self, message: BusMessage):
+        with self._condition:
+            if message.message_type == SPEAKING_STARTED:
+                self._speaking[message.source] = time.time()
+            elif message.message_type == SPEAKING_FINISHED:
+                self._speaking.pop(message.source, None)
+                self._condition.notify_all()
+
+    def speaking_peers(self):
+        with self._condition:
+            return self._active_peers()
+
+    def wait_until_quiet(self, timeout: float = 10.0) -> float:
+        """
+        Blocks until no other prop is speaking or the timeout expires.
+
+        Returns:
+            float: The number of seconds waited.
+        """
+        started = time.time()
+        with self._condition:
+            while self._active_peers() and time.time() - started < timeout:
+                self._condition.wait(timeout=min(0.5, timeout))
+        return time.time() - started
+
+    def _active_peers(self):
+        # a prop that crashed mid sentence never says it finished, forget it after a while
+        cutoff = time.time() - self.max_speaking_seconds
+        for source in [s for s, started in self._speaking.items() if started < cutoff]:
+            del self._speaking[source]
+        return list(self._speaking)
+
+
+def connect_event_bus(config: dict, source: str, message_types=None, logger=None):
+    """
+    Connects to the event bus described by the EventBus configuration section, starting a broker when needed.
+
+    Returns:
+        tuple: The client (None when the bus is disabled) and the broker started by this process (or None).
+    """
+    bus_config = merge_defaults(DEFAULT_BUS_CONFIG, config.get("EventBus"))
+    if not bus_config["Enabled"]:
+        return None, None
+
+    logger = logger or logging.getLogger(__name__)
+    broker = None
+    if bus_config["RunBroker"]:
+        try:
+            broker = EventBroker(bus_config["Host"], bus_config["Port"], logger=logger).start()
+            logger.info(f"Event bus broker listening on {bus_config['Host']}:{broker.port}")
+        except OSError:
+            # another prop on this box already runs the broker
+            broker = None
+
+    return EventBusClient(source, bus_config["Host"], bus_config["Port"], message_types, logger), broker
+
+
+def _benchmark_subscriber(port, expected, ready, results):
+    # runs in its own process, collects the delivery latency of every message it receives
+    latencies = []
+    done = threading.Event()
+
+    def on_message(message):
+        latencies.append(message.latency)
+        if len(latencies) >= expected:
+            done.set()
+
+    client = EventBusClient(f"subscriber-{port}", port=port, message_types=[DETECTION])
+    client.add_callback(on_message)
+    ready.set()
+    done.wait(timeout=30)
+    client.close()
+    results.put(latencies)
+
+
+def run_latency_benchmark(subscriber_count: int = 3, message_count: int = 2000, rate: float = 1000.0, port: int = 0):
+    """
+    Measures delivery latency between processes: one publisher, several subscriber processes and a local broker.
+
+    Args:
+        subscriber_count (int): The number of subscriber processes.
+        message_count (int): The number of messages to publish.
+        rate (float): Messages per second, 0 publishes as fast as possible.
+        port (int): Broker port, 0 picks a free one.
+
+    Returns:
+        dict: Message counts and latency percentiles in milliseconds.
+    """
+    import multiprocessing
+
+    broker = EventBroker(port=port).start()
+    results = multiprocessing.Queue()
+    processes = []
+    for _ in range(subscriber_count):
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=_benchmark_subscriber, args=(broker.port, message_count, ready, results), daemon=True)
+        process.start()
+        ready.wait(timeout=10)
+        processes.append(process)
+
+    # give the subscriptions a moment to reach the broker
+    time.sleep(0.2)
+    publisher = EventBusClient("publisher", port=broker.port)
+    interval = 1.0 / rate if rate > 0 else 0
+    started = time.perf_counter()
+    for index in range(message_count):
+        publisher.publish(DETECTION, index, "person")
+        if interval:
+            delay = started + (index + 1) * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for _ in processes:
+        try:
+            latencies.extend(results.get(timeout=35))
+        except Exception:
+            pass
+    for process in processes:
+        process.join(timeout=5)
+    publisher.close()
+    broker.stop()
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else None
+    return {
+        'published': message_count,
+        'delivered': len(latencies),
+        'expected': message_count * subscriber_count,
+        'publish_rate': round(message_count / elapsed, 1) if elapsed else None,
+        'dropped_by_broker': broker.dropped,
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': latencies[-1] * 1000 if latencies else None
+    }
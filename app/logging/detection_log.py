@@ -0,0 +1,113 @@
+# detection_log.py
+import os
+import queue
+import atexit
+import threading
+
+
+class DetectionLog:
+    """
+    A single buffered appender for the daily detection_log_<date>.txt files.
+
+    Callers only put the line on a queue, a background thread keeps the current day's file open
+    and writes the lines in batches, flushing at most once per flush interval.
+    """
+    def __init__(self, log_dir: str, flush_interval: float = 1.0, queue_size: int = 10000):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.dropped = 0
+
+        self._queue = queue.Queue(queue_size)
+        self._file = None
+        self._file_date = None
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._write_loop, name="DetectionLogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, timestamp: str, message: str):
+        """
+        Queues a line for the detection log of the day in the timestamp.
+
+        Args:
+            timestamp (str): The detection timestamp (YYYY-mm-dd_HH-MM-SS), the first 10 characters select the file.
+            message (str): The line to write.
+        """
+        try:
+            self._queue.put_nowait((timestamp[:10], message))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """
+        Blocks until the lines queued so far have been written.
+        """
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self._queue.get(True, self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [item]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    self._flush_file()
+                    item.set()
+                else:
+                    self._write(*item)
+
+            self._flush_file()
+            if stop:
+                self._close_file()
+                return
+
+    def _write(self, date: str, message: str):
+        try:
+            if date != self._file_date:
+                self._close_file()
+                self._file = open(os.path.join(self.log_dir, f"detection_log_{date}.txt"), 'a', buffering=64 * 1024)
+                self._file_date = date
+            self._file.write(message + '\n')
+        except OSError:
+            self.dropped += 1
+
+    def _flush_file(self):
+        if self._file:
+            try:
+                self._file.flush()
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self._file:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            self._file_date = None
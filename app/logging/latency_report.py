@@ -0,0 +1,259 @@
+# latency_report.py
+import math
+import os
+import re
+from datetime import datetime
+
+LOG_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) - ([^ ]+) - ([A-Z]+) - (.*)$")
+DETECTION_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}) - Detected: ")
+RECORDING_TIME = re.compile(r"recording time: ([0-9.]+)")
+TRANSCRIPTION_TIME = re.compile(r"Transciption Metrics: ([0-9.]+)")
+FIRST_API_CALL = re.compile(r"Detection to first API call: ([0-9.]+)s")
+DETECTED_OBJECT = re.compile(r" - Detected: .*, ID: (\d+)$")
+SESSION_STARTED = re.compile(r"^Starting session for object (\d+)")
+SESSION_DROPPED = re.compile(r"^Session for object (\d+) (?:cancelled|expired|failed)")
+SESSION_REJECTED = re.compile(r"not starting a session for object (\d+)\.$")
+
+# main.py logs under its module name, which is __main__ when it is run as a script
+MAIN_LOGGERS = ("main", "__main__")
+
+# messages that close an interaction
+END_MESSAGES = ("End trigger word detected", "Reached the maximum exchange count", "Playing goodbye message", "Printing goodbye message")
+
+
+class StreamingHistogram:
+    """
+    A fixed size, log-bucketed histogram, percentiles are accurate to within a few percent
+    no matter how many samples are added.
+    """
+    def __init__(self, minimum: float = 0.001, maximum: float = 3600.0, growth: float = 1.05):
+        self.minimum = minimum
+        self.growth = growth
+        self.bucket_count = int(math.ceil(math.log(maximum / minimum) / math.log(growth))) + 2
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        if value < 0:
+            return
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        if value < self.minimum:
+            index = 0
+        else:
+            index = min(self.bucket_count - 1, 1 + int(math.log(value / self.minimum) / math.log(self.growth)))
+        self.buckets[index] += 1
+
+    def percentile(self, percent: float):
+        if self.count == 0:
+            return None
+        target = self.count * percent / 100.0
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target:
+                if index == 0:
+                    return self.min
+                # report the middle of the bucket, clamped to what was actually observed
+                value = self.minimum * self.growth ** (index - 0.5)
+                return max(self.min, min(self.max, value))
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class Interaction:
+    """
+    The part of one visitor's interaction the report still needs while reading the log.
+    """
+    __slots__ = ("start", "awaiting_first_listen", "last_user_response", "exchange_count")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.awaiting_first_listen = True
+        self.last_user_response = None
+        self.exchange_count = 0
+
+
+class LatencyReport:
+    """
+    Rebuilds interactions from app.log and the detection logs one line at a time.
+
+    Interactions are keyed by the object id in the detection and session lines, groups wait in line
+    while another group talks so several can be open at once. Lines without an id, the listens,
+    responses and goodbyes, belong to the session that started last, or to the last detection in logs
+    without session lines. Only the open interactions are
+    held in memory, every measurement goes straight into a fixed size histogram.
+    """
+    def __init__(self):
+        self.recording_time = StreamingHistogram()
+        self.transcription_time = StreamingHistogram()
+        self.greeting_gap = StreamingHistogram()
+        self.response_gap = StreamingHistogram()
+        self.first_api_call = StreamingHistogram()
+        self.interaction_duration = StreamingHistogram()
+        self.exchanges = StreamingHistogram(minimum=1, maximum=1000)
+        self.interactions_per_hour = {}
+        self.detections_per_hour = {}
+        self.interactions = 0
+        self.abandoned = 0
+        self.lines = 0
+
+        self._open = {}
+        self._active = None
+        # once a SessionManager line is seen, only it decides which interaction is talking
+        self._sessions_seen = False
+
+    def read_app_log(self, path: str):
+        with open(path, 'r', encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                self.lines += 1
+                match = LOG_LINE.match(line)
+                if match:
+                    self._handle(datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp() + int(match.group(2)) / 1000,
+                                 match.group(3), match.group(5).rstrip())
+        # a log that ends mid conversation still counts up to the last line read
+        self._close_all()
+
+    def read_detection_log(self, path: str):
+        with open(path, 'r', encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                self.lines += 1
+                match = DETECTION_LINE.match(line)
+                if match:
+                    hour = datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S").strftime("%Y-%m-%d %H:00")
+                    self.detections_per_hour[hour] = self.detections_per_hour.get(hour, 0) + 1
+
+    def _handle(self, timestamp: float, logger: str, message: str):
+        if logger in MAIN_LOGGERS:
+            detected = DETECTED_OBJECT.search(message)
+            active = self._open.get(self._active)
+            if detected:
+                object_id = detected.group(1)
+                self._close_interaction(object_id, None)
+                if not self._sessions_seen:
+                    # older logs and the multi-prop orchestrator have no session lines, one visitor is talked to at a time
+                    self._close_interaction(self._active, None)
+                    self._active = object_id
+                self._open[object_id] = Interaction(timestamp)
+                hour = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:00")
+                self.interactions_per_hour[hour] = self.interactions_per_hour.get(hour, 0) + 1
+            elif message.startswith("Initailizing SpookyPi"):
+                # the process restarted, whatever was in progress was cut short
+                self._close_all()
+                self._sessions_seen = False
+            elif message.startswith("User response:") and active is not None:
+                active.last_user_response = timestamp
+                active.exchange_count += 1
+            elif message.startswith(END_MESSAGES):
+                self._close_interaction(self._active, timestamp)
+            else:
+                match = FIRST_API_CALL.search(message)
+                if match:
+                    self.first_api_call.add(float(match.group(1)))
+
+        elif logger == "SessionManager":
+            started = SESSION_STARTED.search(message)
+            if started:
+                self._sessions_seen = True
+                self._active = started.group(1)
+                return
+            # groups that were turned away, left before their turn or whose session failed get no goodbye
+            dropped = SESSION_DROPPED.search(message) or SESSION_REJECTED.search(message)
+            if dropped:
+                self._close_interaction(dropped.group(1), None)
+
+        elif logger == "VoiceService":
+            if message.startswith("Listening for user response"):
+                active = self._open.get(self._active)
+                if active is None:
+                    return
+                if active.awaiting_first_listen:
+                    self.greeting_gap.add(timestamp - active.start)
+                    active.awaiting_first_listen = False
+                elif active.last_user_response is not None:
+                    self.response_gap.add(timestamp - active.last_user_response)
+                active.last_user_response = None
+            else:
+                match = RECORDING_TIME.search(message)
+                if match:
+                    self.recording_time.add(float(match.group(1)))
+                match = TRANSCRIPTION_TIME.search(message)
+                if match:
+                    self.transcription_time.add(float(match.group(1)))
+
+    def _close_interaction(self, object_id, end_time):
+        interaction = self._open.pop(object_id, None)
+        if object_id == self._active:
+            self._active = None
+        if interaction is None:
+            return
+        if end_time is None:
+            self.abandoned += 1
+        else:
+            self.interaction_duration.add(end_time - interaction.start)
+        self.exchanges.add(interaction.exchange_count)
+        self.interactions += 1
+
+    def _close_all(self):
+        for object_id in list(self._open):
+            self._close_interaction(object_id, None)
+
+    def format(self) -> str:
+        lines = [f"Lines read: {self.lines}", f"Interactions: {self.interactions} ({self.abandoned} ended without a goodbye)", ""]
+        lines.append(f"{'Stage (seconds)':<34}{'count':>7}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for name, histogram in (
+            ("Detection to first API call", self.first_api_call),
+            ("Detection to first listen", self.greeting_gap),
+            ("Recording time", self.recording_time),
+            ("Transcription time", self.transcription_time),
+            ("Response gap (user -> next listen)", self.response_gap),
+            ("Interaction duration", self.interaction_duration),
+            ("Exchanges per interaction", self.exchanges),
+        ):
+            if histogram.count == 0:
+                lines.append(f"{name:<34}{0:>7}")
+                continue
+            lines.append(f"{name:<34}{histogram.count:>7}{histogram.mean:>9.2f}{histogram.percentile(50):>9.2f}"
+                         f"{histogram.percentile(90):>9.2f}{histogram.percentile(99):>9.2f}{histogram.max:>9.2f}")
+
+        lines.append("")
+        lines.append(f"{'Hour':<20}{'interactions':>14}{'detections':>12}")
+        for hour in sorted(set(self.interactions_per_hour) | set(self.detections_per_hour)):
+            lines.append(f"{hour:<20}{self.interactions_per_hour.get(hour, 0):>14}{self.detections_per_hour.get(hour, 0):>12}")
+
+        return "\n".join(lines)
+
+
+def build_latency_report(paths) -> LatencyReport:
+    """
+    Builds a latency report from app.log files, detection logs or directories containing them.
+
+    Args:
+        paths (list): Files or directories to read, detection_log_*.txt files are recognized by name.
+
+    Returns:
+        LatencyReport: The populated report.
+    """
+    report = LatencyReport()
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(('.log', '.txt'))]
+        else:
+            files = [path]
+
+        for file_path in files:
+            if os.path.basename(file_path).startswith("detection_log_"):
+                report.read_detection_log(file_path)
+            else:
+                report.read_app_log(file_path)
+
+    return report
@@ -3,15 +3,22 @@ import logging, logging.config
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
-from opentelemetry.sdk._logs import (
-    LoggerProvider,
-    LoggingHandler,
-)
-from azure.monitor.opentelemetry import configure_azure_monitor
-from opentelemetry._logs import set_logger_provider
+from app.logging.tracing import VisitorSpanProcessor, JsonLinesSpanExporter
+from app.logging.pipeline import install_log_pipeline
+import os
+import atexit
+from app.configuration import merge_defaults
 
-from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
-from azure.monitor.opentelemetry.exporter import AzureMonitorLogExporter
+# Defaults for the Telemetry configuration section.
+DEFAULT_TELEMETRY_CONFIG = {
+    # none | console | file
+    "TraceExporter": "none",
+    "TraceFile": "logs/traces.jsonl",
+    # write log records from a background thread so slow disks or exporters never stall the caller
+    "AsyncLogging": True,
+    "LogQueueSize": 10000,
+    "LogFlushInterval": 1.0
+}
 
 class LogService:
     def __init__(self, config):
@@ -24,7 +31,10 @@ class LogService:
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
         
+        self.queue_handler = None
+        self.log_listener = None
         self._configure_logging()
+        self._configure_pipeline()
 
 
     def _configure_logging(self):
@@ -32,21 +42,27 @@ class LogService:
         self.logger = logging.getLogger(__name__)
         
         # Azure App Insights setup
-        azure_connection_string = self.config["Azure"]["MonitorConnectionString"] or ""
+        azure_connection_string = self.config["Azure"].get("MonitorConnectionString") or ""
+
+        # OpenTelemetry setup
+        self._configure_tracing(azure_connection_string)
 
         if azure_connection_string == "":
             # log and exit, we are done here.
             self.logger.warning("Azure Monitor connection string is not set.")
             return
         
-        # OpenTelemetry setup
-        trace.set_tracer_provider(TracerProvider())
-        tracer = trace.get_tracer(__name__)
-        span_processor = BatchSpanProcessor(ConsoleSpanExporter())
-        trace.get_tracer_provider().add_span_processor(span_processor)
-        
+        # the azure monitor stack is heavy, it is only imported when it is configured.
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        from azure.monitor.opentelemetry.exporter import AzureMonitorLogExporter
+        from opentelemetry._logs import set_logger_provider
+        from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+        from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
+
+        # tracing is already wired to our provider above, let azure monitor handle the rest.
         configure_azure_monitor(
            connection_string=azure_connection_string,
+           disable_tracing=True
         )
 
         logger_provider = LoggerProvider()
@@ -58,5 +74,61 @@ class LogService:
         handler = LoggingHandler()
         logging.getLogger().addHandler(handler)                                                                                                                     
 
+    def _configure_pipeline(self):
+        telemetry_config = merge_defaults(DEFAULT_TELEMETRY_CONFIG, self.config.get("Telemetry"))
+
+        if not telemetry_config["AsyncLogging"]:
+            return
+
+        self.queue_handler, self.log_listener = install_log_pipeline(telemetry_config["LogQueueSize"], telemetry_config["LogFlushInterval"])
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """
+        Drains the log queue and stops the background writer.
+        """
+        if self.log_listener is None:
+            return
+
+        listener, self.log_listener = self.log_listener, None
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+        if self.queue_handler.dropped:
+            print(f"{self.queue_handler.dropped} log records were dropped because the log queue was full.")
+
+    def _configure_tracing(self, azure_connection_string):
+        telemetry_config = merge_defaults(DEFAULT_TELEMETRY_CONFIG, self.config.get("Telemetry"))
+        trace_exporter = telemetry_config["TraceExporter"]
+
+        if trace_exporter == "none" and azure_connection_string == "":
+            # nothing will consume the spans, leave the no-op tracer in place.
+            return
+
+        tracer_provider = TracerProvider()
+        tracer_provider.add_span_processor(VisitorSpanProcessor())
+
+        if trace_exporter == "console":
+            tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+        elif trace_exporter == "file":
+            trace_file = telemetry_config["TraceFile"]
+            if not os.path.isabs(trace_file):
+                trace_file = os.path.join(os.path.dirname(__file__), '..', '..', trace_file)
+            tracer_provider.add_span_processor(BatchSpanProcessor(JsonLinesSpanExporter(trace_file)))
+            self.logger.info(f"Writing trace spans to {os.path.abspath(trace_file)}")
+        elif trace_exporter != "none":
+            self.logger.warning(f"Unknown trace exporter {trace_exporter}, spans will only be sent to Azure Monitor.")
+
+        if azure_connection_string != "":
+            from azure.monitor.opentelemetry.exporter import AzureMonitorTraceExporter
+            tracer_provider.add_span_processor(BatchSpanProcessor(AzureMonitorTraceExporter(connection_string=azure_connection_string)))
+
+        trace.set_tracer_provider(tracer_provider)
+
     def get_logger(self, name):
-        return logging.getLogger(name)
\ No newline at end of file
+        return logging.getLogger(name)
+
+    def get_tracer(self, name):
+        return trace.get_tracer(name)
\ No newline at end of file
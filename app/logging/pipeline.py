@@ -0,0 +1,117 @@
+# pipeline.py
+import queue
+import logging
+import logging.handlers
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    A FileHandler that does not flush after every record once it sits behind the log pipeline.
+
+    The pipeline's writer thread then flushes it once per batch, so a slow SD card costs one write
+    per batch instead of one per log line. Without the pipeline it flushes like any FileHandler.
+    """
+    # set by install_log_pipeline
+    pipelined = False
+
+    def flush(self):
+        # behind the pipeline flushing is driven by the writer thread, see flush_batch
+        if not self.pipelined:
+            super().flush()
+
+    def flush_batch(self):
+        super().flush()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that never blocks the caller, records are dropped (and counted) when the queue is full.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Drains the log queue on a background thread in batches and flushes the handlers once per batch.
+    """
+    def __init__(self, log_queue, *handlers, batch_size: int = 256, flush_interval: float = 1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def enqueue_sentinel(self):
+        # unlike the callers, shutdown can afford to wait for room in the queue
+        self.queue.put(self._sentinel, timeout=5.0)
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            try:
+                record = q.get(True, self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+                q.task_done()
+
+            self._flush_handlers()
+            if stop:
+                break
+
+    def _flush_handlers(self):
+        for handler in self.handlers:
+            try:
+                if hasattr(handler, 'flush_batch'):
+                    handler.flush_batch()
+                else:
+                    handler.flush()
+            except Exception:
+                handler.handleError(None)
+
+
+def install_log_pipeline(queue_size: int = 10000, flush_interval: float = 1.0):
+    """
+    Moves every handler on the root logger behind a bounded queue serviced by a background writer.
+
+    Args:
+        queue_size (int): The maximum number of records waiting to be written.
+        flush_interval (float): The maximum number of seconds a record waits before being flushed.
+
+    Returns:
+        tuple: The queue handler now attached to the root logger and the running listener.
+    """
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_queue = queue.Queue(queue_size)
+
+    queue_handler = DroppingQueueHandler(log_queue)
+    listener = BatchingQueueListener(log_queue, *handlers, flush_interval=flush_interval)
+
+    for handler in handlers:
+        root.removeHandler(handler)
+        if isinstance(handler, BufferedFileHandler):
+            handler.pipelined = True
+    root.addHandler(queue_handler)
+
+    listener.start()
+    return queue_handler, listener
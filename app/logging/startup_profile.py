@@ -0,0 +1,119 @@
+# startup_profile.py
+import os
+import sys
+import time
+import builtins
+import threading
+from contextlib import contextmanager
+
+# Imports and phases faster than this are left out of the timeline.
+MIN_DURATION = 0.005
+
+# How deep nested imports are shown, 0 is the import made by our own code.
+MAX_DEPTH = 2
+
+_profiler = None
+
+
+class StartupProfiler:
+    """
+    Records a timeline of first-time module imports and named initialization phases.
+
+    Imports are timed by wrapping the import builtin, only imports made from the main thread are
+    recorded and the time of an import includes everything it imports in turn.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.entries = []
+        self._depth = 0
+        self._main_thread = threading.main_thread()
+        self._original_import = None
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules or threading.current_thread() is not self._main_thread:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        depth = self._depth
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self._record("import", name, start, depth)
+
+    @contextmanager
+    def phase(self, name):
+        depth = self._depth
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self._record("init", name, start, depth)
+
+    def _record(self, kind, name, start, depth):
+        duration = time.perf_counter() - start
+        if depth <= MAX_DEPTH and duration >= MIN_DURATION:
+            self.entries.append((start - self.started, duration, kind, name, depth))
+
+    def format(self, title="Startup") -> str:
+        total = time.perf_counter() - self.started
+        lines = [f"{title} timeline, {total:.3f}s total:"]
+        for offset, duration, kind, name, depth in sorted(self.entries, key=lambda entry: (entry[0], entry[4])):
+            lines.append(f"  +{offset:7.3f}s {duration:7.3f}s  {'  ' * depth}{kind:<6} {name}")
+        return "\n".join(lines)
+
+
+def profiling_requested() -> bool:
+    """
+    True when the process was started with --profile_startup or SPOOKYPI_PROFILE_STARTUP is set.
+    """
+    return "--profile_startup" in sys.argv or os.getenv("SPOOKYPI_PROFILE_STARTUP", "") not in ("", "0")
+
+
+def start_profiling():
+    """
+    Starts recording the startup timeline, call it before the imports that should be measured.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        _profiler.install()
+    return _profiler
+
+
+@contextmanager
+def startup_phase(name):
+    """
+    Times an initialization phase, does nothing when the startup profiler is not running.
+    """
+    if _profiler is None:
+        yield
+        return
+
+    with _profiler.phase(name):
+        yield
+
+
+def finish_profiling(title="Startup"):
+    """
+    Prints the timeline and stops recording, does nothing when the startup profiler is not running.
+    """
+    global _profiler
+    if _profiler is None:
+        return
+
+    profiler, _profiler = _profiler, None
+    profiler.uninstall()
+    print(profiler.format(title))
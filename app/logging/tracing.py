@@ -0,0 +1,71 @@
+# tracing.py
+import os
+import json
+import threading
+from contextlib import contextmanager
+from opentelemetry import trace, baggage, context
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+# Baggage key (and span attribute) used to tie every span of an interaction to the visitor.
+VISITOR_ID_KEY = "spookypi.object_id"
+
+
+class VisitorSpanProcessor(SpanProcessor):
+    """
+    Copies the visitor/object id from the current baggage onto every span when it starts.
+
+    This lets services deep in the pipeline create spans without knowing who they are talking to.
+    """
+    def on_start(self, span, parent_context=None):
+        object_id = baggage.get_baggage(VISITOR_ID_KEY, parent_context)
+        if object_id is not None:
+            span.set_attribute(VISITOR_ID_KEY, object_id)
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """
+    Writes finished spans to a local file, one JSON document per line, for offline analysis.
+    """
+    def __init__(self, file_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._file = open(file_path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        try:
+            with self._lock:
+                for span in spans:
+                    self._file.write(json.dumps(json.loads(span.to_json()), separators=(",", ":")) + '\n')
+                self._file.flush()
+            return SpanExportResult.SUCCESS
+        except Exception:
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        with self._lock:
+            self._file.flush()
+        return True
+
+
+@contextmanager
+def visitor_context(object_id):
+    """
+    Marks everything that runs inside the block as belonging to the given visitor.
+
+    Args:
+        object_id: The id the detector assigned to the visitor.
+    """
+    token = context.attach(baggage.set_baggage(VISITOR_ID_KEY, str(object_id)))
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+
+def get_tracer(name: str):
+    return trace.get_tracer(name)
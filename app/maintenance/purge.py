@@ -0,0 +1,187 @@
+# purge.py
+import time
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# The blob batch api accepts at most 256 sub-requests per call.
+MAX_BLOB_BATCH = 256
+
+# Connection string of the local Azurite storage emulator.
+EMULATOR_CONNECTION_STRING = "UseDevelopmentStorage=true"
+
+
+class PurgeReport:
+    """
+    Counts what a purge listed, matched and deleted, and how fast it went.
+    """
+    def __init__(self, kind: str, dry_run: bool = False):
+        self.kind = kind
+        self.dry_run = dry_run
+        self.listed = 0
+        self.matched = 0
+        self.deleted = 0
+        self.failed = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        return self.deleted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def format(self) -> str:
+        if self.dry_run:
+            return f"Dry run: {self.matched} of {self.listed} {self.kind} would be deleted (listed in {self.elapsed:.1f}s)."
+        return (f"Deleted {self.deleted} of {self.matched} matching {self.kind} ({self.listed} listed, {self.failed} failed) "
+                f"in {self.elapsed:.1f}s, {self.rate:.1f}/s.")
+
+
+def _cutoff(older_than_days):
+    if older_than_days is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(days=older_than_days)
+
+
+def _run_purge(batches, delete_batch, report, workers, progress=None):
+    """
+    Deletes batches on a bounded pool while the listing keeps paging.
+
+    At most twice as many batches as there are workers are in flight, so memory stays flat no
+    matter how many items the listing returns.
+    """
+    def collect(futures):
+        for future in futures:
+            deleted, failed = future.result()
+            report.deleted += deleted
+            report.failed += failed
+        if progress:
+            progress(report)
+
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Purge") as pool:
+        for batch in batches:
+            report.matched += len(batch)
+            if report.dry_run:
+                continue
+
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(delete_batch, batch))
+
+        collect(wait(in_flight).done)
+
+    report.finished = time.time()
+    return report
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def purge_assistants(openai_client, older_than_days: float = None, name_prefix: str = None, dry_run: bool = False,
+                     workers: int = 8, progress=None) -> PurgeReport:
+    """
+    Deletes assistants, optionally only the ones older than a number of days or whose name starts with a prefix.
+
+    The assistants api has no batch delete, the deletes run one call each on a bounded pool.
+
+    Args:
+        openai_client (OpenAI): The OpenAI client, its base url may point at a local emulator.
+        older_than_days (float): Only delete assistants created more than this many days ago.
+        name_prefix (str): Only delete assistants whose name starts with this prefix.
+        dry_run (bool): Only count the assistants that would be deleted.
+        workers (int): Number of concurrent delete calls.
+        progress (callable): Called with the report after each completed batch.
+
+    Returns:
+        PurgeReport: What was listed, matched and deleted.
+    """
+    report = PurgeReport("assistants", dry_run)
+    cutoff = _cutoff(older_than_days)
+
+    def matching():
+        # iterating the page fetches the next page as it goes
+        for assistant in openai_client.beta.assistants.list(limit=100):
+            report.listed += 1
+            if cutoff and datetime.fromtimestamp(assistant.created_at, timezone.utc) > cutoff:
+                continue
+            if name_prefix and not (assistant.name or "").startswith(name_prefix):
+                continue
+            yield assistant.id
+
+    def delete_batch(batch):
+        deleted = failed = 0
+        for assistant_id in batch:
+            try:
+                openai_client.beta.assistants.delete(assistant_id)
+                deleted += 1
+            except Exception:
+                failed += 1
+        return deleted, failed
+
+    # one assistant per task keeps all workers busy
+    return _run_purge(_batched(matching(), 1), delete_batch, report, workers, progress)
+
+
+def purge_storage_blobs(container_client, older_than_days: float = None, prefix: str = None, dry_run: bool = False,
+                        workers: int = 4, batch_size: int = MAX_BLOB_BATCH, progress=None) -> PurgeReport:
+    """
+    Deletes blobs from a container with batch requests, optionally only the ones older than a
+    number of days or whose name starts with a prefix.
+
+    The listing is paged and the prefix is applied by the service. When the service does not
+    support batch requests the batch falls back to one delete per blob.
+
+    Args:
+        container_client (ContainerClient): The container to purge.
+        older_than_days (float): Only delete blobs last modified more than this many days ago.
+        prefix (str): Only delete blobs whose name starts with this prefix.
+        dry_run (bool): Only count the blobs that would be deleted.
+        workers (int): Number of concurrent batch requests.
+        batch_size (int): Blobs per batch request, at most 256.
+        progress (callable): Called with the report after each completed batch.
+
+    Returns:
+        PurgeReport: What was listed, matched and deleted.
+    """
+    report = PurgeReport("blobs", dry_run)
+    cutoff = _cutoff(older_than_days)
+    batch_size = max(1, min(batch_size, MAX_BLOB_BATCH))
+
+    def matching():
+        for page in container_client.list_blobs(name_starts_with=prefix or None, results_per_page=5000).by_page():
+            for blob in page:
+                report.listed += 1
+                if cutoff and blob.last_modified and blob.last_modified > cutoff:
+                    continue
+                yield blob.name
+
+    def delete_batch(names):
+        try:
+            responses = container_client.delete_blobs(*names, raise_on_any_failure=False)
+            deleted = sum(1 for response in responses if response.status_code in (200, 202, 404))
+            return deleted, len(names) - deleted
+        except Exception:
+            pass
+
+        deleted = failed = 0
+        for name in names:
+            try:
+                container_client.delete_blob(name)
+                deleted += 1
+            except Exception:
+                failed += 1
+        return deleted, failed
+
+    return _run_purge(_batched(matching(), batch_size), delete_batch, report, workers, progress)
@@ -0,0 +1,305 @@
+# self_test.py
+import os
+import json
+import time
+import shutil
+import platform
+from datetime import datetime, timezone
+from app.configuration import merge_defaults
+
+# Defaults for the SelfTest configuration section.
+DEFAULT_SELF_TEST_CONFIG = {
+    # frames read from the camera for the frame rate and latency
+    "CameraFrames": 60,
+    # YOLO passes timed after one warm-up pass
+    "InferenceRuns": 5,
+    # seconds of ambient noise calibration, the prop calibrates for 2 seconds before every answer
+    "CalibrationSeconds": 2.0,
+    # data written to the captures directory, in files the size of a capture
+    "DiskWriteMB": 32,
+    "BaselinePath": "logs/self_test_baseline.json",
+    # a result this much worse than the baseline (0.25 = 25%) is reported as a regression
+    "RegressionTolerance": 0.25,
+    # limits per result, CameraFps and DiskWriteMBps are minimums, the rest are maximums
+    "Thresholds": {
+        "CameraFps": 10.0,
+        "CameraStartMs": 3000.0,
+        "CameraLatencyMs": 150.0,
+        "InferenceMs": 2500.0,
+        "MicrophoneOpenMs": 1000.0,
+        "MicrophoneCalibrationMs": 2500.0,
+        "AudioStartMs": 500.0,
+        "DiskWriteMBps": 5.0,
+        "CaptureWriteMs": 100.0
+    }
+}
+
+# Results where a bigger number is better, every other result is a time.
+HIGHER_IS_BETTER = {"CameraFps", "DiskWriteMBps"}
+
+# Size of the files written by the disk test, about one 1280 pixel wide capture.
+CAPTURE_SIZE = 200 * 1024
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class SelfTestReport:
+    """
+    The results of a hardware self-test, checked against the thresholds and an earlier baseline.
+
+    Args:
+        thresholds (dict): The limit per result name.
+        baseline (dict): The results of an earlier run, None when there is no baseline.
+        tolerance (float): How much worse than the baseline a result may get.
+    """
+    def __init__(self, thresholds: dict, baseline: dict = None, tolerance: float = 0.25):
+        self.thresholds = thresholds
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.results = {}
+        self.details = {}
+        self.errors = {}
+
+    def add(self, name: str, value: float):
+        self.results[name] = round(value, 3)
+
+    def passed(self, name: str) -> bool:
+        limit = self.thresholds.get(name)
+        if limit is None:
+            return True
+        value = self.results[name]
+        return value >= limit if name in HIGHER_IS_BETTER else value <= limit
+
+    def change(self, name: str):
+        """
+        Returns how much worse (positive) or better (negative) a result is than the baseline, None without one.
+        """
+        previous = (self.baseline or {}).get("Results", {}).get(name)
+        if not previous:
+            return None
+        change = (self.results[name] - previous) / previous
+        return -change if name in HIGHER_IS_BETTER else change
+
+    @property
+    def failures(self):
+        return [name for name in self.results if not self.passed(name)] + list(self.errors)
+
+    @property
+    def regressions(self):
+        return [name for name in self.results if (self.change(name) or 0.0) > self.tolerance]
+
+    def to_baseline(self) -> dict:
+        return {
+            "CreatedAt": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "Host": platform.node(),
+            "Details": self.details,
+            "Results": self.results
+        }
+
+    def format(self) -> str:
+        lines = [f"{'Result':<26}{'Value':>10}{'Limit':>10}{'Baseline':>10}{'Change':>9}"]
+        for name, value in self.results.items():
+            limit = self.thresholds.get(name)
+            limit_text = f"{'>=' if name in HIGHER_IS_BETTER else '<='}{limit:g}" if limit is not None else "-"
+            previous = (self.baseline or {}).get("Results", {}).get(name)
+            change = self.change(name)
+            flags = ("" if self.passed(name) else " FAIL") + (" REGRESSED" if name in self.regressions else "")
+            lines.append(f"{name:<26}{value:>10.1f}{limit_text:>10}{f'{previous:.1f}' if previous is not None else '-':>10}"
+                         f"{f'{change:+.0%}' if change is not None else '-':>9}{flags}")
+        for name, error in self.errors.items():
+            lines.append(f"{name:<26}{'error':>10}  {error}")
+        for name, detail in self.details.items():
+            lines.append(f"{name}: {detail}")
+        if self.baseline:
+            lines.append(f"Compared with the baseline from {self.baseline.get('CreatedAt')} on {self.baseline.get('Host')}, "
+                         f"{len(self.regressions)} regressed by more than {self.tolerance:.0%}.")
+        lines.append(f"{sum(self.passed(name) for name in self.results)} of {len(self.results)} results within their limits, "
+                     f"{len(self.errors)} tests failed to run.")
+        return "\n".join(lines)
+
+
+def self_test_config(config: dict) -> dict:
+    """
+    Returns the SelfTest section of a configuration with the defaults filled in, thresholds are merged per result.
+    """
+    test_config = merge_defaults(DEFAULT_SELF_TEST_CONFIG, (config or {}).get('SelfTest'))
+    test_config["Thresholds"] = merge_defaults(DEFAULT_SELF_TEST_CONFIG["Thresholds"], test_config["Thresholds"])
+    return test_config
+
+
+def resolve_path(path: str) -> str:
+    if os.path.isabs(path):
+        return path
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', path))
+
+
+def load_baseline(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(report: SelfTestReport, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as baseline_file:
+        json.dump(report.to_baseline(), baseline_file, indent=4)
+
+
+def measure_camera(report: SelfTestReport, device_index, frames: int):
+    """
+    Opens the camera the detector uses and reads frames as fast as it delivers them.
+
+    Returns:
+        ndarray: The last frame, for the inference test.
+    """
+    import cv2
+    start_time = time.perf_counter()
+    capture = cv2.VideoCapture(device_index)
+    try:
+        ok, frame = capture.read()
+        if not ok:
+            raise RuntimeError(f"Camera {device_index} did not deliver a frame.")
+        report.add("CameraStartMs", (time.perf_counter() - start_time) * 1000)
+
+        reads = []
+        first_read = time.perf_counter()
+        for _ in range(frames):
+            read_start = time.perf_counter()
+            ok, frame = capture.read()
+            if not ok:
+                raise RuntimeError(f"Camera {device_index} stopped delivering frames.")
+            reads.append(time.perf_counter() - read_start)
+        report.add("CameraFps", frames / (time.perf_counter() - first_read))
+        report.add("CameraLatencyMs", _percentile(reads, 95) * 1000)
+        report.details["Camera resolution"] = f"{frame.shape[1]}x{frame.shape[0]}"
+        return frame
+    finally:
+        capture.release()
+
+
+def measure_inference(report: SelfTestReport, detection_config: dict, frame, runs: int):
+    """
+    Times the YOLO network the detector runs on every frame, on a camera frame or a blank 720p frame.
+    """
+    import cv2
+    import numpy as np
+    from app.detection.detector import ObjectDetector
+
+    if frame is None:
+        frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    detector = ObjectDetector(detection_config)
+    blob = cv2.dnn.blobFromImage(frame, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+
+    # the first pass allocates the network's buffers
+    detector.net.setInput(blob)
+    detector.net.forward(detector.output_layers)
+
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        detector.net.setInput(blob)
+        detector.net.forward(detector.output_layers)
+        timings.append(time.perf_counter() - start_time)
+    report.add("InferenceMs", sum(timings) / len(timings) * 1000)
+
+
+def measure_microphone(report: SelfTestReport, device_index, calibration_seconds: float):
+    """
+    Opens the microphone and calibrates for ambient noise the way the prop does before it listens.
+    """
+    import speech_recognition as sr
+    recognizer = sr.Recognizer()
+    start_time = time.perf_counter()
+    with sr.Microphone(device_index=device_index) as source:
+        opened = time.perf_counter()
+        recognizer.adjust_for_ambient_noise(source, duration=calibration_seconds)
+        calibrated = time.perf_counter()
+    report.add("MicrophoneOpenMs", (opened - start_time) * 1000)
+    report.add("MicrophoneCalibrationMs", (calibrated - opened) * 1000)
+
+
+def measure_audio_output(report: SelfTestReport, device_index):
+    """
+    Times opening the output device and writing the first 10ms of silence, the prop pays this before its first line and every cached line.
+    """
+    import pyaudio
+    start_time = time.perf_counter()
+    audio = pyaudio.PyAudio()
+    try:
+        stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, output=True, output_device_index=device_index)
+        stream.write(b"\x00\x00" * 441)
+        report.add("AudioStartMs", (time.perf_counter() - start_time) * 1000)
+        report.details["Audio output latency"] = f"{stream.get_output_latency() * 1000:.1f}ms reported by the device"
+        stream.stop_stream()
+        stream.close()
+    finally:
+        audio.terminate()
+
+
+def measure_disk(report: SelfTestReport, capture_dir: str, megabytes: float):
+    """
+    Writes capture sized files to the captures directory, each one synced to disk, and removes them again.
+    """
+    test_dir = os.path.join(capture_dir, '.self_test')
+    os.makedirs(test_dir, exist_ok=True)
+    data = os.urandom(CAPTURE_SIZE)
+    files = max(1, int(megabytes * 1024 * 1024 / CAPTURE_SIZE))
+    writes = []
+    try:
+        start_time = time.perf_counter()
+        for index in range(files):
+            write_start = time.perf_counter()
+            with open(os.path.join(test_dir, f"{index}.jpg"), 'wb') as test_file:
+                test_file.write(data)
+                test_file.flush()
+                os.fsync(test_file.fileno())
+            writes.append(time.perf_counter() - write_start)
+        elapsed = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+    report.add("DiskWriteMBps", files * CAPTURE_SIZE / (1024 * 1024) / elapsed)
+    report.add("CaptureWriteMs", _percentile(writes, 95) * 1000)
+
+
+def run_self_test(config: dict, progress=None) -> SelfTestReport:
+    """
+    Measures whether the hardware keeps up with the prop: the camera, the YOLO network, the
+    microphone, the audio output and the captures disk.
+
+    A test that cannot run (no camera, no microphone) is reported as an error and the others still run.
+
+    Args:
+        config (dict): The application configuration.
+        progress (callable): Called with the name of each test as it starts.
+
+    Returns:
+        SelfTestReport: The results, compared with the thresholds and the saved baseline.
+    """
+    test_config = self_test_config(config)
+    baseline = load_baseline(resolve_path(test_config["BaselinePath"]))
+    report = SelfTestReport(test_config["Thresholds"], baseline, test_config["RegressionTolerance"])
+    detection_config = config.get('Detection', {})
+    capture_dir = resolve_path(os.path.join('logs', 'captures'))
+
+    frame = None
+    tests = [
+        ("Camera", lambda: measure_camera(report, detection_config.get('VideoInputDeviceIndex', 0), test_config["CameraFrames"])),
+        ("Inference", lambda: measure_inference(report, detection_config, frame, test_config["InferenceRuns"])),
+        ("Microphone", lambda: measure_microphone(report, config['App']['AudioInputDeviceIndex'], test_config["CalibrationSeconds"])),
+        ("AudioOutput", lambda: measure_audio_output(report, config['App'].get('AudioOutputDeviceIndex'))),
+        ("Disk", lambda: measure_disk(report, capture_dir, test_config["DiskWriteMB"]))
+    ]
+    for name, test in tests:
+        if progress:
+            progress(name)
+        try:
+            result = test()
+            if name == "Camera":
+                frame = result
+        except Exception as e:
+            report.errors[name] = f"{type(e).__name__}: {str(e).strip()}"
+    return report
@@ -0,0 +1,273 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.ai_services.budgets import budget_config
+from app.configuration import load_config, diff_config
+from app.detection.detector import ObjectDetector
+from app.detection.capture_store import CaptureStore
+from app.events.broadcaster import EventBroadcaster
+from app.logging.detection_log import DetectionLog
+from app.orchestration.prop_agent import PropAgent
+from app.orchestration.turn_scheduler import TurnScheduler
+
+
+class PropOrchestrator:
+    """
+    Runs several coordinated props from a single camera.
+
+    There is one detection pipeline, one capture and one image upload per visitor. The lead prop
+    greets the visitor from the image and carries the conversation, supporting props react to what
+    was said using text only, and the turn scheduler keeps them from talking over each other.
+    """
+    def __init__(self, config: dict, config_path: str, log_service):
+        self.config = config
+        self.config_path = config_path
+        self.log_service = log_service
+        self.logger = log_service.get_logger(__name__)
+
+        # one detector, shared by every prop
+        self.events = EventBroadcaster()
+        self.object_detector = ObjectDetector(config['Detection'])
+        self.object_detector.add_observer(self.events.publish)
+
+        root_dir = os.path.dirname(os.path.abspath(config_path))
+        self.log_dir = os.path.join(root_dir, 'logs')
+        self.capture_dir = os.path.join(self.log_dir, 'captures')
+        os.makedirs(self.capture_dir, exist_ok=True)
+        self.detection_log = DetectionLog(self.log_dir)
+        self.capture_store = CaptureStore(self.capture_dir, config.get('Captures'), log_service.get_logger("CaptureStore"))
+
+        # the lead prop is listed first, only it listens so the speech engine is shared
+        props = sorted(config['Props'], key=lambda prop: prop.get('Role', 'support') != 'lead')
+        self.agents = []
+        for prop in props:
+            shared_speech_to_text = self.agents[0].voice_service.speech_to_text if self.agents else None
+            self.agents.append(PropAgent(config, prop, config_path, log_service, shared_speech_to_text))
+        self.lead = self.agents[0]
+        self.supporting = self.agents[1:]
+        if not self.lead.is_lead:
+            self.logger.warning(f"No prop has the lead role, {self.lead.name} will lead.")
+
+        self.scheduler = TurnScheduler()
+        self.reaction_pool = ThreadPoolExecutor(max_workers=max(1, len(self.supporting)), thread_name_prefix="PropReaction")
+        # conversations run off the detector thread, one at a time
+        self.conversations = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PropConversation")
+        self.conversation = None
+        self.exchange_count = 0
+        self.listening = False
+        self.budgets = budget_config(config)
+        self.fallbacks = {stage: 0 for stage in self.budgets['FallbackLines']}
+        self.enable_text_to_speech = config['App']['UseTextToSpeech']
+        self.enable_speech_to_text = config['App']['UseSpeechToText']
+        self.max_exchange_count = config['App']['MaxExchangeCount']
+        self.end_trigger_words = config['App']['EndTriggerWords']
+        self.active_object_id = None
+        self.visitors = 0
+        self.running = False
+
+        # the lead's fallback lines are synthesized ahead of time, they play when the assistant or the speech synthesis fails
+        if self.enable_text_to_speech:
+            threading.Thread(target=self.cache_phrases, name="CachePhrases", daemon=True).start()
+
+    def cache_phrases(self):
+        for line in [line for fallbacks in self.budgets['FallbackLines'].values() for line in fallbacks]:
+            try:
+                self.lead.voice_service.cache_phrase(line)
+            except Exception as e:
+                self.logger.warning(f"Could not cache the line \"{line}\": {e}")
+                return
+
+    def start(self):
+        self.running = True
+        if self.handle_events not in self.object_detector.observers:
+            self.object_detector.add_observer(self.handle_events)
+        self.object_detector.start()
+
+    def stop(self):
+        self.running = False
+        self.active_object_id = None
+        self.object_detector.stop()
+        self.detection_log.flush()
+
+    def handle_events(self, event_type, data):
+        if event_type == 'new_object_detected':
+            self.logger.info("New object detected.")
+            if self.conversation is not None and not self.conversation.done():
+                self.logger.info(f"Still talking with object {self.active_object_id}, object {data['object_id']} is not greeted.")
+                return
+            self.visitors += 1
+            self.active_object_id = data['object_id']
+
+            # one capture and one upload for every prop
+            capture = self.capture_store.save(data['frame'], f"{data['class_name']}_{data['timestamp']}_{data['object_id']}.jpg")
+            self.detection_log.append(data['timestamp'], f"{data['timestamp']} - Detected: {data['class_name']}, Image: {os.path.basename(capture.path)}, Confidence: {data['confidence']:.2f}, ID: {data['object_id']}")
+            self.conversation = self.conversations.submit(self._converse, data, capture)
+
+        if event_type == 'all_objects_left':
+            self.logger.info("Object left the frame.")
+            self.active_object_id = None
+
+    def _converse(self, data, capture):
+        try:
+            self.run_conversation(data, capture)
+        except Exception as e:
+            # a budget, an open circuit or a failed run ends the conversation with a line rather than silence
+            self.logger.exception(f"Conversation with object {data['object_id']} failed: {type(e).__name__} {str(e)}", exc_info=e)
+            self.play_fallback('Greeting' if self.exchange_count == 0 else 'Reply')
+        finally:
+            self.listening = False
+
+    def run_conversation(self, data, capture):
+        for agent in self.agents:
+            agent.reset()
+
+        prompt = ("Forget anything we've discussed to this point, we are starting over. "
+                  f"Analyze this image containing at least one {data['class_name']} and start a conversation with the individual or group that you see.")
+        line = self.lead.respond(prompt, capture.path, capture.data, timeout=self.budgets['Greeting'])
+        self._lead_turn(0, line)
+
+        self.exchange_count = 0
+        while self.running and self.active_object_id == data['object_id']:
+            if self.enable_speech_to_text:
+                # listening holds the floor too, nobody should talk over the visitor
+                with self.scheduler.floor(self.lead.name):
+                    self.listening = True
+                    try:
+                        user_response = self.lead.voice_service.listen_for_response_openai()
+                    finally:
+                        self.listening = False
+                if user_response is None:
+                    continue
+            else:
+                user_response = input("Your response: ")
+            self.events.publish('conversation_turn', {'object_id': data['object_id'], 'speaker': 'visitor', 'text': user_response})
+
+            if any(word.lower() in user_response.lower() for word in self.end_trigger_words):
+                self.logger.info("End trigger word detected. Ending conversation.")
+                break
+
+            line = self.lead.respond(user_response, timeout=self.budgets['Reply'])
+            self.exchange_count += 1
+            self._lead_turn(self.exchange_count, line)
+
+            if self.exchange_count >= self.max_exchange_count:
+                self.logger.info(f"Reached the maximum exchange count of {self.max_exchange_count}. Ending conversation.")
+                break
+
+        self.logger.info("Playing goodbye message...")
+        with self.scheduler.floor(self.lead.name):
+            if self.enable_text_to_speech:
+                self.lead.voice_service.play_audio_from_file(os.path.join(os.path.dirname(__file__), '..', 'ai_services', 'resources', 'goodbye.mp3'))
+            else:
+                print("Goodbye!")
+
+    def _lead_turn(self, turn, line):
+        # supporting props start writing their reactions while the lead is still speaking
+        reactions = [(agent, self.reaction_pool.submit(agent.react, self.lead.name, line, self.budgets['Reply'])) for agent in self.supporting if agent.should_chime_in(turn)]
+        self._say(self.lead, line)
+
+        for agent, reaction in reactions:
+            try:
+                self._say(agent, reaction.result())
+            except Exception as e:
+                self.logger.exception(f"{agent.name} could not react: {str(e)}", exc_info=e)
+
+    def _say(self, agent, text):
+        self.events.publish('conversation_turn', {'object_id': self.active_object_id, 'speaker': agent.name, 'text': text})
+        with self.scheduler.floor(agent.name):
+            agent.speak(text, self.enable_text_to_speech)
+
+    def play_fallback(self, stage):
+        """
+        Has the lead play a pre-rendered fallback line, only lines already in the phrase cache are played.
+
+        Args:
+            stage (str): Greeting, Reply or Voice.
+        """
+        self.fallbacks[stage] = self.fallbacks.get(stage, 0) + 1
+        lines = self.budgets['FallbackLines'].get(stage) or []
+        if not lines:
+            return
+
+        line = random.choice(lines)
+        print(f"{self.lead.name}'s response:\n{line}")
+        self.events.publish('conversation_turn', {'object_id': self.active_object_id, 'speaker': self.lead.name, 'text': line})
+        if self.enable_text_to_speech and self.lead.voice_service.has_phrase(line):
+            try:
+                with self.scheduler.floor(self.lead.name):
+                    self.lead.voice_service.play_phrase(line)
+            except Exception as e:
+                self.logger.warning(f"Could not play the fallback line: {str(e)}")
+
+    def reload_config(self, new_config=None):
+        """
+        Applies configuration changes to the running props.
+
+        Args:
+            new_config (dict): The new configuration, read from config.json when not provided.
+
+        Returns:
+            dict: The changed keys per section.
+        """
+        if new_config is None:
+            new_config = load_config(self.config_path)
+
+        changes = diff_config(self.config, new_config)
+        if not changes:
+            self.logger.info("Configuration reloaded, nothing changed.")
+            return changes
+
+        self.logger.info(f"Applying configuration changes: {', '.join(f'{section}({len(keys)})' for section, keys in changes.items())}")
+
+        if 'Detection' in changes:
+            self.object_detector.apply_configuration(new_config['Detection'])
+
+        if 'Captures' in changes:
+            self.capture_store.apply_config(new_config.get('Captures'))
+
+        if 'Budgets' in changes:
+            self.budgets = budget_config(new_config)
+
+        if 'App' in changes:
+            self.max_exchange_count = new_config['App']['MaxExchangeCount']
+            self.end_trigger_words = new_config['App']['EndTriggerWords']
+            self.enable_text_to_speech = new_config['App']['UseTextToSpeech']
+            self.enable_speech_to_text = new_config['App']['UseSpeechToText']
+
+        # props are matched by name, adding or removing one needs new services and devices
+        props = {prop['Name']: prop for prop in new_config.get('Props', []) if 'Name' in prop}
+        if set(props) != {agent.name for agent in self.agents}:
+            self.logger.warning("Adding or removing props takes effect after a restart.")
+        for agent in self.agents:
+            if agent.name in props:
+                agent.apply_config(new_config, props[agent.name])
+
+        if changes.keys() & {'Logging', 'Telemetry'}:
+            self.logger.warning("Logging and telemetry changes take effect after a restart.")
+
+        self.config = new_config
+        self.events.publish('config_reloaded', {'sections': sorted(changes)})
+        return changes
+
+    def get_status(self):
+        return {
+            'prop': self.lead.name,
+            'running': self.running,
+            'visitors': self.visitors,
+            'detector': self.object_detector.get_status(),
+            'conversation': {
+                'active': self.conversation is not None and not self.conversation.done(),
+                'listening': self.listening,
+                'exchange_count': self.exchange_count,
+                'max_exchange_count': self.max_exchange_count
+            },
+            'scheduler': self.scheduler.get_status(),
+            'props': [agent.get_status() for agent in self.agents],
+            'api_calls_per_visitor': round(sum(agent.api_calls for agent in self.agents) / self.visitors, 2) if self.visitors else 0.0,
+            'fallbacks': dict(self.fallbacks),
+            'captures_evicted': self.capture_store.evicted,
+            'detection_log_dropped': self.detection_log.dropped,
+            'log_records_dropped': self.log_service.queue_handler.dropped if self.log_service.queue_handler else 0,
+            'event_subscribers': self.events.subscriber_count
+        }
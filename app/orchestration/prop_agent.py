@@ -0,0 +1,118 @@
+import copy
+from app.ai_services.openai_service import OpenAIService
+from app.ai_services.voice_service import VoiceService
+from app.configuration import diff_config
+
+# Keys of a Props entry that override the App section for that prop.
+DEVICE_KEYS = ("AudioInputDeviceIndex", "AudioOutputDeviceIndex")
+
+
+def build_prop_config(config: dict, prop: dict) -> dict:
+    """
+    Builds the configuration a single prop's services see.
+
+    The prop entry replaces the Prop section (missing keys fall back to the shared Prop section)
+    and its audio device indexes replace the ones in the App section.
+
+    Args:
+        config (dict): The full application configuration.
+        prop (dict): One entry of the Props list.
+
+    Returns:
+        dict: A copy of the configuration for the prop.
+    """
+    prop_config = copy.deepcopy(config)
+    merged_prop = dict(config.get('Prop', {}))
+    merged_prop.update({key: value for key, value in prop.items() if key not in DEVICE_KEYS})
+    prop_config['Prop'] = merged_prop
+
+    for key in DEVICE_KEYS:
+        if key in prop:
+            prop_config['App'][key] = prop[key]
+
+    return prop_config
+
+
+class PropAgent:
+    """
+    One prop in a multi-prop setup: its own assistant, its own voice and its own audio devices.
+
+    The lead prop greets the visitor from the camera image and carries the conversation,
+    supporting props only see the text of what was said and chime in from time to time.
+    """
+    def __init__(self, config: dict, prop: dict, config_path: str, log_service, speech_to_text=None):
+        self.config = build_prop_config(config, prop)
+        self.name = self.config['Prop']['Name']
+        self.role = prop.get('Role', 'support')
+        self.chime_in_every = prop.get('ChimeInEvery', 2)
+        self.logger = log_service.get_logger(f"PropAgent.{self.name}")
+
+        self.openai_service = OpenAIService(self.config['Keys']['OpenAI'], self.config, log_service.get_logger(f"OpenAIService.{self.name}"))
+        self.openai_service.verify_assistant_async()
+        self.voice_service = VoiceService(config_path, log_service.get_logger(f"VoiceService.{self.name}"), self.openai_service, self.config, speech_to_text)
+        self.api_calls = 0
+
+    @property
+    def is_lead(self):
+        return self.role == 'lead'
+
+    def should_chime_in(self, turn: int) -> bool:
+        return self.chime_in_every > 0 and turn % self.chime_in_every == 0
+
+    def reset(self):
+        # each visitor starts a fresh assistant thread
+        self.openai_service.active_thread = None
+
+    def respond(self, prompt: str, image_path: str = None, image_data: bytes = None, timeout: float = None) -> str:
+        """
+        Sends a turn to the prop's assistant, BudgetExceeded is raised when the answer takes longer than timeout seconds.
+        """
+        self.api_calls += 1
+        return self.openai_service.generate_assistant_response(prompt, image_path, image_data, timeout=timeout)
+
+    def react(self, speaker: str, line: str, timeout: float = None) -> str:
+        """
+        Asks a supporting prop to react to what another prop just said, text only.
+        """
+        self.api_calls += 1
+        prompt = f"{speaker} just said: \"{line}\". React to it in a single short sentence, in character."
+        return self.openai_service.generate_assistant_response(prompt, timeout=timeout)
+
+    def speak(self, text: str, use_text_to_speech: bool):
+        print(f"{self.name}'s response:\n{text}")
+        if use_text_to_speech:
+            self.voice_service.generate_streaming_audio(text)
+
+    def apply_config(self, config: dict, prop: dict) -> dict:
+        """
+        Applies a reloaded configuration to the prop's services.
+
+        The prop's own configuration is compared, so an edit to its Props entry or to a shared
+        section reaches the services as a change to the section they read.
+
+        Args:
+            config (dict): The full application configuration.
+            prop (dict): The prop's entry of the Props list.
+
+        Returns:
+            dict: The changed keys per section of the prop's configuration.
+        """
+        prop_config = build_prop_config(config, prop)
+        changes = diff_config(self.config, prop_config)
+        self.config = prop_config
+        self.chime_in_every = prop.get('ChimeInEvery', 2)
+
+        if changes.keys() & {'Prop', 'App', 'Azure', 'Keys', 'Endpoints', 'Budgets'}:
+            self.openai_service.apply_config(prop_config, changes)
+
+        if changes.keys() & {'Prop', 'App', 'Keys', 'SpeechToText', 'Endpoints', 'Budgets', 'Playback', 'BargeIn'}:
+            self.voice_service.apply_config(prop_config, changes)
+        return changes
+
+    def get_status(self):
+        return {
+            'name': self.name,
+            'role': self.role,
+            'api_calls': self.api_calls,
+            'output_device': self.voice_service.output_device_index
+        }
@@ -0,0 +1,57 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class TurnScheduler:
+    """
+    Hands out the speaking floor so props never talk over each other.
+
+    Props wait in the order they asked to speak. The time each one waited is recorded so
+    the cost of coordination shows up in the status.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self.current_speaker = None
+        self.turns = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def floor(self, speaker: str):
+        """
+        Blocks until it is the speaker's turn and holds the floor for the duration of the block.
+
+        Args:
+            speaker (str): The name of the prop that wants to speak.
+        """
+        requested = time.time()
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._condition.wait()
+            self.current_speaker = speaker
+
+        waited = time.time() - requested
+        self.turns += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+        try:
+            yield waited
+        finally:
+            with self._condition:
+                self.current_speaker = None
+                self._serving += 1
+                self._condition.notify_all()
+
+    def get_status(self):
+        return {
+            'current_speaker': self.current_speaker,
+            'turns': self.turns,
+            'mean_wait_seconds': round(self.total_wait / self.turns, 3) if self.turns else 0.0,
+            'max_wait_seconds': round(self.max_wait, 3)
+        }
@@ -0,0 +1,509 @@
+import os
+import re
+import json
+import math
+import time
+import uuid
+import random
+import struct
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The Azurite development account, the storage sdk signs requests with it and the mock ignores the signature.
+MOCK_ACCOUNT_NAME = "devstoreaccount1"
+MOCK_ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+# Latency is drawn per request from the distribution configured for the endpoint, in seconds.
+DEFAULT_MOCK_PROFILE = {
+    "Seed": None,
+    "Assistants": {"Distribution": "lognormal", "Median": 0.15, "Sigma": 0.3, "ErrorRate": 0.0},
+    "Threads": {"Distribution": "lognormal", "Median": 0.12, "Sigma": 0.3, "ErrorRate": 0.0},
+    "Messages": {"Distribution": "lognormal", "Median": 0.15, "Sigma": 0.3, "ErrorRate": 0.0},
+    # how long a run stays queued or in progress before it completes
+    "Runs": {"Distribution": "lognormal", "Median": 1.8, "Sigma": 0.4, "ErrorRate": 0.0},
+    # time to the first token of a chat completion, the rest of the answer streams a word at a time
+    "ChatCompletions": {"Distribution": "lognormal", "Median": 0.6, "Sigma": 0.4, "ErrorRate": 0.0, "TokenInterval": 0.03},
+    "Transcription": {"Distribution": "lognormal", "Median": 0.9, "Sigma": 0.35, "ErrorRate": 0.0},
+    "BlobUpload": {"Distribution": "lognormal", "Median": 0.2, "Sigma": 0.4, "ErrorRate": 0.0},
+    "TextToSpeech": {
+        "Distribution": "lognormal", "Median": 0.35, "Sigma": 0.3, "ErrorRate": 0.0,
+        # seconds between audio chunks once the first one is sent, and the size of each chunk
+        "ChunkInterval": 0.05,
+        "ChunkSize": 4096
+    }
+}
+
+# Seconds a cancelled run stays cancelling before it is cancelled.
+RUN_CANCEL_DELAY = 0.5
+
+RESPONSES = [
+    "Well, well, what have we here? Brave little visitors on my doorstep!",
+    "Ooooh, I do love a good costume. Tell me, who are you supposed to be?",
+    "Careful now, the candy bowl bites back. What brings you out tonight?",
+    "Ha! You don't scare me. Well, maybe a little. What's your favorite treat?"
+]
+
+TRANSCRIPTS = [
+    "Trick or treat!",
+    "I'm a vampire, can I have some candy?",
+    "Are you a real skeleton?",
+    "Goodbye!"
+]
+
+
+class LatencyModel:
+    """
+    Draws latencies and errors for one endpoint.
+    """
+    def __init__(self, settings: dict, rng: random.Random):
+        self.settings = settings
+        self.rng = rng
+
+    def sample(self) -> float:
+        distribution = self.settings.get("Distribution", "fixed")
+        median = self.settings.get("Median", 0.0)
+        if distribution == "lognormal":
+            return self.rng.lognormvariate(0, self.settings.get("Sigma", 0.3)) * median
+        if distribution == "normal":
+            return max(0.0, self.rng.gauss(median, self.settings.get("Sigma", 0.1)))
+        if distribution == "uniform":
+            return self.rng.uniform(self.settings.get("Min", 0.0), self.settings.get("Max", median * 2))
+        return median
+
+    def should_fail(self) -> bool:
+        return self.rng.random() < self.settings.get("ErrorRate", 0.0)
+
+
+class MockState:
+    """
+    The assistants, threads, runs and blobs the mock server has handed out.
+    """
+    def __init__(self, profile: dict, voices=()):
+        self.profile = profile
+        seed = profile.get("Seed")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = {name: LatencyModel(settings, self._rng) for name, settings in profile.items() if isinstance(settings, dict)}
+
+        self.assistants = {}
+        self.threads = {}
+        self.runs = {}
+        self.blobs = {}
+        self.voices = {f"{index:020d}": name for index, name in enumerate(voices)}
+        self.requests = 0
+        self.errors = 0
+
+        audio_path = os.path.join(os.path.dirname(__file__), '..', 'ai_services', 'resources', 'listening.mp3')
+        with open(audio_path, 'rb') as audio_file:
+            self.audio = audio_file.read()
+        self._pcm = {}
+
+    def pcm_audio(self, sample_rate: int) -> bytes:
+        """
+        A second and a half of a quiet tone as 16 bit mono PCM, for text to speech requests that ask for pcm output.
+        """
+        if sample_rate not in self._pcm:
+            samples = int(sample_rate * 1.5)
+            self._pcm[sample_rate] = struct.pack(f"<{samples}h", *(int(3000 * math.sin(2 * math.pi * 220 * index / sample_rate)) for index in range(samples)))
+        return self._pcm[sample_rate]
+
+    def sample(self, endpoint):
+        with self._lock:
+            model = self.models[endpoint]
+            return model.sample(), model.should_fail()
+
+    def choice(self, items):
+        with self._lock:
+            return self._rng.choice(items)
+
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _message(thread_id, role, text, run_id=None):
+    return {
+        "id": _new_id("msg"), "object": "thread.message", "created_at": int(time.time()), "thread_id": thread_id,
+        "role": role, "run_id": run_id, "assistant_id": None, "attachments": [], "metadata": {}, "status": "completed",
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}]
+    }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the OpenAI, ElevenLabs and Azure Blob stand-ins.
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "SpookyPiMock/1.0"
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    @property
+    def state(self) -> MockState:
+        return self.server.state
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        body = self._read_body()
+        return json.loads(body) if body else {}
+
+    def _send(self, status, body: bytes = b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload, status=200):
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _delay(self, endpoint):
+        # sleeps for the sampled latency and answers with an error instead when one was drawn
+        latency, fail = self.state.sample(endpoint)
+        time.sleep(latency)
+        if fail:
+            self.state.errors += 1
+            self._send_json({"error": {"message": f"Injected {endpoint} failure", "type": "server_error", "code": None}}, status=500)
+            return False
+        return True
+
+    def _route(self, method):
+        self.state.requests += 1
+        path = self.path.split("?", 1)[0]
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match:
+                return handler(self, *match.groups())
+        self._read_body()
+        self._send_json({"error": {"message": f"No mock for {method} {path}", "type": "invalid_request_error"}}, status=404)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    # OpenAI assistants
+    def create_assistant(self):
+        body = self._json_body()
+        if not self._delay("Assistants"):
+            return
+        assistant = {"id": _new_id("asst"), "object": "assistant", "created_at": int(time.time()), "name": body.get("name"),
+                     "description": body.get("description"), "model": body.get("model", "gpt-4o-mini"),
+                     "instructions": body.get("instructions"), "tools": [], "metadata": {}}
+        self.state.assistants[assistant["id"]] = assistant
+        self._send_json(assistant)
+
+    def list_assistants(self):
+        if not self._delay("Assistants"):
+            return
+        data = list(self.state.assistants.values())
+        self._send_json({"object": "list", "data": data, "first_id": data[0]["id"] if data else None,
+                         "last_id": data[-1]["id"] if data else None, "has_more": False})
+
+    def get_assistant(self, assistant_id):
+        if not self._delay("Assistants"):
+            return
+        assistant = self.state.assistants.setdefault(assistant_id, {
+            "id": assistant_id, "object": "assistant", "created_at": int(time.time()), "name": None, "description": None,
+            "model": "gpt-4o-mini", "instructions": "", "tools": [], "metadata": {}})
+        self._send_json(assistant)
+
+    def update_assistant(self, assistant_id):
+        body = self._json_body()
+        if not self._delay("Assistants"):
+            return
+        assistant = self.state.assistants.setdefault(assistant_id, {"id": assistant_id, "object": "assistant", "created_at": int(time.time()), "tools": [], "metadata": {}})
+        assistant.update({key: value for key, value in body.items() if key in ("name", "description", "model", "instructions")})
+        self._send_json(assistant)
+
+    def delete_assistant(self, assistant_id):
+        if not self._delay("Assistants"):
+            return
+        self.state.assistants.pop(assistant_id, None)
+        self._send_json({"id": assistant_id, "object": "assistant.deleted", "deleted": True})
+
+    # OpenAI threads, messages and runs
+    def create_thread(self):
+        self._json_body()
+        if not self._delay("Threads"):
+            return
+        thread = {"id": _new_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}, "tool_resources": None}
+        self.state.threads[thread["id"]] = {"thread": thread, "messages": []}
+        self._send_json(thread)
+
+    def _thread(self, thread_id):
+        return self.state.threads.setdefault(thread_id, {"thread": {"id": thread_id}, "messages": []})
+
+    def create_message(self, thread_id):
+        body = self._json_body()
+        if not self._delay("Messages"):
+            return
+        active = self._active_run(thread_id)
+        if active is not None:
+            # the real api rejects messages while a run is still going or being cancelled
+            self._send_json({"error": {"message": f"Can't add messages to {thread_id} while a run {active} is active.", "type": "invalid_request_error"}}, status=400)
+            return
+        content = body.get("content", "")
+        text = content if isinstance(content, str) else " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        message = _message(thread_id, body.get("role", "user"), text)
+        self._thread(thread_id)["messages"].append(message)
+        self._send_json(message)
+
+    def list_messages(self, thread_id):
+        if not self._delay("Messages"):
+            return
+        messages = list(self._thread(thread_id)["messages"])
+        if "order=asc" not in self.path:
+            messages.reverse()
+        self._send_json({"object": "list", "data": messages, "first_id": messages[0]["id"] if messages else None,
+                         "last_id": messages[-1]["id"] if messages else None, "has_more": False})
+
+    def create_run(self, thread_id):
+        body = self._json_body()
+        latency, fail = self.state.sample("Runs")
+        run = {"id": _new_id("run"), "object": "thread.run", "created_at": int(time.time()), "thread_id": thread_id,
+               "assistant_id": body.get("assistant_id"), "status": "queued", "model": "gpt-4o-mini", "instructions": "",
+               "tools": [], "metadata": {}, "last_error": None}
+        self.state.runs[run["id"]] = {"run": run, "done_at": time.time() + latency, "fail": fail}
+        self._send_json(run)
+
+    def _active_run(self, thread_id):
+        now = time.time()
+        for run_id, entry in list(self.state.runs.items()):
+            run = entry["run"]
+            if run["thread_id"] != thread_id:
+                continue
+            if run["status"] in ("queued", "in_progress") and now < entry["done_at"]:
+                return run_id
+            if run["status"] == "cancelling" and now < entry["cancelled_at"]:
+                return run_id
+        return None
+
+    def get_run(self, thread_id, run_id):
+        entry = self.state.runs.get(run_id)
+        if entry is None:
+            self._send_json({"error": {"message": f"No run found with id '{run_id}'.", "type": "invalid_request_error"}}, status=404)
+            return
+
+        run = entry["run"]
+        if run["status"] == "cancelling" and time.time() >= entry["cancelled_at"]:
+            run["status"] = "cancelled"
+        if run["status"] in ("queued", "in_progress"):
+            if time.time() < entry["done_at"]:
+                run["status"] = "in_progress"
+            elif entry["fail"]:
+                self.state.errors += 1
+                run["status"] = "failed"
+                run["last_error"] = {"code": "server_error", "message": "Injected run failure"}
+            else:
+                run["status"] = "completed"
+                self._thread(thread_id)["messages"].append(_message(thread_id, "assistant", self.state.choice(RESPONSES), run_id))
+        self._send_json(run)
+
+    def cancel_run(self, thread_id, run_id):
+        self._read_body()
+        entry = self.state.runs.get(run_id)
+        if entry is None:
+            self._send_json({"error": {"message": f"No run found with id '{run_id}'.", "type": "invalid_request_error"}}, status=404)
+            return
+        if entry["run"]["status"] in ("queued", "in_progress"):
+            # a run takes a moment to stop, like on the real api
+            entry["run"]["status"] = "cancelling"
+            entry["cancelled_at"] = time.time() + RUN_CANCEL_DELAY
+        self._send_json(entry["run"])
+
+    # OpenAI chat completions
+    def create_chat_completion(self):
+        body = self._json_body()
+        if not self._delay("ChatCompletions"):
+            return
+
+        completion_id = _new_id("chatcmpl")
+        model = body.get("model", "gpt-4o-mini")
+        text = self.state.choice(RESPONSES)
+        if not body.get("stream"):
+            self._send_json({"id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            delta = {"role": "assistant", "content": word} if index == 0 else {"content": " " + word}
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if index == len(words) - 1 else None}]}
+            self._send_event(json.dumps(chunk))
+            time.sleep(self.state.profile["ChatCompletions"].get("TokenInterval", 0.0))
+        self._send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_event(self, data: str):
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.flush()
+
+    # OpenAI transcription
+    def create_transcription(self):
+        body = self._read_body()
+        if not self._delay("Transcription"):
+            return
+        text = self.state.choice(TRANSCRIPTS)
+        if b'name="response_format"\r\n\r\ntext' in body:
+            self._send(200, text.encode("utf-8"), content_type="text/plain")
+        else:
+            self._send_json({"text": text})
+
+    # ElevenLabs
+    def list_voices(self):
+        self._send_json({"voices": [{"voice_id": voice_id, "name": name, "category": "premade"} for voice_id, name in self.state.voices.items()]})
+
+    def _speech_audio(self):
+        # pcm_22050 and the like answer with raw samples, anything else with the bundled mp3
+        match = re.search(r"output_format=pcm_(\d+)", self.path)
+        if match:
+            return self.state.pcm_audio(int(match.group(1))), "audio/pcm"
+        return self.state.audio, "audio/mpeg"
+
+    def text_to_speech(self, voice_id):
+        self._read_body()
+        if not self._delay("TextToSpeech"):
+            return
+        audio, content_type = self._speech_audio()
+        self._send(200, audio, content_type=content_type)
+
+    def text_to_speech_stream(self, voice_id):
+        self._read_body()
+        if not self._delay("TextToSpeech"):
+            return
+
+        settings = self.state.profile["TextToSpeech"]
+        chunk_size = settings.get("ChunkSize", 4096)
+        audio, content_type = self._speech_audio()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for offset in range(0, len(audio), chunk_size):
+            chunk = audio[offset:offset + chunk_size]
+            self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+            time.sleep(settings.get("ChunkInterval", 0.0))
+        self.wfile.write(b"0\r\n\r\n")
+
+    # Azure blob storage
+    def put_blob(self, container, blob_name):
+        data = self._read_body()
+        if not self._delay("BlobUpload"):
+            return
+        self.state.blobs[f"{container}/{blob_name}"] = data
+        self._send(201, headers={
+            "ETag": f'"0x{uuid.uuid4().hex[:15].upper()}"',
+            "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()),
+            "x-ms-request-id": str(uuid.uuid4()),
+            "x-ms-version": "2024-11-04",
+            "x-ms-request-server-encrypted": "true"
+        }, content_type="application/octet-stream")
+
+    def get_blob(self, container, blob_name):
+        data = self.state.blobs.get(f"{container}/{blob_name}")
+        if data is None:
+            self._send(404, content_type="application/octet-stream")
+        else:
+            self._send(200, data, content_type="image/jpeg")
+
+
+ROUTES = [
+    ("POST", re.compile(r"/v1/assistants"), MockRequestHandler.create_assistant),
+    ("GET", re.compile(r"/v1/assistants"), MockRequestHandler.list_assistants),
+    ("GET", re.compile(r"/v1/assistants/([^/]+)"), MockRequestHandler.get_assistant),
+    ("POST", re.compile(r"/v1/assistants/([^/]+)"), MockRequestHandler.update_assistant),
+    ("DELETE", re.compile(r"/v1/assistants/([^/]+)"), MockRequestHandler.delete_assistant),
+    ("POST", re.compile(r"/v1/threads"), MockRequestHandler.create_thread),
+    ("POST", re.compile(r"/v1/threads/([^/]+)/messages"), MockRequestHandler.create_message),
+    ("GET", re.compile(r"/v1/threads/([^/]+)/messages"), MockRequestHandler.list_messages),
+    ("POST", re.compile(r"/v1/threads/([^/]+)/runs"), MockRequestHandler.create_run),
+    ("GET", re.compile(r"/v1/threads/([^/]+)/runs/([^/]+)"), MockRequestHandler.get_run),
+    ("POST", re.compile(r"/v1/threads/([^/]+)/runs/([^/]+)/cancel"), MockRequestHandler.cancel_run),
+    ("POST", re.compile(r"/v1/chat/completions"), MockRequestHandler.create_chat_completion),
+    ("POST", re.compile(r"/v1/audio/transcriptions"), MockRequestHandler.create_transcription),
+    ("GET", re.compile(r"/v1/voices"), MockRequestHandler.list_voices),
+    ("POST", re.compile(r"/v1/text-to-speech/([^/]+)/stream"), MockRequestHandler.text_to_speech_stream),
+    ("POST", re.compile(r"/v1/text-to-speech/([^/]+)"), MockRequestHandler.text_to_speech),
+    ("PUT", re.compile(rf"/{MOCK_ACCOUNT_NAME}/([^/]+)/(.+)"), MockRequestHandler.put_blob),
+    ("GET", re.compile(rf"/{MOCK_ACCOUNT_NAME}/([^/]+)/(.+)"), MockRequestHandler.get_blob),
+]
+
+
+class MockServer:
+    """
+    A local stand-in for the OpenAI, ElevenLabs and Azure Blob endpoints the prop talks to.
+
+    Every endpoint answers after a latency drawn from the profile and fails at the profile's error
+    rate, so throughput and tail latency can be measured without a network. Point the Endpoints
+    section and the storage connection string at it, see `endpoints()`.
+
+    Args:
+        profile (dict): Overrides for DEFAULT_MOCK_PROFILE, per endpoint.
+        voices (list): Voice names the ElevenLabs stand-in knows about.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+    """
+    def __init__(self, profile: dict = None, voices=(), host: str = "127.0.0.1", port: int = 8790):
+        merged = {name: dict(settings) if isinstance(settings, dict) else settings for name, settings in DEFAULT_MOCK_PROFILE.items()}
+        for name, settings in (profile or {}).items():
+            if isinstance(settings, dict):
+                merged.setdefault(name, {}).update(settings)
+            else:
+                merged[name] = settings
+
+        self.httpd = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockState(merged, voices)
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def state(self) -> MockState:
+        return self.httpd.state
+
+    def endpoints(self) -> dict:
+        """
+        The configuration that points the prop at this server.
+        """
+        base_url = f"http://{self.host}:{self.port}"
+        return {
+            "Endpoints": {"OpenAI": f"{base_url}/v1", "ElevenLabs": base_url},
+            "StorageConnectionString": (f"DefaultEndpointsProtocol=http;AccountName={MOCK_ACCOUNT_NAME};AccountKey={MOCK_ACCOUNT_KEY};"
+                                        f"BlobEndpoint={base_url}/{MOCK_ACCOUNT_NAME};")
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MockServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
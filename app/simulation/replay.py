@@ -0,0 +1,576 @@
+import io
+import os
+import copy
+import time
+import wave
+import random
+import threading
+import contextlib
+from datetime import datetime
+from types import SimpleNamespace
+from app.logging.latency_report import StreamingHistogram
+from app.ai_services.budgets import CircuitBreaker, budget_config
+from app.ai_services.barge_in import BargeInDetector, DEFAULT_BARGE_IN_CONFIG
+from app.ai_services.pcm_player import PcmPlayer
+from app.simulation.mock_server import LatencyModel, RESPONSES
+from app.configuration import merge_defaults
+
+# How long each simulated stage takes, in scenario seconds. A scenario's Timings section overrides these.
+DEFAULT_TIMINGS = {
+    # image upload and assistant run for the opening line
+    "Greeting": {"Distribution": "lognormal", "Median": 2.5, "Sigma": 0.3},
+    # assistant run for every reply after that
+    "Reply": {"Distribution": "lognormal", "Median": 1.8, "Sigma": 0.3},
+    "Transcription": {"Distribution": "lognormal", "Median": 0.8, "Sigma": 0.3},
+    # ambient noise calibration, listening chime and ListenDelay before the prop listens
+    "ListenSetup": {"Distribution": "fixed", "Median": 3.0},
+    # text to speech time to first audio
+    "FirstAudio": {"Distribution": "lognormal", "Median": 0.4, "Sigma": 0.3},
+    # detector time per frame
+    "Inference": {"Distribution": "normal", "Median": 0.25, "Sigma": 0.02},
+    "Goodbye": {"Distribution": "fixed", "Median": 2.0},
+    # characters of prop speech and words of visitor speech per second
+    "SpeechRate": 15.0,
+    "VisitorWordsPerSecond": 2.5
+}
+
+# Defaults for a visitor entry of a scenario.
+DEFAULT_VISITOR = {
+    "At": 0.0,
+    "Stay": 60.0,
+    "ClassName": "person",
+    "Confidence": 0.9,
+    "Image": None,
+    "Responses": []
+}
+
+
+class SimClock:
+    """
+    Scenario time that runs time_scale times faster than the wall clock.
+    """
+    def __init__(self, time_scale: float = 1.0):
+        self.time_scale = max(time_scale, 1e-6)
+        self.started = time.perf_counter()
+
+    def now(self) -> float:
+        return (time.perf_counter() - self.started) * self.time_scale
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds / self.time_scale)
+
+
+class Simulation:
+    """
+    The shared state of a replay: the clock, the visitor scripts and the measurements.
+
+    Args:
+        scenario (dict): The scenario, see replay_scenario.
+    """
+    def __init__(self, scenario: dict):
+        self.scenario = scenario
+        self.clock = SimClock(scenario.get("TimeScale", 10.0))
+        self.rng = random.Random(scenario.get("Seed"))
+        self.timings = dict(DEFAULT_TIMINGS)
+        for name, value in scenario.get("Timings", {}).items():
+            self.timings[name] = dict(self.timings.get(name, {}), **value) if isinstance(value, dict) else value
+        self.models = {name: LatencyModel(value, self.rng) for name, value in self.timings.items() if isinstance(value, dict)}
+        self.visitors = [dict(DEFAULT_VISITOR, **visitor) for visitor in scenario.get("Visitors", [])]
+        self.end_words = []
+        self.barge_in_config = dict(DEFAULT_BARGE_IN_CONFIG)
+
+        self.spooky_pi = None
+        self._lock = threading.Lock()
+        self.arrivals = {}
+        self.scripts = {}
+        self.greeted = set()
+        self.listen_ended = {}
+        self.greeting_latency = StreamingHistogram()
+        self.reply_latency = StreamingHistogram()
+        self.dispatch_time = StreamingHistogram()
+        self.api_calls = 0
+        self.interruptions = 0
+        self.speech_cut = 0.0
+        self.detections_during_conversation = 0
+
+        # detector frames with and without a conversation running, sampled in the background
+        self.conversation_seconds = 0.0
+        self.conversation_frames = 0
+        self.idle_seconds = 0.0
+        self.idle_frames = 0
+        self._sampling = False
+
+    def sample(self, name) -> float:
+        with self._lock:
+            return self.models[name].sample()
+
+    def choice(self, items):
+        with self._lock:
+            return self.rng.choice(items)
+
+    def active_object_id(self):
+        session = self.spooky_pi.sessions.active if self.spooky_pi else None
+        return session.object_id if session else None
+
+    def on_detector_event(self, event_type, data):
+        # visitor scripts are handed out in the order the detector reports new objects
+        if event_type != 'new_object_detected':
+            return
+        with self._lock:
+            visitor = self.visitors[len(self.arrivals) % len(self.visitors)] if self.visitors else dict(DEFAULT_VISITOR)
+            self.arrivals[data['object_id']] = self.clock.now()
+            self.scripts[data['object_id']] = list(visitor["Responses"])
+            if self.active_object_id() is not None:
+                self.detections_during_conversation += 1
+
+    def on_speak(self):
+        object_id = self.active_object_id()
+        now = self.clock.now()
+        with self._lock:
+            if object_id in self.arrivals and object_id not in self.greeted:
+                self.greeted.add(object_id)
+                self.greeting_latency.add(now - self.arrivals[object_id])
+            elif object_id in self.listen_ended:
+                self.reply_latency.add(now - self.listen_ended.pop(object_id))
+
+    def next_interruption(self):
+        """
+        Seconds into the prop's line at which the active visitor starts their next line, None when they wait for their turn.
+        """
+        object_id = self.active_object_id()
+        with self._lock:
+            script = self.scripts.get(object_id, [])
+            line = script[0] if script else None
+        return line.get("InterruptAfter") if isinstance(line, dict) else None
+
+    def next_line(self):
+        """
+        The next thing the active visitor says and how long saying it takes.
+        """
+        object_id = self.active_object_id()
+        with self._lock:
+            script = self.scripts.get(object_id, [])
+            line = script.pop(0) if script else None
+
+        if line is None:
+            # a visitor without anything left to say walks off
+            text = self.end_words[0] if self.end_words else "*silence*"
+            return text, 1.0
+        if isinstance(line, str):
+            return line, max(1.0, len(line.split()) / self.timings["VisitorWordsPerSecond"])
+
+        if line.get("Audio"):
+            # recorded audio sets the timing, its transcript is what the prop hears
+            with wave.open(line["Audio"], 'rb') as recording:
+                duration = recording.getnframes() / float(recording.getframerate())
+        else:
+            duration = max(1.0, len(line.get("Text", "").split()) / self.timings["VisitorWordsPerSecond"])
+        return line.get("Text", ""), duration
+
+    def on_listen_end(self):
+        object_id = self.active_object_id()
+        with self._lock:
+            self.listen_ended[object_id] = self.clock.now()
+
+    def timed_dispatch(self, handle_events):
+        def dispatch(event_type, data):
+            start = self.clock.now()
+            try:
+                handle_events(event_type, data)
+            finally:
+                self.dispatch_time.add(self.clock.now() - start)
+        return dispatch
+
+    def start_sampling(self, detector, detector_done, interval: float = 0.05):
+        def sample():
+            last_time, last_frames = self.clock.now(), detector.frame_count
+            while self._sampling and not detector_done():
+                time.sleep(interval)
+                now, frames = self.clock.now(), detector.frame_count
+                if self.active_object_id() is not None:
+                    self.conversation_seconds += now - last_time
+                    self.conversation_frames += frames - last_frames
+                else:
+                    self.idle_seconds += now - last_time
+                    self.idle_frames += frames - last_frames
+                last_time, last_frames = now, frames
+
+        self._sampling = True
+        threading.Thread(target=sample, name="SimulationSampler", daemon=True).start()
+
+    def stop_sampling(self):
+        self._sampling = False
+
+
+class ScriptedDetector:
+    """
+    Stands in for the ObjectDetector: reports the scenario's visitors arriving and leaving, and
+    spends the scenario's inference time on every frame in between.
+    """
+    def __init__(self, simulation: Simulation, frame_shape=(480, 640, 3)):
+        self.simulation = simulation
+        self.frame_shape = frame_shape
+        self.configuration = SimpleNamespace(AllowMultiThreading=True)
+        self.observers = []
+        self.detected_objects = {}
+        self.running = False
+        self.thread = None
+        self.finished = threading.Event()
+        self.fps = 0.0
+        self.frame_count = 0
+        self.last_inference_time = 0.0
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def notify_observers(self, event_type, data):
+        for observer in self.observers:
+            observer(event_type, data)
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="ScriptedDetector", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def apply_configuration(self, configuration: dict):
+        pass
+
+    def _frame(self, visitor):
+        import numpy as np
+        if visitor["Image"]:
+            import cv2
+            frame = cv2.imread(visitor["Image"])
+            if frame is not None:
+                return frame
+        return np.zeros(self.frame_shape, dtype=np.uint8)
+
+    def _run(self):
+        clock = self.simulation.clock
+        events = sorted([(visitor["At"], 0, index) for index, visitor in enumerate(self.simulation.visitors)] +
+                        [(visitor["At"] + visitor["Stay"], 1, index) for index, visitor in enumerate(self.simulation.visitors)])
+        object_ids = {}
+        last_frame_at = None
+
+        while self.running and (events or self.detected_objects):
+            now = clock.now()
+            while events and events[0][0] <= now:
+                _, leaving, index = events.pop(0)
+                visitor = self.simulation.visitors[index]
+                if not leaving:
+                    object_id = object_ids[index] = len(object_ids)
+                    self.detected_objects[object_id] = {'class': visitor["ClassName"], 'box': [0, 0, 0, 0], 'last_seen': datetime.now()}
+                    self.notify_observers('new_object_detected', {
+                        'timestamp': datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+                        'class_name': visitor["ClassName"],
+                        'confidence': visitor["Confidence"],
+                        'object_id': object_id,
+                        'frame': self._frame(visitor),
+                        'detected_at': time.time()
+                    })
+                elif index in object_ids:
+                    self.detected_objects.pop(object_ids[index], None)
+                    if not self.detected_objects:
+                        self.notify_observers('all_objects_left', {'timestamp': datetime.now().strftime("%Y-%m-%d_%H-%M-%S")})
+
+            self.last_inference_time = self.simulation.sample("Inference")
+            clock.sleep(self.last_inference_time)
+            # measured like the detector, from one frame to the next
+            frame_at = clock.now()
+            self.frame_count += 1
+            if last_frame_at is not None and frame_at > last_frame_at:
+                frame_time = frame_at - last_frame_at
+                self.fps = 1.0 / frame_time if self.fps == 0 else 0.9 * self.fps + 0.1 / frame_time
+            last_frame_at = frame_at
+
+        self.finished.set()
+
+    def get_status(self):
+        return {
+            'running': self.running,
+            'fps': round(self.fps, 2),
+            'frames': self.frame_count,
+            'inference_seconds': round(self.last_inference_time, 4),
+            'tracked_objects': [
+                {'object_id': object_id, 'class_name': obj['class'], 'box': obj['box'], 'last_seen': obj['last_seen'].isoformat()}
+                for object_id, obj in dict(self.detected_objects).items()
+            ]
+        }
+
+
+class SimulatedOpenAIService:
+    """
+    Answers assistant calls with canned lines after the scenario's greeting and reply times.
+    """
+    def __init__(self, simulation: Simulation):
+        self.simulation = simulation
+        self._threads = 0
+        self.breaker = CircuitBreaker("openai")
+        self.storage_breaker = CircuitBreaker("storage")
+
+    def create_thread(self):
+        self._threads += 1
+        return SimpleNamespace(id=f"sim_thread_{self._threads}")
+
+    def verify_assistant_async(self):
+        pass
+
+    def generate_assistant_response(self, prompt, media=None, media_data=None, thread=None, media_url=None, timeout=None):
+        self.simulation.api_calls += 1
+        self.simulation.clock.sleep(self.simulation.sample("Greeting" if media else "Reply"))
+        return self.simulation.choice(RESPONSES)
+
+    def generate_chat_response(self, messages, timeout=None, max_tokens=300):
+        # the greeting is the turn that carries the visitor's image
+        has_image = isinstance(messages[-1]["content"], list) and any(part["type"] == "image_url" for part in messages[-1]["content"])
+        self.simulation.api_calls += 1
+        self.simulation.clock.sleep(self.simulation.sample("Greeting" if has_image else "Reply"))
+        return self.simulation.choice(RESPONSES)
+
+    def apply_config(self, config, changes):
+        pass
+
+
+class SimulatedVoiceService:
+    """
+    Speaks and listens in scenario time: speech takes as long as the text would, and the
+    visitor answers from their script.
+    """
+    def __init__(self, simulation: Simulation):
+        self.simulation = simulation
+        self.output_device_index = None
+        self.breaker = CircuitBreaker("elevenlabs")
+        self.barge_in = BargeInDetector(simulation.barge_in_config)
+        self.player = PcmPlayer()
+        self.last_first_audio_at = None
+        # seconds of the interrupting line the visitor had already said when the prop stopped
+        self.pending_interruption = None
+
+    def generate_streaming_audio(self, text: str):
+        self.simulation.on_speak()
+        self.pending_interruption = None
+        first_audio = self.simulation.sample("FirstAudio")
+        self.simulation.clock.sleep(first_audio)
+        self.player.lines += 1
+        self.player.record_first_sample(first_audio)
+        self.last_first_audio_at = self.player.last_first_sample_at
+        line_seconds = len(text) / self.simulation.timings["SpeechRate"]
+
+        interrupt_after = self.simulation.next_interruption() if self.barge_in.enabled else None
+        if interrupt_after is None:
+            self.simulation.clock.sleep(line_seconds)
+            return True
+
+        # the prop stops once the visitor has talked for MinSpeechMs, and no earlier than EchoLearnMs into the line
+        heard = self.barge_in.config["MinSpeechMs"] / 1000
+        stopped_at = max(interrupt_after, self.barge_in.config["EchoLearnMs"] / 1000) + heard
+        if stopped_at >= line_seconds:
+            self.simulation.clock.sleep(line_seconds)
+            return True
+        self.simulation.clock.sleep(stopped_at)
+        self.barge_in.interruptions += 1
+        self.simulation.interruptions += 1
+        self.simulation.speech_cut += line_seconds - stopped_at
+        self.pending_interruption = stopped_at - interrupt_after
+        return True
+
+    def generate_audio(self, text: str):
+        self.generate_streaming_audio(text)
+
+    def play_phrase(self, text: str):
+        # cached lines start right away
+        self.simulation.on_speak()
+        self.last_first_audio_at = time.time()
+        self.simulation.clock.sleep(len(text) / self.simulation.timings["SpeechRate"])
+        return True
+
+    def has_phrase(self, text: str):
+        return True
+
+    def cache_phrase(self, text: str):
+        return None
+
+    def listen_for_response_openai(self):
+        text, duration = self.simulation.next_line()
+        if self.pending_interruption is not None:
+            # the visitor is already talking, no calibration, chime or delay
+            duration = max(0.0, duration - self.pending_interruption)
+            self.pending_interruption = None
+        else:
+            duration += self.simulation.sample("ListenSetup")
+        self.simulation.clock.sleep(duration + self.simulation.sample("Transcription"))
+        self.simulation.on_listen_end()
+        return text
+
+    def play_listening_message(self):
+        pass
+
+    def play_audio_from_file(self, file_path):
+        self.simulation.clock.sleep(self.simulation.sample("Goodbye"))
+
+    def apply_config(self, config, changes):
+        pass
+
+
+class SimulationReport:
+    """
+    Throughput and latency of a replayed scenario, all times in scenario seconds.
+    """
+    def __init__(self, simulation: Simulation, sessions: dict, scenario_seconds: float, wall_seconds: float, detector_frames: int):
+        self.simulation = simulation
+        self.sessions = sessions
+        self.scenario_seconds = scenario_seconds
+        self.wall_seconds = wall_seconds
+        self.detector_frames = detector_frames
+
+    @property
+    def interactions_per_minute(self):
+        return self.sessions['completed'] / (self.scenario_seconds / 60) if self.scenario_seconds > 0 else 0.0
+
+    @property
+    def detector_overlap(self):
+        # detector frame rate during conversations relative to when the prop is idle, 1.0 means no slowdown
+        simulation = self.simulation
+        if not simulation.conversation_seconds or not simulation.idle_seconds or not simulation.idle_frames:
+            return None
+        return (simulation.conversation_frames / simulation.conversation_seconds) / (simulation.idle_frames / simulation.idle_seconds)
+
+    def format(self) -> str:
+        simulation = self.simulation
+        lines = [
+            f"Scenario time: {self.scenario_seconds:.1f}s in {self.wall_seconds:.1f}s wall time ({self.scenario_seconds / self.wall_seconds if self.wall_seconds else 0:.1f}x)",
+            f"Visitors: {len(simulation.arrivals)}, sessions completed: {self.sessions['completed']}, cancelled: {self.sessions['cancelled']}, turned away: {self.sessions['rejected']}",
+            f"Interactions per minute: {self.interactions_per_minute:.2f}",
+            f"Assistant calls: {simulation.api_calls}",
+            f"Barge-ins: {simulation.interruptions}, prop speech cut short: {simulation.speech_cut:.1f}s",
+            f"Queue wait: mean {self.sessions['mean_queue_wait_seconds'] * simulation.clock.time_scale:.2f}s, max {self.sessions['max_queue_wait_seconds'] * simulation.clock.time_scale:.2f}s",
+            "",
+            f"{'Turn latency (seconds)':<34}{'count':>7}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+        ]
+        for name, histogram in (
+            ("Arrival to first words", simulation.greeting_latency),
+            ("Visitor done to reply", simulation.reply_latency),
+            ("Detector blocked per event", simulation.dispatch_time),
+        ):
+            if histogram.count == 0:
+                lines.append(f"{name:<34}{0:>7}")
+                continue
+            lines.append(f"{name:<34}{histogram.count:>7}{histogram.mean:>9.2f}{histogram.percentile(50):>9.2f}"
+                         f"{histogram.percentile(90):>9.2f}{histogram.percentile(99):>9.2f}{histogram.max:>9.2f}")
+
+        lines.append("")
+        overlap = self.detector_overlap
+        lines.append(f"Detector frames: {self.detector_frames}, {simulation.conversation_frames} during conversations ({simulation.conversation_seconds:.1f}s), "
+                     f"{simulation.idle_frames} while idle ({simulation.idle_seconds:.1f}s)")
+        lines.append(f"Detector/conversation overlap: {'n/a' if overlap is None else f'{overlap:.0%} of the idle frame rate'}, "
+                     f"detections while talking: {simulation.detections_during_conversation}")
+        return "\n".join(lines)
+
+
+def _simulation_config(config: dict, simulation: Simulation, log_dir: str) -> dict:
+    config = copy.deepcopy(config)
+    scale = simulation.clock.time_scale
+
+    app = config['App']
+    app['UseTextToSpeech'] = True
+    app['UseSpeechToText'] = True
+    app['ReloadConfigOnChange'] = False
+    # session timeouts are in wall seconds, keep them the same length in scenario time
+    app['SessionMaxWait'] = app.get('SessionMaxWait', 60) / scale
+    simulation.end_words = app.get('EndTriggerWords', [])
+    simulation.barge_in_config = merge_defaults(DEFAULT_BARGE_IN_CONFIG, config.get('BargeIn'))
+    if "BargeIn" in simulation.scenario:
+        simulation.barge_in_config["Enabled"] = simulation.scenario["BargeIn"]
+    budgets = budget_config(config)
+    config['Budgets'] = dict(budgets, Greeting=budgets['Greeting'] / scale, Reply=budgets['Reply'] / scale)
+
+    config['EventBus'] = {"Enabled": False}
+    config['Azure']['MonitorConnectionString'] = ""
+    config['Telemetry'] = dict(config.get('Telemetry', {}), TraceExporter="none")
+    config['Logging'] = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {"standard": {"format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"}},
+        "handlers": {"file": {"class": "logging.FileHandler", "level": "DEBUG", "formatter": "standard",
+                              "filename": os.path.join(log_dir, "simulation.log"), "mode": "w", "encoding": "utf-8"}},
+        "loggers": {"": {"handlers": ["file"], "level": "INFO", "propagate": True}}
+    }
+    return config
+
+
+def replay_scenario(scenario: dict, config: dict, log_dir: str) -> SimulationReport:
+    """
+    Replays a recorded scenario through the real SpookyPi conversation flow.
+
+    The detector, the assistant and the voice are replaced with stand-ins that take the scenario's
+    timings, everything in between (event handling, captures, sessions, the conversation loop) is
+    the code the prop runs.
+
+    The scenario is a dict with:
+        TimeScale: How many times faster than real time to run, 10 by default.
+        Seed: Seed for the timing distributions.
+        Timings: Overrides for DEFAULT_TIMINGS.
+        Visitors: Entries with At and Stay (seconds), ClassName, Confidence, an optional Image
+            and the Responses the visitor gives, each a string or {"Text": ..., "Audio": "clip.wav"}.
+            A response with InterruptAfter (seconds) is started that far into the prop's line before it.
+        BargeIn: Overrides the BargeIn Enabled setting, to compare runs with and without interruptions.
+        Video: Optional video file or image sequence pattern, when set the real ObjectDetector runs
+            on it and the visitor entries only supply the responses, in order of detection.
+        Timeout: Scenario seconds after which the replay is stopped, 3600 by default.
+
+    Args:
+        scenario (dict): The scenario.
+        config (dict): The prop configuration the replay runs with.
+        log_dir (str): Directory for the simulation log, detection log and captures.
+
+    Returns:
+        SimulationReport: Throughput and latency of the replay.
+    """
+    # main pulls in the detector and the services, only load it when a replay runs
+    from main import SpookyPi
+
+    os.makedirs(log_dir, exist_ok=True)
+    simulation = Simulation(scenario)
+    sim_config = _simulation_config(config, simulation, log_dir)
+
+    if scenario.get("Video"):
+        from app.detection.detector import ObjectDetector
+        detector = ObjectDetector(dict(sim_config['Detection'], VideoInputDeviceIndex=scenario["Video"], AllowMultiThreading=True))
+    else:
+        detector = ScriptedDetector(simulation)
+    detector.add_observer(simulation.on_detector_event)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        spooky_pi = SpookyPi(sim_config, detector, SimulatedOpenAIService(simulation), SimulatedVoiceService(simulation), log_dir)
+        simulation.spooky_pi = spooky_pi
+        spooky_pi.handle_events = simulation.timed_dispatch(spooky_pi.handle_events)
+
+        if isinstance(detector, ScriptedDetector):
+            detector_done = detector.finished.is_set
+        else:
+            detector_done = lambda: detector.thread is not None and not detector.thread.is_alive()
+
+        wall_start = time.perf_counter()
+        spooky_pi.start()
+        simulation.start_sampling(detector, detector_done)
+
+        # wait for the scenario to play out and the last conversation to finish
+        deadline = wall_start + scenario.get("Timeout", 3600) / simulation.clock.time_scale
+        while time.perf_counter() < deadline:
+            if detector_done() and spooky_pi.sessions.idle:
+                break
+            time.sleep(0.02)
+
+        scenario_seconds = simulation.clock.now()
+        wall_seconds = time.perf_counter() - wall_start
+        simulation.stop_sampling()
+        spooky_pi.stop()
+
+    return SimulationReport(simulation, spooky_pi.sessions.get_status(), scenario_seconds, wall_seconds, detector.frame_count)
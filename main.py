@@ -1,50 +1,130 @@
 # main.py
+from app.logging import startup_profile
+if startup_profile.profiling_requested():
+    startup_profile.start_profiling()
+
+from app.logging.startup_profile import startup_phase
 from app.detection.detector import ObjectDetector
+from app.detection.costume_classifier import CostumeClassifier
+from app.detection.visitor_index import VisitorIndex, VisitorRecord, appearance_embedding
 from app.ai_services.openai_service import OpenAIService
+from app.ai_services.budgets import budget_config
+from app.ai_services.conversation_engine import create_conversation_engine
 from app.logging.logservice import LogService
-import cv2
+from app.logging.tracing import get_tracer
+from app.logging.detection_log import DetectionLog
+from app.logging.latency_report import StreamingHistogram
+from app.detection.capture_store import CaptureStore
+from app.events.broadcaster import EventBroadcaster
+from app.configuration import load_config, diff_config, ConfigWatcher
+from app.conversation.session import SessionManager
+from app.conversation.speculation import Speculator
+from app.logging.tracing import visitor_context
+from app.events.bus import connect_event_bus, PeerSpeakingMonitor, DETECTION, SPEAKING_STARTED, SPEAKING_FINISHED
 import os
-import json
+import time
+import random
 from app.ai_services.voice_service import VoiceService
 import threading
 
 class SpookyPi:
-    def __init__(self):
+    def __init__(self, config=None, object_detector=None, openai_service=None, voice_service=None, log_dir=None):
+        """
+        Builds the prop from config.json.
+
+        Every argument is optional and replaces the part that would otherwise be built from the
+        configuration, the replay simulator uses them to run the real conversation flow without a
+        camera, a microphone or the live services.
+
+        Args:
+            config (dict): The configuration, read from config.json when not provided.
+            object_detector (ObjectDetector): The detector, or anything with the same observer interface.
+            openai_service (OpenAIService): The assistant service.
+            voice_service (VoiceService): The speech service.
+            log_dir (str): Directory for the detection log and captures, defaults to logs/.
+        """
         # parse a configuration file
         config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_path, 'r') as config_file:
-            self.config = json.load(config_file)
+        self.config_path = config_path
+        self.config = config if config is not None else load_config(config_path)
         
-        self._configure_logging()
+        with startup_phase("logging"):
+            self._configure_logging()
         
-        # initialize the object detector
-        self.object_detector = ObjectDetector(self.config['Detection'])        
+        # initialize the object detector, every detector event is also published to live dashboards
+        with startup_phase("object detector"):
+            self.events = EventBroadcaster()
+            self.object_detector = object_detector or ObjectDetector(self.config['Detection'])        
+            self.object_detector.add_observer(self.events.publish)
         self.logger.info("Initailizing SpookyPi...")
 
-        # initialize the active conversation
-        self.active_conversation = None
-        self.active_exchange_count = 0
+        # a costume label is known on the device right away, the prop can open with a line about it
+        with startup_phase("costume classifier"):
+            self.costume_classifier = CostumeClassifier(self.config.get('Costumes'), self.log_service.get_logger("CostumeClassifier"))
+
+        # kids circle back all night, a returning visitor is welcomed back instead of greeted from scratch
+        self.visitor_index = VisitorIndex(self.config.get('Revisits'))
+
+        # every stage has a latency budget, a blown budget plays a cached fallback line instead of leaving the visitor waiting
+        self.budgets = budget_config(self.config)
+        self.first_audio = {'greeting': StreamingHistogram(), 'reply': StreamingHistogram()}
+        self.fallbacks = {stage: 0 for stage in self.budgets['FallbackLines']}
+
+        # every group gets its own session, the next greeting is prepared while the current group is still talking
         self.max_exchange_count = self.config['App']['MaxExchangeCount']
+        self.sessions = SessionManager(
+            self.prepare_greeting,
+            self.run_session,
+            workers=self.config['App'].get('SessionWorkers', 2),
+            max_queued=self.config['App'].get('MaxQueuedSessions', 3),
+            max_wait=self.config['App'].get('SessionMaxWait', 60),
+            logger=self.log_service.get_logger("SessionManager"))
 
         # initialize the log directory
         self.logger.info("Creating the manual log directory...")
-        self.log_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'logs'))
+        self.log_dir = os.path.abspath(log_dir or os.path.join(os.path.dirname(__file__), 'logs'))
         os.makedirs(self.log_dir, exist_ok=True)
+        self.detection_log = DetectionLog(self.log_dir)
 
         # initialize the capture directory
         self.logger.info("Creating the captures directory...")
         self.capture_dir = os.path.join(self.log_dir, 'captures')
         os.makedirs(self.capture_dir, exist_ok=True)
+        self.capture_store = CaptureStore(self.capture_dir, self.config.get('Captures'), self.log_service.get_logger("CaptureStore"))
 
         # finally init the service instances
         self.logger.info("Initializing services...")
-        self.openai_service = OpenAIService(self.config['Keys']['OpenAI'], self.config, self.log_service.get_logger("OpenAIService"))
+        with startup_phase("openai service"):
+            self.openai_service = openai_service or OpenAIService(self.config['Keys']['OpenAI'], self.config, self.log_service.get_logger("OpenAIService"))
+        # the assistant from the state file is used right away, the api confirms it in the background
+        self.openai_service.verify_assistant_async()
+        # assistant threads by default, or a history kept on the prop with one chat completions request per turn
+        self.conversation = create_conversation_engine(self.config, self.openai_service)
+        # likely visitors get their thread and image upload started before they are confirmed
+        self.speculator = Speculator(self.conversation, self.capture_store, self.config.get('Speculation'), self.log_service.get_logger("Speculator"))
         self.enable_text_to_speech = self.config['App']['UseTextToSpeech']
         self.enable_speech_to_text = self.config['App']['UseSpeechToText']
-        self.voice_service = VoiceService(config_path, self.log_service.get_logger("VoiceService"), self.openai_service)
-        self.listening_for_user_response = False
+        with startup_phase("voice service"):
+            self.voice_service = voice_service or VoiceService(config_path, self.log_service.get_logger("VoiceService"), self.openai_service, self.config)
         self.prop_name = self.config['Prop']['Name']
         self.allow_detection_threading = self.config['Detection']['AllowMultiThreading']
+        self.running = False
+
+        # let other props on this box know what we are doing, and hear what they are doing
+        self.peer_monitor = PeerSpeakingMonitor()
+        with startup_phase("event bus"):
+            self.event_bus, self.event_broker = connect_event_bus(self.config, self.prop_name, [SPEAKING_STARTED, SPEAKING_FINISHED], self.logger)
+        if self.event_bus:
+            self.event_bus.add_callback(self.peer_monitor.on_message)
+
+        # synthesize the openers and fallback lines ahead of time so they play without a text to speech round trip
+        if self.enable_text_to_speech:
+            threading.Thread(target=self.cache_phrases, name="CachePhrases", daemon=True).start()
+
+        # watch the configuration file so settings can be tuned without a restart
+        self.config_watcher = ConfigWatcher(config_path, self.reload_config, logger=self.logger)
+        if self.config['App'].get('ReloadConfigOnChange', False):
+            self.config_watcher.start()
     
     def _configure_logging(self):
         """
@@ -54,6 +134,7 @@ class SpookyPi:
         """
         self.log_service = LogService(self.config)
         self.logger = self.log_service.get_logger(__name__)
+        self.tracer = get_tracer(__name__)
         
     
     def start(self):
@@ -62,8 +143,10 @@ class SpookyPi:
 
         This method adds an observer to the object detector and starts it.
         """
+        self.running = True
         if self.allow_detection_threading:
-            self.object_detector.add_observer(self.handle_events)
+            if self.handle_events not in self.object_detector.observers:
+                self.object_detector.add_observer(self.handle_events)
             self.object_detector.start()
             
         else:
@@ -80,8 +163,22 @@ class SpookyPi:
 
         This method removes the observer from the object detector and stops it.
         """
-        self.active_conversation = None
+        self.running = False
+        self.sessions.cancel_waiting()
+        self.sessions.end_active()
         self.object_detector.stop()
+        self.detection_log.flush()
+        self.logger.info(f"Captures evicted by retention: {self.capture_store.evicted}")
+        if self.visitor_index.enabled:
+            self.logger.info(f"Returning visitors: {self.visitor_index.returning}, duplicate detections: {self.visitor_index.duplicates}, "
+                             f"API calls saved: {self.visitor_index.api_calls_saved}")
+        first_audio = self.get_budget_status()['first_audio']
+        self.logger.info(f"Time to first audio p99: greeting {first_audio['greeting']['p99_seconds']}s, reply {first_audio['reply']['p99_seconds']}s, "
+                         f"fallbacks played: {self.fallbacks}")
+        if self.speculator.enabled:
+            status = self.speculator.get_status()
+            self.logger.info(f"Speculation hits: {status['hits']}, misses: {status['misses']}, seconds saved: {status['saved_seconds']}, "
+                             f"wasted API calls: {status['wasted_api_calls']}")
     
     def handle_events(self, event_type, data):
         
@@ -89,33 +186,70 @@ class SpookyPi:
         Handles events from the object detector.
 
         This method is called when an event is detected by the object detector.
-        It logs and saves the detection, and engages in a conversation with the AI service.
+        It logs and saves the detection and opens a conversation session for the group, the
+        conversation itself runs on the session manager so the detector is never blocked.
 
         Args:
             event_type (str): The type of event detected.
             data (dict): A dictionary containing event data.
         """        
+        if event_type == 'candidate_detected' and self.speculator.enabled:
+            self.speculator.begin(data)
+
+        if event_type == 'candidate_improved':
+            self.speculator.improve(data)
+
+        if event_type == 'candidate_lost':
+            self.speculator.cancel(data['candidate_id'])
+
         if event_type == 'new_object_detected':
             self.logger.info("New object detected.")
-            saved_image = self.log_and_save_detection(data)
-            self.initiate_conversation(data, saved_image)
-
-        if event_type == 'object_left':
+            if self.event_bus:
+                self.event_bus.publish(DETECTION, data['object_id'], data['class_name'])
+            embedding, previous = self.recognize_visitor(data)
+            if previous is not None and previous.payload.state in ('queued', 'active'):
+                # the detector lost track of someone who already has a session
+                self.logger.info(f"Object {data['object_id']} is object {previous.payload.object_id} again ({previous.similarity:.2f}), no new session.")
+                self.visitor_index.duplicates += 1
+                self.visitor_index.remember(embedding, previous.payload, previous.slot)
+                self.speculator.cancel(data.get('candidate_id'))
+                return
+
+            capture = self.log_and_save_detection(data)
+            speculation = None
+            if previous is not None and previous.payload.state == 'ended':
+                self.welcome_back(data, previous)
+                self.speculator.cancel(data.get('candidate_id'))
+            else:
+                self.classify_costume(data)
+                speculation = self.speculator.commit(data.get('candidate_id'))
+                if speculation is not None:
+                    data['speculation'] = speculation
+
+            session = self.sessions.open(data, capture)
+            if session is None and speculation is not None:
+                self.speculator.discard(speculation)
+            if embedding is not None and session is not None:
+                self.visitor_index.returning += 'returning' in data
+                session.record = VisitorRecord(session.object_id, session.state)
+                self.visitor_index.remember(embedding, session.record, previous.slot if previous else None)
+
+        if event_type == 'all_objects_left':
+            # groups that left before their turn came up are not greeted
             self.logger.info("Object left the frame.")
-            self.active_conversation = None 
-            self.listening_for_user_response = False
+            self.sessions.cancel_waiting()
             
     def log_and_save_detection(self, data):
         """
         Logs and saves the detection data.
 
-        This method logs the detection data and saves the image to the capture directory.
+        This method logs the detection data and queues the image to be saved to the capture directory.
 
         Args:
             data (dict): A dictionary containing detection data.
 
         Returns:
-            str: The path of the saved image.
+            Capture: The path of the saved image and its encoded bytes.
         """
         timestamp = data['timestamp']
         class_name = data['class_name']
@@ -125,10 +259,10 @@ class SpookyPi:
 
         # Generate a unique filename for the image
         image_filename = f"{class_name}_{timestamp}_{object_id}.jpg"
-        image_path = os.path.join(self.capture_dir, image_filename)
 
-        # Save the image
-        cv2.imwrite(image_path, frame)
+        # Encode the image, the file is written in the background
+        with self.tracer.start_as_current_span("capture.save"):
+            capture = self.capture_store.save(frame, image_filename)
 
         # Prepare log message
         log_message = f"{timestamp} - Detected: {class_name}, Image: {image_filename}, Confidence: {confidence:.2f}, ID: {object_id}"
@@ -136,66 +270,186 @@ class SpookyPi:
         # Print to console
         self.logger.info(log_message)
 
-        # Save to log file
-        log_file_path = os.path.join(self.log_dir, f"detection_log_{timestamp[:10]}.txt")
-        with open(log_file_path, 'a') as log_file:
-            log_file.write(log_message + '\n')
+        # Save to log file, the write happens on the detection log's writer thread
+        self.detection_log.append(timestamp, log_message)
 
-        # Return the path of the saved image
-        return image_path
+        # Return the capture
+        return capture
+
+    def classify_costume(self, data):
+        """
+        Labels the visitor's costume and picks an opener line for it.
 
-    def initiate_conversation(self, data, image_path):
+        The label and opener are stored in the event data as 'costume' and 'opener', both are left
+        out when the classifier is disabled or not confident.
 
+        Args:
+            data (dict): The new object event data, with the frame and the person's box.
         """
-        Initiates or continues a conversation with the AI service based on detected object data.
+        if not self.costume_classifier.enabled:
+            return
+
+        with self.tracer.start_as_current_span("costume.classify"):
+            costume = self.costume_classifier.classify(data['frame'], data.get('box'))
+        if costume is None:
+            return
 
-        This method is called when a new object is detected. It prepares the necessary information
-        and interacts with the OpenAI service to generate a response about the detected object.
+        self.logger.info(f"Costume for object {data['object_id']}: {costume.label} ({costume.confidence:.2f}) in {costume.inference_time * 1000:.1f}ms")
+        data['costume'] = costume.label
+        lines = self.costume_classifier.opener_lines(costume.label)
+        if lines:
+            data['opener'] = random.choice(lines)
+
+    def recognize_visitor(self, data):
+        """
+        Looks the visitor up in the index of recent visitors.
 
         Args:
-            data (dict): A dictionary containing information about the detected object.
-                Expected keys:
-                - 'timestamp': The time when the object was detected.
-                - 'class_name': The type of object detected (e.g., 'person', 'cat', 'dog').
-                - 'confidence': The confidence level of the detection.
-                - 'object_id': A unique identifier for the detected object.
-                - 'frame': The image frame containing the detected object.
-            image_path (str): The path to the image file containing the detected object.
+            data (dict): The new object event data, with the frame and the person's box.
+
+        Returns:
+            tuple: The visitor's appearance embedding and their VisitorMatch, the embedding is None
+            when the index is disabled and the match is None for a new visitor.
         """
-        
-        # Prepare initial message for the AI assistant
-        if self.active_conversation is None:
-            
-            # Reset the conversation
-            initial_message = "Forget anything we've discussed to this point, we are starting over. "
-            
-            # The actual Prompt
-            initial_message = initial_message + f"Analyze this image containing at least one {data['class_name']} and start a conversation with the individual or group that you see."
-            
+        if not self.visitor_index.enabled:
+            return None, None
 
-        # capture the response from the AI
-        self.active_conversation = self.openai_service.generate_assistant_response(initial_message, image_path)
+        with self.tracer.start_as_current_span("visitor.lookup"):
+            embedding = appearance_embedding(data['frame'], data.get('box'))
+            return embedding, self.visitor_index.lookup(embedding)
 
-        # Process the AI's response
-        if self.enable_text_to_speech:
-            print(f"{self.prop_name}'s response:\n{self.active_conversation}")
-            self.voice_service.generate_streaming_audio(self.active_conversation) 
-        else:
-            print(f"{self.prop_name}'s response:\n{self.active_conversation}")
+    def welcome_back(self, data, previous):
+        """
+        Marks a returning visitor's session to resume their earlier conversation with a cached line.
+
+        The greeting is not written again, so the image upload, the new thread, the assistant run and
+        the speech synthesis are all skipped.
+
+        Args:
+            data (dict): The new object event data.
+            previous (VisitorMatch): The match, its payload is the VisitorRecord of the visitor's last session.
+        """
+        self.logger.info(f"Object {data['object_id']} is returning visitor {previous.payload.object_id} ({previous.similarity:.2f}), "
+                         f"last seen {time.time() - previous.last_seen:.0f}s ago.")
+        data['returning'] = previous.payload.object_id
+        data['resume_engine'] = previous.payload.engine
+        data['resume_thread'] = previous.payload.thread
+        data['opener'] = random.choice(self.visitor_index.config['WelcomeBackLines'])
+
+    def cache_phrases(self):
+        """
+        Synthesizes every fallback line, costume opener and welcome back line once, runs in the background at startup.
+        """
+        # fallback lines first, they are what plays when the speech synthesis itself is down
+        lines = [line for fallbacks in self.budgets['FallbackLines'].values() for line in fallbacks]
+        if self.visitor_index.enabled:
+            lines += self.visitor_index.config['WelcomeBackLines']
+        if self.costume_classifier.enabled:
+            lines += [line for openers in self.costume_classifier.config['Openers'].values() for line in openers]
+
+        for line in lines:
+            try:
+                self.voice_service.cache_phrase(line)
+            except Exception as e:
+                self.logger.warning(f"Could not cache the line \"{line}\": {e}")
+                return
+
+    def prepare_greeting(self, session):
+        """
+        Writes the greeting for a session, runs on the session manager's worker pool.
+
+        The session gets its own assistant thread so groups waiting in line never share a conversation.
+        Returning visitors pick up their earlier thread and are not greeted again.
+
+        Args:
+            session (ConversationSession): The session of the newly detected group.
+
+        Returns:
+            str: The greeting, None for a returning visitor.
+        """
+        if 'returning' in session.data:
+            session.engine = session.data['resume_engine']
+            session.thread = session.data['resume_thread']
+            return None
+
+        with visitor_context(session.object_id):
+            if 'detected_at' in session.data:
+                self.logger.info(f"Detection to first API call: {time.time() - session.data['detected_at']:.3f}s")
+
+            # a confirmed candidate may already have its thread and image
+            session.engine = self.conversation
+            thread, image_url = None, None
+            if 'speculation' in session.data:
+                thread, image_url = self.speculator.resolve(session.data['speculation'])
+                self.logger.info(f"Speculative work used: thread {'yes' if thread else 'no'}, image {'yes' if image_url else 'no'}.")
+                if not session.engine.remote_history:
+                    # the engine was switched since the work was started
+                    thread, image_url = None, None
+
+            session.thread = thread or session.engine.create_thread()
+            initial_message = f"Analyze this image containing at least one {session.class_name} and start a conversation with the individual or group that you see."
+            if 'costume' in session.data:
+                initial_message += f" The visitor seems to be dressed as a {session.data['costume']}."
+            if 'opener' in session.data:
+                initial_message += f" You have already greeted them with: \"{session.data['opener']}\", carry on from there without greeting them again."
+            return session.engine.respond(initial_message, session.capture.path, session.capture.data, thread=session.thread,
+                                          media_url=image_url, timeout=self.budgets['Greeting'])
+
+    def run_session(self, session):
+        """
+        Greets the group and carries the conversation, runs on the session manager's stage thread.
+
+        Args:
+            session (ConversationSession): The session whose turn it is.
+        """
+        with visitor_context(session.object_id):
+            # the costume opener covers the wait for the assistant's greeting
+            opener = session.data.get('opener')
+            if opener:
+                self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': self.prop_name, 'text': opener})
+                self.speak_response(opener, cached=True)
+
+            greeting_ready = session.greeting.done()
+            self.logger.info(f"Greeting for object {session.object_id} was {'ready' if greeting_ready else 'not ready'} when its session started.")
+            try:
+                greeting = session.greeting.result(timeout=max(0.0, self.budgets['Greeting'] - (time.time() - session.started_at)))
+            except Exception as e:
+                # the late greeting is dropped, its run cancels itself once the run budget is spent
+                self.logger.warning(f"Greeting for object {session.object_id} failed or blew its budget: {type(e).__name__} {e}")
+                greeting = None
+                if not opener:
+                    self.play_fallback('Greeting', session)
+
+            self.initiate_conversation(session, greeting)
+            self.record_first_audio('greeting', session.started_at)
+
+    def initiate_conversation(self, session, greeting):
+
+        """
+        Starts the conversation with a group with the greeting written for them.
+
+        Args:
+            session (ConversationSession): The session of the group.
+            greeting (str): The assistant's opening line, None when the session resumes an earlier conversation.
+        """
+        if greeting is not None:
+            self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': self.prop_name, 'text': greeting})
+
+            # Process the AI's response
+            self.speak_response(greeting)
 
         # Now go into the contuation loop until the user stops it
-        self.continue_conversation()
+        self.continue_conversation(session)
     
-    def continue_conversation(self):
+    def continue_conversation(self, session):
         """
         Continues the conversation with the AI service. Allowing the user to provide responses and interact with the AI assistant.
-        """
-        if self.active_conversation is None:
-            print("No active conversation to continue.")
-            return
 
-        while self.active_conversation:
-            self.listening_for_user_response = True
+        Args:
+            session (ConversationSession): The session of the group.
+        """
+        while self.running and session.state == 'active':
+            session.listening = True
            
             # Get the user's response
             if self.enable_speech_to_text:
@@ -206,33 +460,39 @@ class SpookyPi:
                     continue
                 else:
                     self.logger.info(f"User response: {user_response}")
+                    self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': 'visitor', 'text': user_response})
                     end_trigger_words = self.config['App']['EndTriggerWords']
                     if any(word.lower() in user_response.lower() for word in end_trigger_words):
                         self.logger.info("End trigger word detected. Ending conversation.")
-                        self.active_conversation = None
-                        self.active_exchange_count = 0
+                        self.events.publish('conversation_ended', {'object_id': session.object_id, 'reason': 'end_trigger_word'})
+                        session.end()
                         self.play_goodbye_message()
                         break
             else:
                 user_response = input("Your response: ")
-
-            # Capture the response from the AI
-            self.active_conversation = self.openai_service.generate_assistant_response(user_response)
-
-            # Process the AI's response
-            if self.enable_text_to_speech:
-                print(f"{self.prop_name}'s response:\n{self.active_conversation}")
-                self.voice_service.generate_streaming_audio(self.active_conversation) 
-                
+                self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': 'visitor', 'text': user_response})
+            session.listening = False
+
+            # Capture the response from the AI, a reply over budget is cancelled and covered by a fallback line
+            reply_started = time.time()
+            try:
+                response = session.engine.respond(user_response, thread=session.thread, timeout=self.budgets['Reply'])
+            except Exception as e:
+                self.logger.warning(f"Reply failed or blew its budget: {type(e).__name__} {e}")
+                self.play_fallback('Reply', session)
             else:
-                print(f"{self.prop_name}'s response:\n{self.active_conversation}")
+                self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': self.prop_name, 'text': response})
+
+                # Process the AI's response
+                self.speak_response(response)
+            self.record_first_audio('reply', reply_started)
 
             # check to see if we have reached the max exchange count
             
-            if self.active_exchange_count >= self.max_exchange_count:
+            if session.exchange_count >= self.max_exchange_count:
                 self.logger.info(f"Reached the maximum exchange count of {self.max_exchange_count}. Ending conversation.")
-                self.active_conversation = None
-                self.active_exchange_count = 0
+                self.events.publish('conversation_ended', {'object_id': session.object_id, 'reason': 'max_exchange_count'})
+                session.end()
                 if self.enable_text_to_speech:
                     self.logger.info("Playing goodbye message...")
                     self.play_goodbye_message()
@@ -240,8 +500,195 @@ class SpookyPi:
                     self.logger.info("Printing goodbye message...")
                     print("Goodbye!")
             else:
-                self.active_exchange_count += 1
+                session.exchange_count += 1
     
+    def reload_config(self, new_config=None):
+        """
+        Applies configuration changes to the running services.
+
+        Only the sections that changed are applied, the detection network stays loaded and the
+        services keep their clients, threads and streams.
+
+        Args:
+            new_config (dict): The new configuration, read from config.json when not provided.
+
+        Returns:
+            dict: The changed keys per section.
+        """
+        if new_config is None:
+            new_config = load_config(self.config_path)
+
+        changes = diff_config(self.config, new_config)
+        if not changes:
+            self.logger.info("Configuration reloaded, nothing changed.")
+            return changes
+
+        self.logger.info(f"Applying configuration changes: {', '.join(f'{section}({len(keys)})' for section, keys in changes.items())}")
+
+        if 'Detection' in changes:
+            self.object_detector.apply_configuration(new_config['Detection'])
+            self.allow_detection_threading = new_config['Detection']['AllowMultiThreading']
+
+        if changes.keys() & {'Prop', 'App', 'Azure', 'Keys', 'Endpoints', 'Budgets'}:
+            self.openai_service.apply_config(new_config, changes)
+
+        if changes.keys() & {'Prop', 'App', 'Keys', 'SpeechToText', 'Endpoints', 'Budgets', 'Playback', 'BargeIn'}:
+            self.voice_service.apply_config(new_config, changes)
+
+        if 'Captures' in changes:
+            self.capture_store.apply_config(new_config.get('Captures'))
+
+        if 'Costumes' in changes:
+            self.costume_classifier.apply_config(new_config.get('Costumes'))
+
+        if 'Revisits' in changes:
+            self.visitor_index.apply_config(new_config.get('Revisits'))
+
+        if 'Speculation' in changes:
+            self.speculator.apply_config(new_config.get('Speculation'))
+
+        if 'Conversation' in changes:
+            # sessions already talking keep the engine and thread they started with
+            self.conversation = create_conversation_engine(new_config, self.openai_service)
+            self.speculator.engine = self.conversation
+
+        if 'Budgets' in changes:
+            self.budgets = budget_config(new_config)
+
+        if 'App' in changes:
+            self.max_exchange_count = new_config['App']['MaxExchangeCount']
+            self.enable_text_to_speech = new_config['App']['UseTextToSpeech']
+            self.enable_speech_to_text = new_config['App']['UseSpeechToText']
+            self.sessions.max_queued = new_config['App'].get('MaxQueuedSessions', 3)
+            self.sessions.max_wait = new_config['App'].get('SessionMaxWait', 60)
+
+        if 'Prop' in changes:
+            self.prop_name = new_config['Prop']['Name']
+
+        if changes.keys() & {'Logging', 'Telemetry'}:
+            self.logger.warning("Logging and telemetry changes take effect after a restart.")
+
+        self.config = new_config
+        self.events.publish('config_reloaded', {'sections': sorted(changes)})
+        return changes
+
+    def get_status(self):
+        """
+        Returns a snapshot of the application state for the control api.
+
+        Returns:
+            dict: The running state, the detector status and the conversation state.
+        """
+        session = self.sessions.active
+        return {
+            'prop': self.prop_name,
+            'running': self.running,
+            'detector': self.object_detector.get_status(),
+            'conversation': {
+                'active': session is not None,
+                'engine': self.conversation.name,
+                'listening': session.listening if session else False,
+                'exchange_count': session.exchange_count if session else 0,
+                'max_exchange_count': self.max_exchange_count
+            },
+            'sessions': self.sessions.get_status(),
+            'revisits': self.visitor_index.get_status(),
+            'speculation': self.speculator.get_status(),
+            'barge_in': self.voice_service.barge_in.get_status(),
+            'playback': self.voice_service.player.get_status(),
+            'budgets': self.get_budget_status(),
+            'captures_evicted': self.capture_store.evicted,
+            'detection_log_dropped': self.detection_log.dropped,
+            'log_records_dropped': self.log_service.queue_handler.dropped if self.log_service.queue_handler else 0,
+            'event_subscribers': self.events.subscriber_count
+        }
+
+    def speak_response(self, text, cached=False):
+        """
+        Speaks the prop's response, or prints it when text to speech is disabled.
+
+        When the event bus is enabled the prop waits for other props to finish talking and
+        announces when it starts and stops speaking.
+
+        Args:
+            text (str): The response to speak.
+            cached (bool): Play the line from the phrase cache when it was synthesized ahead of time.
+        """
+        print(f"{self.prop_name}'s response:\n{text}")
+        if not self.enable_text_to_speech:
+            return
+
+        play = self.voice_service.play_phrase if cached else self.voice_service.generate_streaming_audio
+        if not self.event_bus:
+            played = play(text)
+        else:
+            waited = self.peer_monitor.wait_until_quiet()
+            if waited > 0.05:
+                self.logger.info(f"Waited {waited:.2f}s for other props to finish speaking.")
+
+            self.event_bus.publish(SPEAKING_STARTED)
+            try:
+                played = play(text)
+            finally:
+                self.event_bus.publish(SPEAKING_FINISHED)
+
+        # the line could not be synthesized in time, say something rather than nothing
+        if played is False:
+            self.play_fallback('Voice')
+
+    def play_fallback(self, stage, session=None):
+        """
+        Plays a pre-rendered fallback line for a stage that failed or blew its budget.
+
+        Only lines already in the phrase cache are played, a fallback never waits on the speech synthesis.
+
+        Args:
+            stage (str): Greeting, Reply or Voice.
+            session (ConversationSession): The session the line is spoken in, for the conversation events.
+        """
+        self.fallbacks[stage] = self.fallbacks.get(stage, 0) + 1
+        lines = self.budgets['FallbackLines'].get(stage) or []
+        if not lines:
+            return
+
+        line = random.choice(lines)
+        print(f"{self.prop_name}'s response:\n{line}")
+        if session is not None:
+            self.events.publish('conversation_turn', {'object_id': session.object_id, 'speaker': self.prop_name, 'text': line, 'fallback': stage})
+        if not self.enable_text_to_speech:
+            return
+        if self.voice_service.has_phrase(line):
+            self.voice_service.play_phrase(line)
+        else:
+            self.logger.warning(f"The {stage} fallback line is not cached yet, nothing was played.")
+
+    def record_first_audio(self, kind, since):
+        """
+        Records the time from the start of a turn to the first audio the visitor heard in it.
+        """
+        first_audio_at = self.voice_service.last_first_audio_at
+        if self.enable_text_to_speech and first_audio_at is not None and first_audio_at >= since:
+            self.first_audio[kind].add(first_audio_at - since)
+
+    def get_budget_status(self):
+        """
+        Returns the time to first audio per turn kind, the fallbacks played and the circuit breaker states.
+        """
+        first_audio = {}
+        for kind, histogram in self.first_audio.items():
+            first_audio[kind] = {
+                'count': histogram.count,
+                'p50_seconds': round(histogram.percentile(50) or 0.0, 3),
+                'p99_seconds': round(histogram.percentile(99) or 0.0, 3),
+                'max_seconds': round(histogram.max or 0.0, 3)
+            }
+        breakers = [self.openai_service.breaker, self.openai_service.storage_breaker, self.voice_service.breaker]
+        return {
+            'first_audio': first_audio,
+            'fallbacks': dict(self.fallbacks),
+            'breakers': {breaker.name: breaker.get_status() for breaker in breakers}
+        }
+
     def play_goodbye_message(self):
         self.voice_service.play_audio_from_file(os.path.join(os.path.dirname(__file__), 'app/ai_services/resources/goodbye.mp3'))
         
@@ -267,9 +714,23 @@ class SpookyPi:
             return separator.join(array[:-1]) + separator + f" {last_separator}" + array[-1]
 
 
+def create_app():
+    """
+    Creates the application for the configuration: a PropOrchestrator when several props are configured, otherwise SpookyPi.
+    """
+    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+    config = load_config(config_path)
+    if len(config.get('Props', [])) > 1:
+        from app.orchestration.orchestrator import PropOrchestrator
+        return PropOrchestrator(config, config_path, LogService(config))
+    return SpookyPi()
+
+
 if __name__ == "__main__":
     
-    spooky_pi = SpookyPi()
+    with startup_phase("create app"):
+        spooky_pi = create_app()
+    startup_profile.finish_profiling("SpookyPi startup")
     spooky_pi.start()
 
     def listen_for_keypress(spooky_pi):
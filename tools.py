@@ -1,42 +1,55 @@
+from app.logging import startup_profile
+if startup_profile.profiling_requested():
+    startup_profile.start_profiling()
+
 import argparse
 import json
 import os
-import cv2
-import pyaudio
-import speech_recognition as sr
-from elevenlabs import ElevenLabs, play, stream
+import time
 
-from app.ai_services.openai_service import OpenAIService
-from azure.storage.blob import BlobServiceClient
+# The camera, audio, OpenAI and Azure sdks are imported by the tools that use them, listing
+# microphones should not have to load OpenCV.
+from app.logging.latency_report import build_latency_report
+from app.events.bus import run_latency_benchmark
+from app.maintenance import purge
 
-def purge_assistants(config):
+def purge_assistants(config, older_than_days=None, prefix=None, dry_run=False, workers=8):
+    from app.ai_services.openai_service import OpenAIService
     print("Purging assistants...")
     # purge any orphaned assistants
     openai_service = OpenAIService(config['Keys']['OpenAI'], config)
-    assistantList = openai_service.get_assistants()
-
-    for assistant in assistantList:
-        print(f"Deleting orphaned assistant {assistant.id}")
-        openai_service.delete_assistant(assistant.id)
-        print("Purge complete.")
+    report = purge.purge_assistants(openai_service.openai_client, older_than_days, prefix, dry_run, workers, _print_purge_progress)
+    print(f"\n{report.format()}")
+    print("Purge complete.")
 
-def purge_storage_blobs(config):
+def purge_storage_blobs(config, older_than_days=None, prefix=None, dry_run=False, workers=4, emulator=False):
+    from azure.storage.blob import BlobServiceClient
     print("Purging storage blobs...")
     
     azure_config = config['Azure']
-    connection_string = azure_config['StorageConnectionString']
+    # the Azurite emulator is used for trying the purge locally
+    connection_string = purge.EMULATOR_CONNECTION_STRING if emulator else azure_config['StorageConnectionString']
     container_name = azure_config['ContainerName']
 
     blob_service_client = BlobServiceClient.from_connection_string(connection_string)
     container_client = blob_service_client.get_container_client(container_name)
 
-    blobs = container_client.list_blobs()
-    for blob in blobs:
-        print(f"Deleting blob: {blob.name}")
-        container_client.delete_blob(blob.name)
-
+    report = purge.purge_storage_blobs(container_client, older_than_days, prefix, dry_run, workers, progress=_print_purge_progress)
+    print(f"\n{report.format()}")
     print("Purge complete.")
 
+def _print_purge_progress(report):
+    print(f"\r{report.deleted}/{report.matched} {report.kind} deleted, {report.failed} failed, {report.rate:.1f}/s", end="", flush=True)
+
+def _confirm_purge(purge_function, config):
+    # count first so nothing is deleted by accident from the menu
+    older_than = input("Only items older than how many days (blank for all): ").strip()
+    older_than_days = float(older_than) if older_than else None
+    prefix = input("Only items whose name starts with (blank for all): ").strip() or None
+    purge_function(config, older_than_days, prefix, dry_run=True)
+    if input("Delete them? (y/n): ").strip().lower() == 'y':
+        purge_function(config, older_than_days, prefix)
+
 def quick_diagnostic(config):
     # Add quick diagnostic code here
     print("Running quick diagnostic...")
@@ -54,6 +67,7 @@ def quick_diagnostic(config):
     print("Quick diagnostic complete.")
     
 def list_microphones():
+    import pyaudio
     p = pyaudio.PyAudio()
     info = p.get_host_api_info_by_index(0)
     numdevices = info.get('deviceCount')
@@ -62,6 +76,282 @@ def list_microphones():
         if (p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
             print("Input Device id ", i, " - ", p.get_device_info_by_host_api_device_index(0, i).get('name'))
 
+def benchmark_speech_to_text(config, clips_dir, backends=("openai", "local")):
+    from app.ai_services.openai_service import OpenAIService
+    from app.ai_services.speech_to_text import create_speech_to_text
+
+    # Each clip is a wav file with an optional transcript of the same name (clip.wav -> clip.txt)
+    print(f"Benchmarking speech to text backends using clips in {clips_dir}...")
+    clips = sorted(f for f in os.listdir(clips_dir) if f.lower().endswith('.wav'))
+    if not clips:
+        print("\033[91mNo wav clips found.\033[0m")
+        return
+
+    openai_service = OpenAIService(config['Keys']['OpenAI'], config)
+
+    for backend_name in backends:
+        try:
+            backend = create_speech_to_text(config, openai_service, backend=backend_name)
+        except Exception as e:
+            print(f"\033[91mUnable to create the {backend_name} backend: {e}\033[0m")
+            continue
+
+        latencies = []
+        error_rates = []
+        for clip in clips:
+            with open(os.path.join(clips_dir, clip), 'rb') as clip_file:
+                wav_bytes = clip_file.read()
+
+            start_time = time.time()
+            try:
+                text = backend.transcribe(wav_bytes)
+            except Exception as e:
+                print(f"\033[91m[{backend_name}] {clip}: failed - {e}\033[0m")
+                continue
+            latencies.append(time.time() - start_time)
+
+            reference_path = os.path.join(clips_dir, os.path.splitext(clip)[0] + '.txt')
+            if os.path.exists(reference_path):
+                with open(reference_path, 'r') as reference_file:
+                    error_rates.append(_word_error_rate(reference_file.read(), text))
+                print(f"[{backend_name}] {clip}: {latencies[-1]:.2f}s, WER {error_rates[-1]:.2%} - {text.strip()}")
+            else:
+                print(f"[{backend_name}] {clip}: {latencies[-1]:.2f}s - {text.strip()}")
+
+        if latencies:
+            latencies.sort()
+            print(f"[{backend_name}] clips: {len(latencies)}, mean: {sum(latencies) / len(latencies):.2f}s, "
+                  f"p50: {latencies[len(latencies) // 2]:.2f}s, max: {latencies[-1]:.2f}s")
+        if error_rates:
+            print(f"[{backend_name}] mean WER: {sum(error_rates) / len(error_rates):.2%}")
+
+    print("Benchmark complete.")
+
+def latency_report(paths):
+    # Defaults to the app log and the manual detection logs
+    if not paths:
+        root = os.path.dirname(os.path.abspath(__file__))
+        paths = [path for path in (os.path.join(root, 'app.log'), os.path.join(root, 'logs')) if os.path.exists(path)]
+
+    print(f"Building latency report from {', '.join(paths)}...")
+    report = build_latency_report(paths)
+    print(report.format())
+
+def benchmark_event_bus(subscribers=3, messages=2000, rate=500.0):
+    print(f"Benchmarking the event bus: {subscribers} subscriber processes, {messages} messages at {rate or 'max'} messages/s...")
+    results = run_latency_benchmark(subscribers, messages, rate)
+    print(f"Delivered {results['delivered']} of {results['expected']} messages (publish rate {results['publish_rate']}/s, {results['dropped_by_broker']} dropped by the broker).")
+    if results['delivered']:
+        print(f"Latency p50: {results['p50_ms']:.3f}ms, p90: {results['p90_ms']:.3f}ms, p99: {results['p99_ms']:.3f}ms, max: {results['max_ms']:.3f}ms")
+
+def run_mock_server(config, profile_path=None, port=8790):
+    from app.simulation.mock_server import MockServer
+    profile = None
+    if profile_path:
+        with open(profile_path, 'r') as profile_file:
+            profile = json.load(profile_file)
+
+    voices = {config['Prop']['Voice']} | {prop['Voice'] for prop in config.get('Props', []) if 'Voice' in prop}
+    server = MockServer(profile, sorted(voices), port=port)
+    endpoints = server.endpoints()
+    print(f"Mock OpenAI, ElevenLabs and Azure Blob server listening on http://{server.host}:{server.port}")
+    print("Point the prop at it with:")
+    print(f'  "Endpoints": {json.dumps(endpoints["Endpoints"])}')
+    print(f'  "Azure": {{"StorageConnectionString": "{endpoints["StorageConnectionString"]}"}}')
+    print("Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Served {server.state.requests} requests, {server.state.errors} injected errors.")
+
+def simulate(config, scenario_path):
+    from app.simulation.replay import replay_scenario
+    # Scenario files describe the visitors, what they say and how long every stage takes
+    with open(scenario_path, 'r') as scenario_file:
+        scenario = json.load(scenario_file)
+
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'simulation')
+    print(f"Replaying {scenario_path} at {scenario.get('TimeScale', 10.0)}x, logs go to {log_dir}...")
+    report = replay_scenario(scenario, config, log_dir)
+    print(report.format())
+
+def evaluate_costume_classifier(config, captures_dir=None):
+    import csv
+    import cv2
+    from app.detection.costume_classifier import CostumeClassifier
+    from app.logging.latency_report import StreamingHistogram
+
+    # Captures are whole frames, an optional labels.csv (file_name,label) gives the expected costume per capture
+    captures_dir = captures_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'captures')
+    costume_config = dict(config.get('Costumes', {}), Enabled=True)
+    classifier = CostumeClassifier(costume_config)
+    if not classifier.enabled:
+        print("\033[91mThe costume classifier model could not be loaded, check ModelPath and LabelsPath.\033[0m")
+        return
+
+    captures = sorted(f for f in os.listdir(captures_dir) if f.lower().endswith('.jpg'))
+    if not captures:
+        print(f"\033[91mNo captures found in {captures_dir}.\033[0m")
+        return
+
+    expected = {}
+    labels_path = os.path.join(captures_dir, 'labels.csv')
+    if os.path.exists(labels_path):
+        with open(labels_path, 'r', newline='') as labels_file:
+            expected = {row[0].strip(): row[1].strip() for row in csv.reader(labels_file) if len(row) >= 2}
+
+    print(f"Classifying {len(captures)} captures in {captures_dir}...")
+    latencies = StreamingHistogram()
+    predicted_counts, true_positives, expected_counts = {}, {}, {}
+    confident = correct = labeled = 0
+    for capture in captures:
+        frame = cv2.imread(os.path.join(captures_dir, capture))
+        if frame is None:
+            continue
+        result = classifier.predict(frame)
+        latencies.add(result.inference_time)
+        label = result.label if result.confidence >= classifier.config['MinConfidence'] else None
+        confident += label is not None
+        predicted_counts[label] = predicted_counts.get(label, 0) + 1
+
+        truth = expected.get(capture)
+        if truth is not None:
+            labeled += 1
+            expected_counts[truth] = expected_counts.get(truth, 0) + 1
+            if label == truth:
+                correct += 1
+                true_positives[truth] = true_positives.get(truth, 0) + 1
+        print(f"{capture}: {result.label} ({result.confidence:.2f}){'' if label else ' below MinConfidence'}{f', expected {truth}' if truth else ''}")
+
+    if not latencies.count:
+        return
+    print(f"Inference: mean {latencies.mean * 1000:.1f}ms, p50 {latencies.percentile(50) * 1000:.1f}ms, "
+          f"p95 {latencies.percentile(95) * 1000:.1f}ms, max {latencies.max * 1000:.1f}ms")
+    print(f"Confident labels: {confident} of {latencies.count} ({confident / latencies.count:.0%})")
+    for label, count in sorted(predicted_counts.items(), key=lambda item: -item[1]):
+        print(f"  {label or '(none)'}: {count}")
+
+    if labeled:
+        print(f"Accuracy on {labeled} labeled captures: {correct / labeled:.1%}")
+        for label in sorted(expected_counts):
+            hits = true_positives.get(label, 0)
+            predicted = predicted_counts.get(label, 0)
+            print(f"  {label}: precision {hits / predicted if predicted else 0:.1%}, recall {hits / expected_counts[label]:.1%}")
+
+def benchmark_visitor_index(config, lookups=2000):
+    import numpy as np
+    from app.detection.visitor_index import VisitorIndex, EMBEDDING_SIZE
+
+    # A full index of random appearances, the lookups are timed by the index itself
+    index = VisitorIndex(config.get('Revisits'))
+    capacity = len(index.last_seen)
+    rng = np.random.default_rng(7)
+    embeddings = np.sqrt(rng.dirichlet(np.ones(EMBEDDING_SIZE), size=capacity)).astype(np.float32)
+    for embedding in embeddings:
+        index.remember(embedding, None)
+
+    print(f"Timing {lookups} lookups in an index of {capacity} visitors...")
+    for i in range(lookups):
+        index.lookup(embeddings[i % capacity])
+
+    latencies = index.lookup_time
+    print(f"Lookup: mean {latencies.mean * 1000:.3f}ms, p50 {latencies.percentile(50) * 1000:.3f}ms, "
+          f"p99 {latencies.percentile(99) * 1000:.3f}ms, max {latencies.max * 1000:.3f}ms")
+
+def benchmark_conversation_engines(config, profile_path=None, conversations=5, replies=3):
+    import copy
+    import tempfile
+    import cv2
+    import numpy as np
+    from app.simulation.mock_server import MockServer
+    from app.ai_services.openai_service import OpenAIService
+    from app.ai_services.assistant_state import AssistantState
+    from app.ai_services.conversation_engine import create_conversation_engine
+    from app.logging.latency_report import StreamingHistogram
+
+    profile = None
+    if profile_path:
+        with open(profile_path, 'r') as profile_file:
+            profile = json.load(profile_file)
+
+    # Both engines talk to the mock server, round trips are the requests it served during a turn
+    server = MockServer(profile, port=0).start()
+    endpoints = server.endpoints()
+    bench_config = copy.deepcopy(config)
+    bench_config['Endpoints'] = endpoints['Endpoints']
+    bench_config['Azure']['StorageConnectionString'] = endpoints['StorageConnectionString']
+    bench_config['Azure']['ContainerName'] = bench_config['Azure'].get('ContainerName') or "benchmark"
+    bench_config['Prop']['AssistantId'] = ""
+    state_dir = tempfile.mkdtemp()
+    openai_service = OpenAIService("mock", bench_config, assistant_state=AssistantState(os.path.join(state_dir, 'assistant_state.json')))
+    openai_service.verify_assistant()
+
+    # a blurred noise frame at the capture width encodes to about the size of a real capture
+    max_width = bench_config.get('Captures', {}).get('MaxWidth') or 1280
+    frame = cv2.GaussianBlur(np.random.default_rng(7).integers(0, 256, (max_width * 9 // 16, max_width, 3), dtype=np.uint8), (9, 9), 0)
+    image = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), bench_config.get('Captures', {}).get('JpegQuality', 85)])[1].tobytes()
+
+    print(f"Benchmarking {conversations} conversations of a greeting and {replies} replies per engine against the mock server ({len(image)} byte image)...")
+    try:
+        for engine_name in ("assistants", "chat"):
+            engine = create_conversation_engine(bench_config, openai_service, engine_name)
+            turns = {'greeting': (StreamingHistogram(), []), 'reply': (StreamingHistogram(), [])}
+            for conversation in range(conversations):
+                for turn in range(replies + 1):
+                    kind = 'greeting' if turn == 0 else 'reply'
+                    requests = server.state.requests
+                    start_time = time.perf_counter()
+                    if turn == 0:
+                        thread = engine.create_thread()
+                        engine.respond("Start a conversation with the visitor in this image.", f"benchmark_{conversation}.jpg", image, thread=thread)
+                    else:
+                        engine.respond("Trick or treat!", thread=thread)
+                    turns[kind][0].add(time.perf_counter() - start_time)
+                    turns[kind][1].append(server.state.requests - requests)
+
+            for kind, (latencies, round_trips) in turns.items():
+                print(f"{engine_name:>10} {kind:<8}: {sum(round_trips) / len(round_trips):.1f} round trips, p50 {latencies.percentile(50):.3f}s, "
+                      f"p95 {latencies.percentile(95):.3f}s, max {latencies.max:.3f}s")
+    finally:
+        server.stop()
+
+def hardware_self_test(config, save=False, ask=False):
+    from app.maintenance import self_test
+
+    # A baseline is saved on the first run, later runs are compared with it until it is saved again
+    test_config = self_test.self_test_config(config)
+    baseline_path = self_test.resolve_path(test_config["BaselinePath"])
+    print("Running the hardware self-test, keep the room quiet during the microphone calibration...")
+    report = self_test.run_self_test(config, progress=lambda name: print(f"Testing {name}..."))
+    print(report.format())
+
+    if ask and report.baseline is not None:
+        save = input("Save the results as the new baseline? (y/n): ").strip().lower() == 'y'
+    if save or report.baseline is None:
+        self_test.save_baseline(report, baseline_path)
+        print(f"Saved the results as the baseline in {baseline_path}.")
+    if report.failures or report.regressions:
+        print("\033[91mSome tests failed, missed their limits or regressed, see the results above.\033[0m")
+
+def _word_error_rate(reference, hypothesis):
+    # Levenshtein distance over words, normalized by the reference length
+    strip = lambda text: [w.strip(".,!?;:\"'").lower() for w in text.split() if w.strip(".,!?;:\"'")]
+    ref, hyp = strip(reference), strip(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+
+    return previous[-1] / len(ref)
+
 def _check_azure_config(config):
     # Azure key must exist.
     if 'Azure' in config:
@@ -120,6 +410,7 @@ def _check_keys_config(config):
 
 def _check_camera_health(config):
     # Check camera health here
+    import cv2
     print("Checking camera health...")
     cam_index = config['Detection']['VideoInputDeviceIndex']
     print(f"Using camera index {cam_index}")
@@ -131,6 +422,7 @@ def _check_camera_health(config):
     cap.release()
 
 def _check_audio_input(config):
+    import speech_recognition as sr
     mic_index = config['App']['AudioInputDeviceIndex']
     try:            
         rec = sr.Recognizer()
@@ -148,6 +440,7 @@ def _check_audio_input(config):
         print(f"Could not request results from Google Speech Recognition service; {e}")
 
 def _test_record_and_playback(config):
+    import pyaudio
     mic_index = config['App']['AudioInputDeviceIndex']
     
     p = pyaudio.PyAudio()
@@ -196,12 +489,58 @@ def main():
 
     parser = argparse.ArgumentParser(description="Tools script for spooky season.")
     parser.add_argument('--purge_assistants', action='store_true', help='Purge assistants')
+    parser.add_argument('--purge_blobs', action='store_true', help='Purge storage blobs')
+    parser.add_argument('--older_than', type=float, metavar='DAYS', help='Only purge items older than this many days')
+    parser.add_argument('--prefix', help='Only purge items whose name starts with this prefix')
+    parser.add_argument('--dry_run', action='store_true', help='Count the items a purge would delete without deleting them')
+    parser.add_argument('--workers', type=int, help='Number of concurrent delete requests')
+    parser.add_argument('--emulator', action='store_true', help='Purge blobs from the local Azurite emulator')
+    parser.add_argument('--benchmark_stt', metavar='CLIPS_DIR', help='Compare speech to text backends on recorded wav clips')
+    parser.add_argument('--bus_benchmark', action='store_true', help='Measure event bus delivery latency between local processes')
+    parser.add_argument('--latency_report', nargs='*', metavar='LOG_PATH', help='Summarize interaction latencies from app.log and detection logs')
+    parser.add_argument('--mock_server', nargs='?', const='', metavar='PROFILE_JSON', help='Serve mock OpenAI, ElevenLabs and Azure Blob endpoints with the latency profile')
+    parser.add_argument('--simulate', metavar='SCENARIO_JSON', help='Replay a visitor scenario through the conversation flow and report throughput and latency')
+    parser.add_argument('--costume_eval', nargs='?', const='', metavar='CAPTURES_DIR', help='Run the costume classifier over captures and report accuracy and inference time')
+    parser.add_argument('--revisit_benchmark', action='store_true', help='Time returning visitor lookups in a full index')
+    parser.add_argument('--engine_benchmark', nargs='?', const='', metavar='PROFILE_JSON', help='Compare round trips and latency per turn of the assistants and chat conversation engines on the mock server')
+    parser.add_argument('--self_test', action='store_true', help='Measure camera, YOLO, microphone, audio output and disk performance against the thresholds and the baseline')
+    parser.add_argument('--save_baseline', action='store_true', help='Save the self-test results as the new baseline')
+    parser.add_argument('--profile_startup', action='store_true', help='Print an import and initialization timeline for the command')
     
     args = parser.parse_args()
     
-    if args.purge_assistants:
-        purge_assistants(config)
-    else:
+    purge_options = {'older_than_days': args.older_than, 'prefix': args.prefix, 'dry_run': args.dry_run}
+    if args.workers:
+        purge_options['workers'] = args.workers
+
+    with startup_profile.startup_phase("command"):
+        ran_command = True
+        if args.purge_assistants:
+            purge_assistants(config, **purge_options)
+        elif args.purge_blobs:
+            purge_storage_blobs(config, emulator=args.emulator, **purge_options)
+        elif args.benchmark_stt:
+            benchmark_speech_to_text(config, args.benchmark_stt)
+        elif args.bus_benchmark:
+            benchmark_event_bus()
+        elif args.latency_report is not None:
+            latency_report(args.latency_report)
+        elif args.mock_server is not None:
+            run_mock_server(config, args.mock_server or None)
+        elif args.simulate:
+            simulate(config, args.simulate)
+        elif args.costume_eval is not None:
+            evaluate_costume_classifier(config, args.costume_eval or None)
+        elif args.revisit_benchmark:
+            benchmark_visitor_index(config)
+        elif args.engine_benchmark is not None:
+            benchmark_conversation_engines(config, args.engine_benchmark or None)
+        elif args.self_test:
+            hardware_self_test(config, args.save_baseline)
+        else:
+            ran_command = False
+
+    if not ran_command:
         while True:
             print("\nTool Options Menu:")
             print("0: Exit")
@@ -210,6 +549,15 @@ def main():
             print("3: Purge Storage Blobs")
             print("4: List Microphones")
             print("5: Test record and playback")
+            print("6: Benchmark speech to text")
+            print("7: Latency report")
+            print("8: Benchmark event bus")
+            print("9: Run mock API server")
+            print("10: Replay a visitor scenario")
+            print("11: Evaluate the costume classifier")
+            print("12: Benchmark returning visitor lookups")
+            print("13: Benchmark conversation engines")
+            print("14: Hardware self-test")
             
             # Add more options here as needed
             
@@ -218,18 +566,43 @@ def main():
             if choice == '0':
                 print("Exiting...")
                 break
-            elif choice == '1':
-                quick_diagnostic(config)
-            elif choice == '2':
-                purge_assistants(config)
-            elif choice == '3':
-                purge_storage_blobs(config)
-            elif choice == '4':
-                list_microphones()
-            elif choice == '5':
-                _test_record_and_playback(config)
-            else:
-                print("Invalid choice. Please try again.")
+
+            # the timeline covers startup and the first option, later options reuse what it loaded
+            with startup_profile.startup_phase(f"option {choice}"):
+                if choice == '1':
+                    quick_diagnostic(config)
+                elif choice == '2':
+                    _confirm_purge(purge_assistants, config)
+                elif choice == '3':
+                    _confirm_purge(purge_storage_blobs, config)
+                elif choice == '4':
+                    list_microphones()
+                elif choice == '5':
+                    _test_record_and_playback(config)
+                elif choice == '6':
+                    benchmark_speech_to_text(config, input("Directory of wav clips: ").strip())
+                elif choice == '7':
+                    latency_report([])
+                elif choice == '8':
+                    benchmark_event_bus()
+                elif choice == '9':
+                    run_mock_server(config, input("Latency profile json (blank for defaults): ").strip() or None)
+                elif choice == '10':
+                    default_scenario = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'simulation', 'scenarios', 'halloween_rush.json')
+                    simulate(config, input(f"Scenario json (blank for {os.path.basename(default_scenario)}): ").strip() or default_scenario)
+                elif choice == '11':
+                    evaluate_costume_classifier(config, input("Captures directory (blank for logs/captures): ").strip() or None)
+                elif choice == '12':
+                    benchmark_visitor_index(config)
+                elif choice == '13':
+                    benchmark_conversation_engines(config, input("Latency profile json (blank for defaults): ").strip() or None)
+                elif choice == '14':
+                    hardware_self_test(config, ask=True)
+                else:
+                    print("Invalid choice. Please try again.")
+            startup_profile.finish_profiling(f"tools option {choice}")
+
+    startup_profile.finish_profiling("tools")
 
 if __name__ == "__main__":
     main()